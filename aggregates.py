@@ -0,0 +1,220 @@
+'''
+Aggregate functions and GROUP BY for SELECT.
+
+    SELECT name, COUNT(*), AVG(price) FROM product WHERE price > 10 GROUP BY name HAVING COUNT(*) > 1;
+
+Every aggregate is computed from partial aggregates: a table, or each chunk of a streamed table, is grouped with one
+vectorized pandas groupby into a partial table with the count, sum, minimum and maximum of each group, partial tables
+are merged by grouping them again, and finish turns the merged table into the result. A table read at once is a
+single chunk, so both paths give the same result.
+
+Missing values are left out of COUNT(column), SUM, AVG, MIN and MAX, which are missing for a group without values,
+and rows with missing group values form one group, like NULL in SQL.
+'''
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from errors import Invalid_Command
+from conditions import condition_operands, is_name
+
+AGGREGATE_FUNCTIONS = {'count', 'sum', 'avg', 'min', 'max'}
+
+# Partial results each aggregate function needs and how partial tables are merged
+PARTS = {'count': ('count',), 'sum': ('sum', 'count'), 'avg': ('sum', 'count'), 'min': ('min',), 'max': ('max',)}
+MERGE = {'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'}
+
+# Name of the group key added to queries without GROUP BY so the whole table is one group
+ALL_ROWS = '__all__'
+
+# Aggregate functions that add values, so they need a column of numbers
+NUMBER_FUNCTIONS = {'sum', 'avg'}
+
+
+def parse_item(item):
+    '''
+    This function parses one item of the SELECT list, which is a column or an aggregate function call.
+
+    Returns: (function or None, column), the column of COUNT(*) is *
+    '''
+    match = re.fullmatch(r'(\w+)\((\*|[\w.]+)\)', item)
+    if match is None:
+        return None, item
+
+    function, column = match.groups()
+    if function not in AGGREGATE_FUNCTIONS:
+        raise Invalid_Command(f'{function} is not a valid aggregate function.\n')
+    if column == '*' and function != 'count':
+        raise Invalid_Command(f'{function.upper()} needs a column.\n')
+
+    return function, column
+
+
+def is_aggregate_query(select_items, group_by, having):
+    '''
+    This function checks if a query computes aggregates.
+
+    Returns: bool
+    '''
+    return bool(group_by) or having is not None or any(parse_item(item)[0] is not None for item in select_items)
+
+
+class Aggregate_Query:
+    '''
+    Aggregates of one query. items are the labels of the SELECT list, calls the (function, column) of every
+    aggregate in the SELECT list, the HAVING condition and order_items (the ORDER BY columns), and group_by the
+    grouping columns. text_columns are the columns that do not hold numbers, which SUM and AVG cannot add.
+    '''
+
+    def __init__(self, select_items, group_by, having, columns, order_items=(), text_columns=()):
+        self.items = select_items
+        self.group_by = group_by
+        self.having = having
+        self.calls = list()
+
+        having_items = [item for item in condition_operands(having) if is_name(item)] if having is not None else list()
+        hidden_items = having_items + list(order_items)
+        for item in select_items + hidden_items:
+            function, column = parse_item(item)
+            if function is None:
+                continue
+            if column != '*' and column not in columns:
+                raise Invalid_Command(f'Column {column} not found.\n')
+            if function in NUMBER_FUNCTIONS and column in text_columns:
+                raise Invalid_Command(f'{function.upper()} needs a number column, {column} is not one.\n')
+            if (function, column) not in self.calls:
+                self.calls.append((function, column))
+
+        for column in group_by:
+            if column not in columns:
+                raise Invalid_Command(f'Column {column} not found.\n')
+
+        # Columns in the SELECT list, HAVING and ORDER BY are only allowed if they are grouped
+        for item in select_items + having_items + list(order_items):
+            if parse_item(item)[0] is None and item not in group_by:
+                raise Invalid_Command(f'Column {item} must be in GROUP BY or an aggregate function.\n')
+
+    def columns(self):
+        '''
+        This function lists the columns of the table the aggregates read.
+
+        Returns: list of column names
+        '''
+        needed = list(self.group_by)
+        for function, column in self.calls:
+            if column != '*' and column not in needed:
+                needed.append(column)
+
+        return needed
+
+    def partial(self, table_df):
+        '''
+        This function groups a table, or a chunk of a table, into its partial aggregates. Part p of the call
+        (function, column) is stored in the column f'{function}({column}):{p}'.
+
+        Returns: DataFrame with the group columns and the partial aggregates
+        '''
+        keys = self.group_by if self.group_by else [ALL_ROWS]
+        parts = pd.DataFrame({key: table_df[key] for key in self.group_by}, index = table_df.index)
+        if not self.group_by:
+            parts[ALL_ROWS] = 0
+
+        named = dict()
+        for function, column in self.calls:
+            if column == '*':
+                values = pd.Series(1, index = table_df.index)
+            else:
+                values = table_df[column]
+                # Unordered categories have no minimum, their values are compared instead
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    values = values.astype(values.cat.categories.dtype)
+                # Checks the values too, in case the types of the columns were not known when the query was built
+                if function in NUMBER_FUNCTIONS and not pd.api.types.is_numeric_dtype(values):
+                    raise Invalid_Command(f'{function.upper()} needs a number column, {column} is not one.\n')
+
+            for part in PARTS[function]:
+                name = f'{function}({column}):{part}'
+                parts[name] = values
+                named[name] = (name, 'size' if column == '*' and part == 'count' else part)
+
+        grouped = parts.groupby(keys, sort = False, dropna = False, observed = True)
+
+        return grouped.agg(**named).reset_index()
+
+    def merge(self, partials):
+        '''
+        This function merges partial aggregate tables into one.
+
+        Returns: DataFrame with one row per group
+        '''
+        partials = [partial for partial in partials if partial is not None and len(partial) > 0]
+        if len(partials) == 0:
+            return None
+        if len(partials) == 1:
+            return partials[0]
+
+        keys = self.group_by if self.group_by else [ALL_ROWS]
+        named = {column: (column, MERGE[column.rsplit(':', 1)[1]]) for column in partials[0].columns if column not in keys}
+        combined = pd.concat(partials, ignore_index = True)
+
+        return combined.groupby(keys, sort = False, dropna = False, observed = True).agg(**named).reset_index()
+
+    def finish(self, merged):
+        '''
+        This function computes the aggregates from the merged partial table and orders the groups by their group
+        values. The table has a column for every aggregate of the SELECT list and the HAVING condition, so HAVING
+        can be applied to it before the SELECT list is taken.
+
+        Returns: DataFrame
+        '''
+        if merged is None:
+            # Without GROUP BY an empty table is still one group
+            if self.group_by:
+                return pd.DataFrame(columns = self.group_by + [f'{function}({column})' for function, column in self.calls])
+            merged = pd.DataFrame({f'{function}({column}):{part}': [0 if part == 'count' else np.nan]
+                                   for function, column in self.calls for part in PARTS[function]})
+
+        result = pd.DataFrame({key: merged[key] for key in self.group_by})
+        for function, column in self.calls:
+            label = f'{function}({column})'
+            if function == 'count':
+                result[label] = merged[f'{label}:count'].astype('int64')
+            elif function == 'avg':
+                counts = merged[f'{label}:count']
+                result[label] = (merged[f'{label}:sum'] / counts.where(counts > 0)).astype('float64')
+            elif function == 'sum':
+                result[label] = merged[f'{label}:sum'].where(merged[f'{label}:count'] > 0)
+            else:
+                result[label] = merged[f'{label}:{function}']
+
+        if self.group_by:
+            result = result.sort_values(self.group_by, kind = 'stable', na_position = 'last')
+
+        return result.reset_index(drop = True)
+
+
+def aggregate_table(query, table_df):
+    '''
+    This function computes the aggregates of a query on a whole table.
+
+    Returns: DataFrame
+    '''
+    return query.finish(query.merge([query.partial(table_df)]))
+
+
+def aggregate_chunks(query, chunks, merge_every=16):
+    '''
+    This function computes the aggregates of a query from a stream of chunks. Partial tables are merged every
+    merge_every chunks so memory depends on the number of groups and not on the number of chunks.
+
+    Returns: DataFrame
+    '''
+    partials = list()
+    for chunk in chunks:
+        partials.append(query.partial(chunk))
+        if len(partials) >= merge_every:
+            partials = [query.merge(partials)]
+
+    return query.finish(query.merge(partials))
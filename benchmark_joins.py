@@ -0,0 +1,96 @@
+'''
+Compares the join operators in joins.py with the DataFrame.merge path SELECT used before.
+
+Usage: python3 benchmark_joins.py [rows]
+
+Each case joins a table of `rows` rows with a table of rows / 10 rows on an integer key and prints the best
+time of three runs for each algorithm. The right table has one row per key like a table joined on its primary key.
+The skewed case draws the left keys from a Zipf distribution so a few keys match a large share of the rows, and
+the sorted case stores both tables in key order.
+'''
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from joins import hash_join, sort_merge_join, join_tables
+
+
+def make_tables(rows, distribution, rng):
+    '''
+    This function creates the two tables of a benchmark case.
+
+    Returns: (left table, right table)
+    '''
+    right_rows = max(rows // 10, 1)
+
+    right_keys = rng.permutation(right_rows)
+    if distribution == 'skewed':
+        left_keys = (rng.zipf(1.5, rows) - 1) % (2 * right_rows)
+    else:
+        left_keys = rng.integers(0, right_rows, rows)
+
+    if distribution == 'sorted':
+        left_keys = np.sort(left_keys)
+        right_keys = np.sort(right_keys)
+
+    left_df = pd.DataFrame({'l.key': left_keys, 'l.value': rng.random(rows)})
+    right_df = pd.DataFrame({'r.key': right_keys, 'r.value': rng.random(right_rows)})
+
+    return left_df, right_df
+
+
+def best_time(function, repeats=3):
+    '''
+    This function runs a function several times.
+
+    Returns: (fastest time in seconds, result of the last run)
+    '''
+    times = list()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    return min(times), result
+
+
+def run_benchmark(rows):
+    '''
+    This function prints the time of every join algorithm for every case and checks they return the same number of rows.
+
+    Returns: None
+    '''
+    rng = np.random.default_rng(457)
+    algorithms = {
+        'merge': lambda l, r, how: l.merge(r, how=how, left_on='l.key', right_on='r.key'),
+        'hash': lambda l, r, how: hash_join(l, r, 'l.key', 'r.key', how),
+        'sort_merge': lambda l, r, how: sort_merge_join(l, r, 'l.key', 'r.key', how),
+        'chosen': lambda l, r, how: join_tables(l, r, 'l.key', 'r.key', how)
+    }
+
+    print(f'{"case":<10}{"join":<8}' + ''.join(f'{name:>12}' for name in algorithms) + f'{"rows out":>12}')
+
+    for distribution in ('uniform', 'skewed', 'sorted'):
+        left_df, right_df = make_tables(rows, distribution, rng)
+
+        for how in ('inner', 'left', 'outer'):
+            timings = list()
+            row_counts = set()
+            for function in algorithms.values():
+                seconds, result = best_time(lambda: function(left_df, right_df, how))
+                timings.append(seconds)
+                row_counts.add(len(result))
+
+            if len(row_counts) != 1:
+                raise AssertionError(f'Row counts differ for {distribution} {how}: {row_counts}')
+
+            print(f'{distribution:<10}{how:<8}' + ''.join(f'{seconds:>12.4f}' for seconds in timings) + f'{row_counts.pop():>12}')
+
+    return None
+
+
+if __name__ == '__main__':
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,252 @@
+'''
+Client library for the server started with `python manager.py --serve`. It only needs the standard library and
+sql_parser.py.
+
+    pool = Connection_Pool('127.0.0.1:4570', size = 4, database = 'db1')
+    result = pool.execute('select * from flights;')
+    result.columns, result.rows
+
+Each request is one line of JSON, {"sql": "..."}, and each response one line of JSON with the printed output, the
+rows of each table the command returned, the database in use and whether a transaction is open. A connection is
+one session of the server, so it keeps its database, its prepared statements and its open transaction between
+commands.
+
+Statements run many times with different values are prepared once, so the server does not parse them again:
+
+    update = pool.prepare('update flights set status = ? where seat = ?;')
+    update.execute((1, 22))
+'''
+
+import json
+import queue
+import socket
+import threading
+import contextlib
+
+from errors import Invalid_Command
+from sql_parser import literal_text
+
+DEFAULT_ADDRESS = '127.0.0.1:4570'
+
+
+def parse_address(address):
+    '''
+    This function parses a server address, which is host:port or the path of a Unix socket.
+
+    Returns: (socket family, address)
+    '''
+    if '/' in address or ':' not in address:
+        return socket.AF_UNIX, address
+
+    host, port = address.rsplit(':', 1)
+
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+
+class Result:
+    '''
+    Response of the server to one command. tables holds the (columns, rows) of every table the command returned,
+    columns and rows are the ones of the last table.
+    '''
+
+    def __init__(self, response):
+        self.output = response['output']
+        self.database = response['database']
+        self.transaction = response['transaction']
+        self.tables = [(table['columns'], table['rows']) for table in response['results']]
+        self.columns, self.rows = self.tables[-1] if self.tables else (list(), list())
+
+
+class Connection:
+    '''
+    One connection to the server. transaction tells if the last command left a transaction open.
+    '''
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=None):
+        family, server_address = parse_address(address)
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(server_address)
+        self.file = self.socket.makefile('rwb')
+        self.transaction = False
+        self.prepared = dict()
+
+    def execute(self, sql_text):
+        '''
+        This function runs one command on the server.
+
+        Returns: Result, raises Invalid_Command with the message of the server if the command failed
+        '''
+        self.file.write(json.dumps({'sql': sql_text}).encode() + b'\n')
+        self.file.flush()
+
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError('Server closed the connection.')
+        response = json.loads(line)
+
+        self.transaction = response.get('transaction', False)
+        if not response['ok']:
+            raise Invalid_Command(response['error'] + '\n')
+
+        return Result(response)
+
+    def prepare(self, sql_text):
+        '''
+        This function prepares a statement with ? parameters on the server, or reuses it if this connection already
+        prepared the same text.
+
+        Returns: Prepared_Statement
+        '''
+        if sql_text not in self.prepared:
+            name = f'client_{len(self.prepared) + 1}'
+            self.execute(f'prepare {name} as {sql_text}')
+            self.prepared[sql_text] = Prepared_Statement(self, name)
+
+        return self.prepared[sql_text]
+
+    def close(self):
+        '''
+        This function closes the connection. The server rolls back a transaction left open.
+
+        Returns: None
+        '''
+        self.file.close()
+        self.socket.close()
+
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Prepared_Statement:
+    '''
+    Statement prepared on the server by one connection.
+    '''
+
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+
+    def execute(self, params=()):
+        '''
+        This function runs the statement with params, a sequence of Python values, in place of its parameters.
+
+        Returns: Result
+        '''
+        values = ', '.join(literal_text(value) for value in params)
+
+        return self.connection.execute(f'execute {self.name} ({values});')
+
+
+class Pool_Statement:
+    '''
+    Statement of a pool, prepared on each connection of the pool the first time it runs there.
+    '''
+
+    def __init__(self, pool, sql_text):
+        self.pool = pool
+        self.sql_text = sql_text
+
+    def execute(self, params=()):
+        '''
+        This function runs the statement on a connection of the pool with params in place of its parameters.
+
+        Returns: Result
+        '''
+        with self.pool.connection() as connection:
+            return connection.prepare(self.sql_text).execute(params)
+
+
+class Connection_Pool:
+    '''
+    Pool of at most size connections shared by the threads of a program. Connections are opened when needed and
+    kept open for the next command, and each new connection runs USE database first if database is given.
+    '''
+
+    def __init__(self, address=DEFAULT_ADDRESS, size=4, database=None, timeout=None):
+        self.address = address
+        self.database = database
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def open(self):
+        '''
+        This function opens a new connection of the pool.
+
+        Returns: Connection
+        '''
+        connection = Connection(self.address, self.timeout)
+        if self.database is not None:
+            connection.execute(f'use {self.database};')
+
+        return connection
+
+    @contextlib.contextmanager
+    def connection(self):
+        '''
+        This function lends a connection for a group of commands, such as a transaction, waiting if all connections
+        are in use. A transaction left open is rolled back when the connection is given back, and a connection that
+        failed is closed instead of being reused.
+
+        Returns: context manager giving a Connection
+        '''
+        self.slots.acquire()
+        connection = None
+        try:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                connection = self.open()
+
+            yield connection
+
+            if connection.transaction:
+                connection.execute('rollback;')
+            self.idle.put(connection)
+        except (OSError, ValueError):
+            if connection is not None:
+                connection.close()
+            raise
+        except BaseException:
+            if connection is not None:
+                if connection.transaction:
+                    connection.execute('rollback;')
+                self.idle.put(connection)
+            raise
+        finally:
+            self.slots.release()
+
+    def execute(self, sql_text):
+        '''
+        This function runs one command on a connection of the pool.
+
+        Returns: Result
+        '''
+        with self.connection() as connection:
+            return connection.execute(sql_text)
+
+    def prepare(self, sql_text):
+        '''
+        This function prepares a statement with ? parameters for the connections of the pool.
+
+        Returns: Pool_Statement
+        '''
+        return Pool_Statement(self, sql_text)
+
+    def close(self):
+        '''
+        This function closes the idle connections of the pool.
+
+        Returns: None
+        '''
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return None
@@ -0,0 +1,559 @@
+'''
+Evaluation of WHERE and HAVING conditions.
+
+    SELECT * FROM flights WHERE (status = 0 OR status IS NULL) AND seat BETWEEN 10 AND 20 AND name NOT LIKE 'A%';
+
+The parser gives a condition as a tree of tuples: ('compare', left, operator, right), ('and', condition, ...),
+('or', condition, ...), ('not', condition), ('in', operand, values), ('between', operand, low, high),
+('null', operand) and ('like', operand, pattern), where operands are written as in the statement. compile_condition
+checks the tree against the columns of a table, converts the values once and pushes NOT down to the predicates, so a
+missing value never matches, like NULL in SQL. condition_mask then computes one boolean NumPy mask for the whole tree.
+
+AND evaluates its conditions in turn, and once the rows still matching are fewer than SQL_SUBSET_FRACTION (a quarter
+by default) of the rows, the next conditions are only evaluated on those rows and none at all once no row is left.
+OR does the same with the rows not matched yet. A comparison on an indexed column is looked up in the index first, and
+the other conditions of an AND are only evaluated on the rows it finds. If the table was analyzed, the cost model in
+table_stats.py picks the comparison finding the fewest rows and scans the table instead if that is cheaper. Large
+tables are split into chunks evaluated in parallel (see parallel.py). Conditions made only of comparisons of number
+columns are evaluated with numexpr, the engine of pandas.eval, if it is installed: it computes the whole mask in one
+pass over the columns on all cores without the temporary arrays of each comparison.
+'''
+
+import os
+import re
+import operator
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+
+from errors import Invalid_Command
+from indexes import index_lookup, usable_index, load_registry
+from table_stats import load_stats, column_map, order_lookups
+from parallel import parallel_mask
+from explain import plan_operator
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+# AND and OR only evaluate their next conditions on the rows left once fewer than this fraction of the rows is left
+SUBSET_FRACTION = float(os.environ.get('SQL_SUBSET_FRACTION', 0.25))
+
+# Tables with fewer rows are not evaluated with numexpr, which costs more to start than it saves
+NUMEXPR_MIN_ROWS = int(os.environ.get('SQL_NUMEXPR_MIN_ROWS', 100000))
+
+OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+# Comparison matching the rows the comparison does not match, and the same comparison with its operands swapped
+NEGATED = {'=': '!=', '!=': '=', '<': '>=', '<=': '>', '>': '<=', '>=': '<'}
+SWAPPED = {'=': '=', '!=': '!=', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+NUMBER = re.compile(r'-?(?:\d+\.?\d*|\.\d+)')
+IDENTIFIER = re.compile(r'[a-z_][\w.]*(?:\(.*\))?')
+
+
+def literal_value(text):
+    '''
+    This function converts a value written in a condition to a string, int or float. Unquoted words are kept as
+    strings.
+
+    Returns: value
+    '''
+    if text.startswith("'"):
+        return text[1:-1].replace("''", "'")
+    if NUMBER.fullmatch(text):
+        return float(text) if '.' in text else int(text)
+
+    return text
+
+
+def is_name(operand):
+    '''
+    This function checks if an operand is written as a name, which is a column if the table has it.
+
+    Returns: bool
+    '''
+    return isinstance(operand, str) and IDENTIFIER.fullmatch(operand) is not None
+
+
+def condition_operands(condition):
+    '''
+    This function lists every operand of a condition.
+
+    Returns: list of operands
+    '''
+    kind = condition[0]
+    if kind in ('and', 'or', 'not'):
+        return [operand for child in condition[1:] for operand in condition_operands(child)]
+    if kind == 'in':
+        return [condition[1]] + list(condition[2])
+
+    return list(condition[1:])
+
+
+def condition_subjects(condition):
+    '''
+    This function lists the operands a condition is about, which must be columns: the first operand of each
+    predicate, or the second operand of a comparison whose first operand is a value.
+
+    Returns: list of names
+    '''
+    kind = condition[0]
+    if kind in ('and', 'or', 'not'):
+        return [subject for child in condition[1:] for subject in condition_subjects(child)]
+    if kind == 'compare' and not is_name(condition[1]):
+        return [condition[3]] if is_name(condition[3]) else list()
+
+    return [condition[1]] if is_name(condition[1]) else list()
+
+
+def conjuncts(condition):
+    '''
+    This function splits a condition into the conditions of its top AND.
+
+    Returns: list of conditions
+    '''
+    if condition is None:
+        return list()
+    if condition[0] == 'and':
+        return list(condition[1:])
+
+    return [condition]
+
+
+def conjoin(conditions):
+    '''
+    This function joins conditions with AND.
+
+    Returns: condition or None if there are none
+    '''
+    if len(conditions) == 0:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+
+    return ('and',) + tuple(conditions)
+
+
+def condition_text(condition):
+    '''
+    This function writes a condition tree as the text of a condition, with parentheses around the conditions of an
+    AND that are an OR.
+
+    Returns: condition text
+    '''
+    kind = condition[0]
+
+    if kind in ('and', 'or'):
+        parts = [condition_text(child) for child in condition[1:]]
+        if kind == 'and':
+            parts = [f'({part})' if child[0] == 'or' else part for part, child in zip(parts, condition[1:])]
+        return f' {kind} '.join(parts)
+
+    if kind == 'not':
+        child = condition[1]
+        if child[0] == 'null':
+            return f'{child[1]} is not null'
+        if child[0] in ('in', 'between', 'like'):
+            return condition_text(child).replace(f' {child[0]} ', f' not {child[0]} ', 1)
+        return f'not ({condition_text(child)})'
+
+    if kind == 'compare':
+        return f'{condition[1]} {condition[2]} {condition[3]}'
+    if kind == 'in':
+        return f'{condition[1]} in ({", ".join(condition[2])})'
+    if kind == 'between':
+        return f'{condition[1]} between {condition[2]} and {condition[3]}'
+    if kind == 'null':
+        return f'{condition[1]} is null'
+
+    return f'{condition[1]} like {condition[2]}'
+
+
+def resolve(operand, columns, subject):
+    '''
+    This function finds if an operand is a column or a value. A name that is not a column is an error for the
+    subject of a predicate and a value written without quotes otherwise.
+
+    Returns: ('column', name) or ('value', value)
+    '''
+    if operand in columns:
+        return ('column', operand)
+    if subject and is_name(operand):
+        raise Invalid_Command(f'Column {operand} not found.\n')
+
+    return ('value', literal_value(operand))
+
+
+def compile_condition(condition, columns, negated=False):
+    '''
+    This function checks a condition against the columns of a table and converts it to the tree condition_mask
+    evaluates, with the values converted and NOT pushed down to the predicates.
+
+        ('compare', column, operator, value)     ('columns', column, operator, column)    ('constant', bool)
+        ('and', ...)    ('or', ...)    ('in', column, values, negated)    ('null', column, negated)
+        ('like', column, pattern, negated)
+
+    Returns: compiled condition
+    '''
+    kind = condition[0]
+
+    if kind == 'not':
+        return compile_condition(condition[1], columns, not negated)
+
+    if kind in ('and', 'or'):
+        children = tuple(compile_condition(child, columns, negated) for child in condition[1:])
+        # NOT (a AND b) is NOT a OR NOT b
+        return (('or' if kind == 'and' else 'and') if negated else kind,) + children
+
+    if kind == 'compare':
+        left, comparison, right = condition[1:]
+        left = resolve(left, columns, subject = True)
+        right = resolve(right, columns, subject = left[0] == 'value')
+        if negated:
+            comparison = NEGATED[comparison]
+        if left[0] == 'value' and right[0] == 'value':
+            try:
+                return ('constant', bool(OPERATORS[comparison](left[1], right[1])))
+            except TypeError:
+                return ('constant', False)
+        if left[0] == 'value':
+            left, right, comparison = right, left, SWAPPED[comparison]
+        if right[0] == 'column':
+            return ('columns', left[1], comparison, right[1])
+        return ('compare', left[1], comparison, right[1])
+
+    column = resolve(condition[1], columns, subject = True)
+    if column[0] != 'column':
+        raise Invalid_Command(f'{kind.upper()} needs a column.\n')
+    column = column[1]
+
+    if kind == 'between':
+        low, high = literal_value(condition[2]), literal_value(condition[3])
+        if negated:
+            return ('or', ('compare', column, '<', low), ('compare', column, '>', high))
+        return ('and', ('compare', column, '>=', low), ('compare', column, '<=', high))
+
+    if kind == 'in':
+        return ('in', column, tuple(literal_value(value) for value in condition[2]), negated)
+
+    if kind == 'null':
+        return ('null', column, negated)
+
+    if kind == 'like':
+        return ('like', column, literal_value(condition[2]), negated)
+
+    raise Invalid_Command('Condition is invalid.\n')
+
+
+def category_mask(series, function):
+    '''
+    This function applies function to the distinct categories of a categorical column and looks up the result of
+    each row by its code. Missing values never match.
+
+    Returns: boolean array
+    '''
+    category_matches = np.asarray(function(series.cat.categories.to_series()), dtype = bool)
+
+    # Code -1 is a missing value which never matches
+    return np.append(category_matches, False)[series.cat.codes.to_numpy()]
+
+
+def compare_column(series, comparison_function, value):
+    '''
+    This function compares every value of a column to a single value.
+    For categorical columns only the distinct categories are compared and the result is looked up by code.
+
+    Returns: boolean series or array
+    '''
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return category_mask(series, lambda categories: comparison_function(categories, value))
+
+    return comparison_function(series, value)
+
+
+def like_function(pattern):
+    '''
+    This function converts a LIKE pattern, where % matches any text and _ any one character, to a function matching a
+    Series of strings. Patterns only using % at their ends use startswith, endswith or contains instead of a regex.
+
+    Returns: function(Series) -> boolean Series
+    '''
+    pattern = str(pattern)
+    if '_' not in pattern:
+        inner = pattern.strip('%')
+        if '%' not in inner:
+            if pattern.startswith('%') and pattern.endswith('%') and len(pattern) > 1:
+                return lambda strings: strings.str.contains(inner, regex = False)
+            if pattern.endswith('%'):
+                return lambda strings: strings.str.startswith(inner)
+            if pattern.startswith('%'):
+                return lambda strings: strings.str.endswith(inner)
+            return lambda strings: strings == inner
+
+    regex = ''.join('.*' if char == '%' else '.' if char == '_' else re.escape(char) for char in pattern)
+
+    return lambda strings: strings.str.fullmatch(regex, flags = re.DOTALL)
+
+
+def predicate_mask(condition, table_df, positions):
+    '''
+    This function evaluates a comparison or other predicate on the rows at positions, or on every row.
+
+    Returns: boolean array
+    '''
+    kind = condition[0]
+
+    if kind == 'constant':
+        return np.full(len(table_df) if positions is None else len(positions), condition[1])
+
+    series = table_df[condition[1]]
+    if positions is not None:
+        series = series.iloc[positions]
+    present = series.notna().to_numpy()
+
+    if kind == 'null':
+        return present if condition[2] else ~present
+
+    try:
+        if kind == 'compare':
+            matches = compare_column(series, OPERATORS[condition[2]], condition[3])
+        elif kind == 'columns':
+            other = table_df[condition[3]]
+            if positions is not None:
+                other = other.iloc[positions]
+            matches = OPERATORS[condition[2]](series, other)
+            present = present & other.notna().to_numpy()
+        elif kind == 'in':
+            matches = series.isin(condition[2])
+        else:
+            function = like_function(condition[2])
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                matches = category_mask(series, lambda categories: function(categories.astype(str)))
+            else:
+                matches = function(series if pd.api.types.is_string_dtype(series.dtype) else series.astype(str))
+    except TypeError:
+        other = condition[3] if kind in ('compare', 'columns') else condition[2]
+        raise Invalid_Command(f'Column {condition[1]} cannot be compared with {other}.\n')
+
+    if isinstance(matches, pd.Series):
+        matches = matches.fillna(False).to_numpy(dtype = bool)
+    else:
+        matches = np.asarray(matches, dtype = bool)
+    if kind in ('in', 'like') and condition[3]:
+        matches = ~matches
+
+    # Missing values never match, so != and NOT are false for them too
+    return matches & present
+
+
+def evaluate(condition, table_df, positions=None):
+    '''
+    This function evaluates a compiled condition on the rows at positions, or on every row of table_df.
+
+    Returns: boolean array with one value per row evaluated
+    '''
+    kind = condition[0]
+    if kind not in ('and', 'or'):
+        return predicate_mask(condition, table_df, positions)
+
+    if positions is None and numexpr_applies(condition, table_df):
+        return numexpr_mask(condition, table_df)
+
+    # AND keeps the rows every condition matches and OR the rows any condition matches
+    matching = kind == 'and'
+    mask = np.full(len(table_df) if positions is None else len(positions), matching)
+
+    for child in condition[1:]:
+        undecided = mask if matching else ~mask
+        left = int(undecided.sum())
+        if left == 0:
+            break
+
+        if left < len(mask) * SUBSET_FRACTION:
+            # Only evaluates the rows whose result is not decided yet
+            rows = np.flatnonzero(undecided)
+            child_mask = evaluate(child, table_df, rows if positions is None else positions[rows])
+            mask[rows] = child_mask
+        elif matching:
+            mask &= evaluate(child, table_df, positions)
+        else:
+            mask |= evaluate(child, table_df, positions)
+
+    return mask
+
+
+def numexpr_applies(condition, table_df):
+    '''
+    This function checks if numexpr can evaluate a compiled condition: it is installed, the table is large enough and
+    the condition only compares number columns with numbers or other number columns.
+
+    Returns: bool
+    '''
+    if numexpr is None or len(table_df) < NUMEXPR_MIN_ROWS:
+        return False
+
+    def numeric(column):
+        dtype = table_df[column].dtype
+        return pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype) \
+            and not isinstance(dtype, pd.CategoricalDtype)
+
+    def check(node):
+        kind = node[0]
+        if kind in ('and', 'or'):
+            return all(check(child) for child in node[1:])
+        if kind == 'compare':
+            value = node[3]
+            return numeric(node[1]) and isinstance(value, (int, float)) and not isinstance(value, bool)
+        if kind == 'columns':
+            return numeric(node[1]) and numeric(node[3])
+        return False
+
+    return check(condition)
+
+
+def numexpr_mask(condition, table_df):
+    '''
+    This function evaluates a compiled condition on every row with numexpr.
+
+    Returns: boolean array
+    '''
+    arrays = dict()
+
+    def variable(column):
+        if column not in arrays:
+            series = table_df[column]
+            if isinstance(series.dtype, np.dtype):
+                arrays[column] = series.to_numpy()
+            else:
+                # Nullable columns have no NumPy type, their missing values become NaN
+                arrays[column] = series.to_numpy(dtype = np.float64, na_value = np.nan)
+        return f'c{list(arrays).index(column)}'
+
+    def text(node):
+        kind = node[0]
+        if kind in ('and', 'or'):
+            return '(' + (' & ' if kind == 'and' else ' | ').join(text(child) for child in node[1:]) + ')'
+
+        comparison = '==' if node[2] == '=' else node[2]
+        left = variable(node[1])
+        right = variable(node[3]) if kind == 'columns' else repr(node[3])
+        expression = f'({left} {comparison} {right})'
+
+        # NaN is not equal to itself, so x == x leaves out missing values, which != would match
+        if comparison == '!=':
+            expression = f'({expression} & ({left} == {left})'
+            expression += f' & ({right} == {right}))' if kind == 'columns' else ')'
+        return expression
+
+    expression = text(condition)
+
+    return numexpr.evaluate(expression, local_dict = {f'c{i}': array for i, array in enumerate(arrays.values())})
+
+
+def index_comparisons(condition, table_path, row_count=None):
+    '''
+    This function finds the comparisons of a compiled condition, or of the AND it is, that an index of the table can
+    look up. Without statistics of the table they are tried in the order of the condition. With statistics only the
+    ones cheaper than scanning the table are kept, cheapest first (see order_lookups). row_count is the number of rows
+    of the table if it was read.
+
+    Returns: (conditions of the AND, positions of the comparisons to try in them)
+    '''
+    children = list(condition[1:]) if condition[0] == 'and' else [condition]
+    registry = load_registry(table_path)
+    found = [i for i, child in enumerate(children)
+             if child[0] == 'compare' and usable_index(table_path, child[1], child[2], child[3], registry) is not None]
+
+    stats = load_stats(table_path) if found else None
+    if stats is not None:
+        rows = stats['rows'] if row_count is None else row_count
+        found = [found[i] for i in order_lookups([children[i] for i in found], len(children), column_map(stats), rows)]
+
+    return children, found
+
+
+def index_positions(condition, table_df, table_path):
+    '''
+    This function finds the rows matching a compiled condition with an index, if the condition is a comparison of an
+    indexed column or an AND with one.
+
+    Returns: (sorted row positions, comparison looked up, condition still to evaluate on them or None), or None if
+    no index can be used
+    '''
+    children, found = index_comparisons(condition, table_path, len(table_df))
+
+    for i in found:
+        child = children[i]
+        positions = index_lookup(table_path, child[1], child[2], child[3], len(table_df))
+        if positions is not None:
+            return np.sort(np.asarray(positions, dtype = np.int64)), child, conjoin(children[:i] + children[i+1:])
+
+    return None
+
+
+def lookup_detail(comparison):
+    '''
+    This function describes the comparison an Index Lookup operator of a query plan looks up.
+
+    Returns: string
+    '''
+    return f'on {comparison[1]} {comparison[2]} {comparison[3]!r}'
+
+
+def planned_index(condition, columns, table_path):
+    '''
+    This function finds the index condition_mask would use for a condition on a table, without reading the table.
+
+    Returns: (index name, comparison looked up, condition still to evaluate or None), or None if no index can be used
+    '''
+    children, found = index_comparisons(compile_condition(condition, columns), table_path)
+
+    for i in found:
+        child = children[i]
+        return usable_index(table_path, child[1], child[2], child[3])[0], child, conjoin(children[:i] + children[i+1:])
+
+    return None
+
+
+def condition_mask(condition, table_df, table_path=None, operator=None):
+    '''
+    This function finds the rows of a table matching a condition. If table_path is given, table_df holds every row
+    of that table and comparisons on an indexed column use the index. operator is the Filter operator of the query
+    plan (see explain.py), which gets an Index Lookup operator as its input if the index is used.
+
+    Returns: boolean array
+    '''
+    compiled = compile_condition(condition, table_df.columns)
+
+    if table_path is not None:
+        lookup = None if operator is None else plan_operator('Index Lookup', inputs = operator.inputs, last = False)
+        with nullcontext() if lookup is None else lookup.measure():
+            found = index_positions(compiled, table_df, table_path)
+
+        if found is not None:
+            positions, comparison, rest = found
+            if lookup is not None:
+                lookup.detail = lookup_detail(comparison)
+                lookup.count(rows_out = len(positions))
+                operator.inputs = [lookup]
+            if rest is not None and len(positions) > 0:
+                positions = positions[evaluate(rest, table_df, positions)]
+            mask = np.zeros(len(table_df), dtype = bool)
+            mask[positions] = True
+            return mask
+
+    # numexpr uses every core itself, other conditions evaluate chunks of rows in parallel
+    if numexpr_applies(compiled, table_df):
+        return numexpr_mask(compiled, table_df)
+
+    return parallel_mask(lambda start, stop: evaluate(compiled, table_df.iloc[start:stop]), len(table_df))
@@ -0,0 +1,7 @@
+'''
+Exceptions shared by the SQL command modules
+'''
+
+class Invalid_Command(Exception):
+    '''Exception for when a command is invalid'''
+    pass
@@ -0,0 +1,270 @@
+'''
+EXPLAIN and EXPLAIN ANALYZE for SELECT.
+
+    EXPLAIN SELECT * FROM flights f, seats s WHERE f.seat = s.seat AND s.row < 10;
+    EXPLAIN ANALYZE SELECT status, COUNT(*) FROM flights GROUP BY status;
+
+A plan is a tree of Operator objects, each with the operators whose rows it reads as its inputs. EXPLAIN prints the
+plan select_plan in sql_commands.py builds from the statement, the table files and their indexes without reading any
+rows, with the rows each operator is expected to give if the tables were analyzed (see table_stats.py). EXPLAIN
+ANALYZE runs the query with a Query_Profile active in its thread and discards the rows it prints: select_command adds
+an operator for each step it takes, so the plan shows what the query really did, such as the join algorithm picked for
+the tables, and each operator measures while it runs
+
+* time: the wall time spent in the operator, not counting the operators it calls, such as the scan of a streamed table
+  run by the operators reading its chunks,
+* rows in and out: the rows the operator reads and produces, rows in being the rows out of its inputs unless it
+  counts them itself or has no inputs, like a scan,
+* bytes read: the bytes of table files read from disk, 0 for a table found in the table cache,
+* peak memory: the most memory allocated above the level at the start of the operator while it runs, traced with
+  tracemalloc.
+
+Tracing memory slows down code that creates many Python objects, so EXPLAIN ANALYZE can take longer than the query.
+'''
+
+import time
+import threading
+import contextlib
+import tracemalloc
+
+# Profile of the query explained in this thread
+profiles = threading.local()
+
+
+class Operator:
+    '''
+    One step of a query plan. name is the kind of step (such as Scan or Hash Join), detail what it works on and inputs
+    the operators whose rows it reads. seconds, rows_in, rows_out, bytes_read and peak_memory are measured while the
+    query runs if the operator belongs to a Query_Profile, rows_in is None until the operator counts the rows it reads.
+    estimate is the number of rows the planner expects the operator to give, None if it has no statistics.
+    '''
+
+    def __init__(self, name, detail='', inputs=()):
+        self.name = name
+        self.detail = detail
+        self.inputs = list(inputs)
+        self.estimate = None
+        self.profile = None
+        self.seconds = 0.0
+        self.rows_in = None
+        self.rows_out = 0
+        self.bytes_read = 0
+        self.peak_memory = 0
+        self.started = None
+        self.base_memory = 0
+
+    def count(self, rows_out=0, bytes_read=0, rows_in=None):
+        '''
+        This function adds to the rows and bytes the operator read and produced.
+
+        Returns: None
+        '''
+        if rows_in is not None:
+            self.rows_in = (self.rows_in or 0) + rows_in
+        self.rows_out += rows_out
+        self.bytes_read += bytes_read
+
+        return None
+
+    @contextlib.contextmanager
+    def measure(self):
+        '''
+        This function measures the time and memory of the code run inside it as part of the operator. An operator
+        can be measured many times, such as once per chunk of a streamed table, and its measures add up.
+
+        Returns: context manager
+        '''
+        if self.profile is None:
+            yield self
+            return
+
+        self.profile.enter(self)
+        try:
+            yield self
+        finally:
+            self.profile.leave(self)
+
+    def rows_read(self):
+        '''
+        This function gets the rows the operator read, counted by the operator or else produced by its inputs. An
+        operator without inputs, such as a scan, reads the rows it produces.
+
+        Returns: number of rows
+        '''
+        if self.rows_in is not None:
+            return self.rows_in
+        if not self.inputs:
+            return self.rows_out
+
+        return sum(operator.rows_out for operator in self.inputs)
+
+
+class Query_Profile:
+    '''
+    Operators of one query run by EXPLAIN ANALYZE. last is the last operator of the query so far, which is the input of
+    the next one, and running the stack of operators being measured, the innermost last.
+    '''
+
+    def __init__(self, trace_memory=True):
+        self.operators = list()
+        self.last = None
+        self.running = list()
+        self.trace_memory = trace_memory
+
+    def add(self, name, detail='', inputs=None, last=True):
+        '''
+        This function adds an operator to the query. Without inputs it reads the rows of the last operator. Unless
+        last is False, such as for an operator added below one already in the plan, it becomes the last operator.
+
+        Returns: Operator
+        '''
+        if inputs is None:
+            inputs = () if self.last is None else [self.last]
+
+        operator = Operator(name, detail, inputs)
+        operator.profile = self
+        if last:
+            self.last = operator
+        self.operators.append(operator)
+
+        return operator
+
+    def enter(self, operator):
+        '''
+        This function starts measuring an operator, pausing the operator measured around it.
+
+        Returns: None
+        '''
+        now = time.perf_counter()
+        if self.running:
+            self.pause(self.running[-1], now)
+
+        self.start(operator, now)
+        operator.base_memory = tracemalloc.get_traced_memory()[0] if self.trace_memory else 0
+        self.running.append(operator)
+
+        return None
+
+    def leave(self, operator):
+        '''
+        This function stops measuring an operator and resumes the operator measured around it.
+
+        Returns: None
+        '''
+        now = time.perf_counter()
+        self.pause(operator, now)
+        self.running.pop()
+
+        if self.running:
+            self.start(self.running[-1], now)
+
+        return None
+
+    def start(self, operator, now):
+        '''
+        This function starts the clock and the memory peak of an operator.
+
+        Returns: None
+        '''
+        operator.started = now
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+        return None
+
+    def pause(self, operator, now):
+        '''
+        This function adds the time since an operator started to its time and records its memory peak.
+
+        Returns: None
+        '''
+        operator.seconds += now - operator.started
+        if self.trace_memory:
+            operator.peak_memory = max(operator.peak_memory, tracemalloc.get_traced_memory()[1] - operator.base_memory)
+
+        return None
+
+
+def current_profile():
+    '''
+    This function gets the profile of the query explained in this thread.
+
+    Returns: Query_Profile or None if the query is not explained
+    '''
+    return getattr(profiles, 'profile', None)
+
+
+def plan_operator(name, detail='', inputs=None, last=True):
+    '''
+    This function adds an operator to the query running in this thread (see Query_Profile.add). Queries that are
+    not explained get an operator that is not recorded and measures nothing, so commands can add operators without
+    checking.
+
+    Returns: Operator
+    '''
+    profile = current_profile()
+    if profile is None:
+        return Operator(name, detail, inputs or ())
+
+    return profile.add(name, detail, inputs, last)
+
+
+@contextlib.contextmanager
+def profiled(profile):
+    '''
+    This function makes profile the profile of the queries run inside it in this thread, tracing memory while it
+    is active if the profile measures memory.
+
+    Returns: context manager
+    '''
+    started_tracing = profile.trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+
+    profiles.profile = profile
+    try:
+        yield profile
+    finally:
+        profiles.profile = None
+        if started_tracing:
+            tracemalloc.stop()
+
+
+def format_size(size):
+    '''
+    This function writes a number of bytes with a unit.
+
+    Returns: string
+    '''
+    for unit in ('B', 'kB', 'MB'):
+        if size < 1024:
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+
+    return f'{size:.1f} GB'
+
+
+def format_plan(operator, analyze=False):
+    '''
+    This function writes a plan as an indented tree, the output of the query first and each operator above its
+    inputs. With analyze every operator also shows its measures, and otherwise the rows it is expected to give.
+
+    Returns: list of lines
+    '''
+    lines = list()
+
+    def visit(node, depth):
+        text = f'{node.name} {node.detail}'.strip()
+        if not analyze and node.estimate is not None:
+            text += f' (estimated rows={node.estimate})'
+        if analyze:
+            text += (f' (time={node.seconds * 1000:.3f} ms, rows in={node.rows_read()}, rows out={node.rows_out}, '
+                     f'bytes read={format_size(node.bytes_read)}, peak memory={format_size(max(node.peak_memory, 0))})')
+        lines.append(('  ' * (depth - 1) + '-> ' if depth else '') + text)
+
+        for child in node.inputs:
+            visit(child, depth + 1)
+
+    visit(operator, 0)
+
+    return lines
@@ -0,0 +1,751 @@
+'''
+Secondary indexes on table columns.
+An index is created with CREATE INDEX index_name ON table_name(column_name) and stored next to the table:
+
+* {table}_indexes.json lists the indexes of the table with their column, the number of rows of the table and the
+  stamp of the table files the indexes match.
+* {table}_{index}_index.npz holds the non-missing values of the column in ascending order and the row position of each value.
+* {table}_{index}_index_delta.csv holds the entries of rows inserted since the .npz file was written. They are merged
+  into the .npz file once there are more than INDEX_DELTA_ROWS of them.
+
+Equality and range conditions on an indexed column find their rows by binary search instead of comparing every row.
+Columns declared PRIMARY KEY or UNIQUE get a unique index. Rows are checked against a hash set of its keys that is
+built from the index file the first time it is needed in a process, so each inserted row is checked in constant time.
+INSERT, UPDATE and DELETE keep the indexes of a table up to date. If the table is changed any other way, for example
+by committing a transaction, its stamp no longer matches and the index is rebuilt the next time it is used.
+'''
+
+import os
+import json
+import operator
+
+import numpy as np
+import pandas as pd
+
+from errors import Invalid_Command
+from table_cache import file_stamp
+from schema import parse_type, schema_file, load_schema, INTEGER_TYPES, FLOAT_TYPES
+from storage import read_table, read_columns, storage_for, unlock_file, write_csv_rows
+
+# Number of inserted entries kept in the delta file of an index before it is merged into the .npz file
+INDEX_DELTA_ROWS = int(os.environ.get('SQL_INDEX_DELTA_ROWS', 4096))
+
+# Comparisons that can be answered with an index
+INDEX_COMPARISONS = {
+    '=': operator.eq,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+class Column_Index:
+    '''
+    Sorted index of one column. keys holds the non-missing values of the column in ascending order and positions
+    holds the row of the table each key comes from. Entries added since the index was sorted are kept in
+    delta_keys and delta_positions and compared one by one.
+    '''
+
+    def __init__(self, keys, positions, delta_keys=None, delta_positions=None):
+        self.keys = keys
+        self.positions = positions
+        self.delta_keys = keys[:0] if delta_keys is None else delta_keys
+        self.delta_positions = positions[:0] if delta_positions is None else delta_positions
+
+    def lookup(self, comparison, value):
+        '''
+        This function finds the rows where the column compares true to the value with a binary search of the sorted keys.
+
+        Returns: array of row positions
+        '''
+        first = np.searchsorted(self.keys, value, side='left')
+        last = np.searchsorted(self.keys, value, side='right')
+        bounds = {
+            '=': (first, last),
+            '<': (0, first),
+            '<=': (0, last),
+            '>': (last, len(self.keys)),
+            '>=': (first, len(self.keys))
+        }
+        start, end = bounds[comparison]
+        delta_matches = INDEX_COMPARISONS[comparison](self.delta_keys, value)
+
+        return np.concatenate((self.positions[start:end], self.delta_positions[delta_matches]))
+
+    def merged(self):
+        '''
+        This function sorts the delta entries into the keys.
+
+        Returns: Column_Index without delta entries
+        '''
+        if len(self.delta_keys) == 0:
+            return self
+
+        keys = np.concatenate((self.keys, self.delta_keys))
+        positions = np.concatenate((self.positions, self.delta_positions))
+        order = np.argsort(keys, kind='stable')
+
+        return Column_Index(keys[order], positions[order])
+
+
+# Sorted keys loaded in this process by index file path: (stamp of the .npz file, Column_Index)
+loaded_indexes = dict()
+
+# Keys of unique indexes loaded in this process by index file path: (table stamp, set of keys)
+key_sets = dict()
+
+
+def registry_file(table_path):
+    '''
+    This function builds the path of the file listing the indexes of a table. Lock files share the registry of their table.
+
+    Returns: registry path
+    '''
+    root = os.path.splitext(unlock_file(table_path))[0]
+
+    return f'{root}_indexes.json'
+
+
+def index_file(table_path, index_name):
+    '''
+    This function builds the path of the sorted keys of an index.
+
+    Returns: index path
+    '''
+    root = os.path.splitext(unlock_file(table_path))[0]
+
+    return f'{root}_{index_name}_index.npz'
+
+
+def delta_file(index_path):
+    '''
+    This function builds the path of the entries inserted since an index was sorted.
+
+    Returns: delta path
+    '''
+    return index_path[:-len('.npz')] + '_delta.csv'
+
+
+def load_registry(table_path):
+    '''
+    This function reads the indexes of a table.
+
+    Returns: dictionary of index name to index details, empty if the table has no indexes
+    '''
+    path = registry_file(table_path)
+    if not os.path.isfile(path):
+        return dict()
+
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_registry(table_path, registry):
+    '''
+    This function saves the indexes of a table, removing the file if there are none.
+
+    Returns: None
+    '''
+    path = registry_file(table_path)
+    if not registry:
+        if os.path.isfile(path):
+            os.remove(path)
+        return None
+
+    with open(path, 'w') as f:
+        json.dump(registry, f)
+
+    return None
+
+
+def table_stamp(table_path):
+    '''
+    This function gets the stamp of the files of a table as a string that can be saved in the registry.
+
+    Returns: string
+    '''
+    return repr(storage_for(table_path).stamp(table_path))
+
+
+def key_kind(table_path, column, series):
+    '''
+    This function decides how the keys of a column are stored. Columns with a numeric schema type are stored as
+    float64 numbers and all others as strings. Columns without a schema type use the type of their values.
+
+    Returns: 'number' or 'string'
+    '''
+    schema_path = schema_file(table_path)
+    column_type = load_schema(schema_path).get(column) if os.path.isfile(schema_path) else None
+
+    if column_type:
+        base_type = parse_type(column_type)[0]
+        return 'number' if base_type in INTEGER_TYPES | FLOAT_TYPES else 'string'
+
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return 'number'
+
+    return 'string'
+
+
+def index_keys(values, kind):
+    '''
+    This function converts column values to index keys, leaving out missing values.
+
+    Returns: (keys, positions of the values that were kept)
+    '''
+    # Converts the few values of inserted rows without building a Series
+    if isinstance(values, list):
+        positions = [i for i, value in enumerate(values) if value is not None and value == value]
+        if kind == 'number':
+            keys = np.array([float(values[i]) for i in positions], dtype='float64')
+        else:
+            keys = np.array([str(values[i]) for i in positions], dtype=str)
+        return keys, np.array(positions, dtype=np.int64)
+
+    values = pd.Series(values).reset_index(drop=True)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype(object)
+
+    valid = values.notna().to_numpy()
+    positions = np.flatnonzero(valid)
+
+    if kind == 'number':
+        keys = pd.to_numeric(values[valid]).to_numpy(dtype='float64')
+    else:
+        keys = values[valid].astype(str).to_numpy(dtype=str)
+
+    return keys, positions
+
+
+def build_index(table_df, column, kind):
+    '''
+    This function sorts the values of a column into a new index.
+
+    Returns: Column_Index
+    '''
+    keys, positions = index_keys(table_df[column], kind)
+    order = np.argsort(keys, kind='stable')
+
+    return Column_Index(keys[order], positions[order])
+
+
+def save_index(index_path, index):
+    '''
+    This function writes the sorted keys of an index and removes its delta file.
+
+    Returns: None
+    '''
+    temp_path = index_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez(f, keys=index.keys, positions=index.positions)
+    os.replace(temp_path, index_path)
+
+    if os.path.isfile(delta_file(index_path)):
+        os.remove(delta_file(index_path))
+
+    loaded_indexes[index_path] = (file_stamp(index_path), index)
+
+    return None
+
+
+def load_index(index_path, kind):
+    '''
+    This function loads an index. The sorted keys are only read from the .npz file if they changed since they
+    were last loaded in this process, the short delta file is read every time.
+
+    Returns: Column_Index
+    '''
+    stamp = file_stamp(index_path)
+    if index_path in loaded_indexes and loaded_indexes[index_path][0] == stamp:
+        index = loaded_indexes[index_path][1]
+    else:
+        with np.load(index_path, allow_pickle=False) as npz:
+            index = Column_Index(npz['keys'], npz['positions'])
+        loaded_indexes[index_path] = (stamp, index)
+
+    # Adds the entries of inserted rows
+    delta_path = delta_file(index_path)
+    if os.path.isfile(delta_path) and os.path.getsize(delta_path) > 0:
+        delta_df = pd.read_csv(delta_path, header=None, names=['key', 'position'],
+                               dtype={'key': 'float64' if kind == 'number' else str}, keep_default_na=False)
+        index = Column_Index(index.keys, index.positions, delta_df['key'].to_numpy(dtype='float64' if kind == 'number' else str),
+                             delta_df['position'].to_numpy(dtype='int64'))
+
+    return index
+
+
+def rebuild_index(table_path, index_name, details, table_df=None):
+    '''
+    This function builds an index again from the table and records the table stamp it matches.
+
+    Returns: Column_Index
+    '''
+    if table_df is None:
+        table_df = read_table(table_path, [details['column']])
+
+    index = build_index(table_df, details['column'], details['kind'])
+    save_index(index_file(table_path, index_name), index)
+
+    details['rows'] = len(table_df)
+    details['delta'] = 0
+    details['stamp'] = table_stamp(table_path)
+
+    return index
+
+
+def create_index(table_path, index_name, column, unique=False, constraint=None):
+    '''
+    This function creates an index on a column of a table. A unique index fails if the column already has
+    repeated values. constraint is 'primary key' or 'unique' for the index that enforces a constraint of the
+    schema, a primary key index also fails if the column has missing values.
+
+    Returns: None
+    '''
+    registry = load_registry(table_path)
+    if index_name in registry:
+        raise Invalid_Command(f'Failed to create index {index_name} because it already exists.\n')
+
+    if column not in read_columns(table_path):
+        raise Invalid_Command(f'Column {column} does not exists.\n')
+
+    table_df = read_table(table_path, [column])
+    primary = constraint == 'primary key'
+    details = {'column': column, 'kind': key_kind(table_path, column, table_df[column]),
+               'unique': unique or constraint is not None, 'primary': primary, 'constraint': constraint}
+    index = build_index(table_df, column, details['kind'])
+
+    if primary and len(index.keys) < len(table_df):
+        raise Invalid_Command(f'Failed to create index {index_name} because column {column} has NULL values.\n')
+    if unique and np.any(index.keys[1:] == index.keys[:-1]):
+        raise Invalid_Command(f'Failed to create index {index_name} because column {column} has duplicate values.\n')
+
+    rebuild_index(table_path, index_name, details, table_df)
+
+    registry[index_name] = details
+    save_registry(table_path, registry)
+
+    return None
+
+
+def drop_index(table_path, index_name, drop_keys=False):
+    '''
+    This function deletes an index of a table. The index that enforces a PRIMARY KEY or UNIQUE constraint of the
+    schema is only deleted if drop_keys is True, which is used when the column or table is dropped.
+
+    Returns: None
+    '''
+    registry = load_registry(table_path)
+    if index_name not in registry:
+        raise Invalid_Command(f'Failed to delete index {index_name} because it does not exists.\n')
+
+    details = registry[index_name]
+    if details.get('constraint') and not drop_keys:
+        raise Invalid_Command(f'Failed to delete index {index_name} because it enforces the {details["constraint"]} constraint of column {details["column"]}.\n')
+
+    index_path = index_file(table_path, index_name)
+    for path in (index_path, delta_file(index_path)):
+        if os.path.isfile(path):
+            os.remove(path)
+    loaded_indexes.pop(index_path, None)
+    key_sets.pop(index_path, None)
+
+    registry.pop(index_name)
+    save_registry(table_path, registry)
+
+    return None
+
+
+def drop_column_indexes(table_path, column=None):
+    '''
+    This function deletes the indexes on a column, or all indexes of the table if column is None.
+
+    Returns: None
+    '''
+    for index_name, details in load_registry(table_path).items():
+        if column is None or details['column'] == column:
+            drop_index(table_path, index_name, drop_keys=True)
+
+    return None
+
+
+def find_table_index(database_path, index_name):
+    '''
+    This function finds the table an index belongs to when DROP INDEX does not name the table.
+
+    Returns: table name
+    '''
+    for file_name in sorted(os.listdir(database_path)):
+        if file_name.endswith('_indexes.json'):
+            with open(os.path.join(database_path, file_name), 'r') as f:
+                if index_name in json.load(f):
+                    return file_name[:-len('_indexes.json')]
+
+    raise Invalid_Command(f'Failed to delete index {index_name} because it does not exists.\n')
+
+
+def current_index(table_path, index_name, registry):
+    '''
+    This function loads an index, rebuilding it first if the table changed since it was last updated.
+
+    Returns: Column_Index
+    '''
+    details = registry[index_name]
+    if details['stamp'] == table_stamp(table_path):
+        return load_index(index_file(table_path, index_name), details['kind'])
+
+    index = rebuild_index(table_path, index_name, details)
+    save_registry(table_path, registry)
+
+    return index
+
+
+def key_set(table_path, index_name, registry):
+    '''
+    This function gets the hash set of the keys of a unique index, building it from the index if the table
+    changed since the set was built.
+
+    Returns: set of keys
+    '''
+    details = registry[index_name]
+    index_path = index_file(table_path, index_name)
+    if index_path in key_sets and key_sets[index_path][0] == details['stamp'] == table_stamp(table_path):
+        return key_sets[index_path][1]
+
+    index = current_index(table_path, index_name, registry)
+    key_sets[index_path] = (details['stamp'], set(index.keys.tolist()) | set(index.delta_keys.tolist()))
+
+    return key_sets[index_path][1]
+
+
+def format_key(key):
+    '''
+    This function formats a key for an error message, writing whole numbers without a decimal point.
+
+    Returns: string
+    '''
+    if isinstance(key, float) and key.is_integer():
+        return str(int(key))
+
+    return str(key)
+
+
+def unique_indexes(table_path, column=None):
+    '''
+    This function finds the PRIMARY KEY and UNIQUE indexes of a table, only those on column if it is given.
+
+    Returns: (registry, list of index names)
+    '''
+    if unlock_file(table_path) != table_path:
+        return dict(), list()
+
+    registry = load_registry(table_path)
+    names = [name for name, details in registry.items() if details.get('unique') and (column is None or details['column'] == column)]
+
+    return registry, names
+
+
+def check_unique_rows(table_path, rows, table_df=None):
+    '''
+    This function checks that rows about to be appended to a table do not repeat a value of a PRIMARY KEY or UNIQUE
+    column, either among themselves or with the rows already in the table. A primary key also cannot be NULL.
+    Rows can be a list of row lists or a DataFrame with the table's columns. If table_df is given it holds the rows
+    of the table instead of the file, such as a table modified inside a transaction.
+
+    Returns: None
+    '''
+    registry, names = unique_indexes(table_path)
+    if not names:
+        return None
+
+    columns = read_columns(table_path) if table_df is None else list(table_df.columns)
+
+    for index_name in names:
+        details = registry[index_name]
+        column = details['column']
+        if column not in columns:
+            continue
+        if isinstance(rows, pd.DataFrame):
+            values = rows.iloc[:, columns.index(column)]
+        else:
+            values = [row[columns.index(column)] for row in rows]
+
+        new_keys = index_keys(values, details['kind'])[0]
+        if details.get('primary') and len(new_keys) < len(values):
+            raise Invalid_Command(f'Column {column} is a primary key and cannot be NULL.\n')
+
+        # Looks up each new key in the hash set of the index and in the keys of the rows before it
+        if table_df is None:
+            existing = key_set(table_path, index_name, registry)
+        else:
+            existing = set(index_keys(table_df[column], details['kind'])[0].tolist())
+        seen = set()
+        for key in new_keys.tolist():
+            if key in existing or key in seen:
+                raise Invalid_Command(f'Duplicate value {format_key(key)} for key column {column}.\n')
+            seen.add(key)
+
+    return None
+
+
+def check_unique_table(table_path, table_df):
+    '''
+    This function checks that no PRIMARY KEY or UNIQUE column of a whole table repeats a value or, for a primary
+    key, holds NULL. It is used for tables built from the changes of two transactions.
+
+    Returns: None
+    '''
+    registry, names = unique_indexes(table_path)
+
+    for index_name in names:
+        details = registry[index_name]
+        column = details['column']
+        if column not in table_df.columns:
+            continue
+
+        keys, positions = index_keys(table_df[column], details['kind'])
+        if details.get('primary') and len(keys) < len(table_df):
+            raise Invalid_Command(f'Column {column} is a primary key and cannot be NULL.\n')
+
+        repeated = pd.Series(keys).duplicated()
+        if repeated.any():
+            raise Invalid_Command(f'Duplicate value {format_key(keys[repeated.to_numpy()][0])} for key column {column}.\n')
+
+    return None
+
+
+def check_unique_update(table_path, filter_series, column, value, table_df=None):
+    '''
+    This function checks that setting column to value in the rows of filter_series does not repeat a value of
+    a PRIMARY KEY or UNIQUE column. filter_series must cover every row of the table, or of table_df if it is given.
+
+    Returns: None
+    '''
+    registry, names = unique_indexes(table_path, column)
+
+    changed = filter_series.to_numpy(dtype=bool)
+    if not changed.any():
+        return None
+
+    for index_name in names:
+        details = registry[index_name]
+        if value is None:
+            if details.get('primary'):
+                raise Invalid_Command(f'Column {column} is a primary key and cannot be NULL.\n')
+            continue
+
+        key = index_keys(pd.Series([value], dtype=object), details['kind'])[0][0]
+
+        # Finds the rows already holding the value
+        if table_df is None:
+            holders = current_index(table_path, index_name, registry).lookup('=', key)
+        else:
+            keys, positions = index_keys(table_df[column], details['kind'])
+            holders = positions[keys == key]
+
+        # More than one changed row, or a row that is not changed already holding the value, would repeat the key
+        if changed.sum() > 1 or np.any(~changed[holders]):
+            raise Invalid_Command(f'Duplicate value {format_key(key)} for key column {column}.\n')
+
+    return None
+
+
+def usable_index(table_path, column, comparison, value, registry=None):
+    '''
+    This function finds an index of a table that can look up a WHERE condition on the column. registry is the list
+    of indexes of the table if it was already read.
+
+    Returns: (index name, details) or None if the condition cannot use an index
+    '''
+    if comparison not in INDEX_COMPARISONS or unlock_file(table_path) != table_path:
+        return None
+
+    if registry is None:
+        registry = load_registry(table_path)
+    matches = [(name, details) for name, details in registry.items() if details['column'] == column]
+    if not matches:
+        return None
+
+    index_name, details = matches[0]
+
+    # Numbers can only be looked up in number keys and strings in string keys
+    if isinstance(value, bool) or (details['kind'] == 'number') != isinstance(value, (int, float)):
+        return None
+
+    return index_name, details
+
+
+def index_lookup(table_path, column, comparison, value, row_count):
+    '''
+    This function finds the rows of a table matching a WHERE condition with an index on the column.
+    The index is rebuilt first if the table changed since it was last updated.
+
+    Returns: array of row positions, or None if the condition cannot use an index
+    '''
+    if comparison not in INDEX_COMPARISONS:
+        return None
+
+    registry = load_registry(table_path)
+    found = usable_index(table_path, column, comparison, value, registry)
+    if found is None:
+        return None
+
+    index_name, details = found
+    index = current_index(table_path, index_name, registry)
+
+    # The positions only apply to the whole table
+    if details['rows'] != row_count:
+        return None
+
+    return index.lookup(comparison, value)
+
+
+def current_indexes(table_path, old_stamp):
+    '''
+    This function finds the indexes of a table that matched the table before it was written.
+    Writes to the lock file of a transaction do not change the indexes until the transaction is committed.
+
+    Returns: (registry, list of (index name, details) that can be updated)
+    '''
+    if unlock_file(table_path) != table_path:
+        return dict(), list()
+
+    registry = load_registry(table_path)
+
+    return registry, [(name, details) for name, details in registry.items() if details['stamp'] == old_stamp]
+
+
+def append_index_rows(table_path, rows, old_stamp):
+    '''
+    This function adds the entries of rows appended to a table to the delta files of its indexes.
+    Rows can be a list of row lists or a DataFrame with the table's columns.
+
+    Returns: None
+    '''
+    registry, indexes = current_indexes(table_path, old_stamp)
+    if not indexes:
+        return None
+
+    columns = read_columns(table_path)
+    row_count = len(rows)
+    new_stamp = table_stamp(table_path)
+
+    for index_name, details in indexes:
+        if isinstance(rows, pd.DataFrame):
+            values = rows.iloc[:, columns.index(details['column'])]
+        else:
+            values = [row[columns.index(details['column'])] for row in rows]
+
+        keys, positions = index_keys(values, details['kind'])
+        positions = positions + details['rows']
+
+        index_path = index_file(table_path, index_name)
+        write_csv_rows(list(zip(keys.tolist(), positions.tolist())), delta_file(index_path))
+        details['delta'] += len(keys)
+
+        # Sorts the delta entries into the index once there are too many to compare one by one
+        if details['delta'] > INDEX_DELTA_ROWS:
+            save_index(index_path, load_index(index_path, details['kind']).merged())
+            details['delta'] = 0
+
+        # Adds the new keys to the hash set of a unique index so it does not need to be built again
+        if index_path in key_sets and key_sets[index_path][0] == details['stamp']:
+            key_sets[index_path][1].update(keys.tolist())
+            key_sets[index_path] = (new_stamp, key_sets[index_path][1])
+
+        details['rows'] += row_count
+        details['stamp'] = new_stamp
+
+    save_registry(table_path, registry)
+
+    return None
+
+
+def update_index_rows(table_path, filter_series, column, value, old_stamp):
+    '''
+    This function updates the indexes of a table after the rows in filter_series had column set to value.
+    Indexes on other columns only record the new table stamp.
+
+    Returns: None
+    '''
+    registry, indexes = current_indexes(table_path, old_stamp)
+    if not indexes:
+        return None
+
+    changed = filter_series.to_numpy(dtype=bool)
+
+    for index_name, details in indexes:
+        if details['column'] == column:
+            index_path = index_file(table_path, index_name)
+            index = load_index(index_path, details['kind']).merged()
+
+            # Leaves the index to be rebuilt if the value does not fit the keys
+            try:
+                new_keys = index_keys(pd.Series([value] * int(changed.sum()), dtype=object), details['kind'])[0]
+            except (ValueError, TypeError):
+                continue
+
+            # Removes the old entries of the changed rows and inserts the new value at its sorted place
+            keep = ~changed[index.positions]
+            keys, positions = index.keys[keep], index.positions[keep]
+            if len(new_keys):
+                insert_at = np.searchsorted(keys, new_keys[0], side='right')
+                keys = np.concatenate((keys[:insert_at], new_keys, keys[insert_at:]))
+                positions = np.concatenate((positions[:insert_at], np.flatnonzero(changed), positions[insert_at:]))
+
+            save_index(index_path, Column_Index(keys, positions))
+            details['delta'] = 0
+
+        details['stamp'] = table_stamp(table_path)
+
+    save_registry(table_path, registry)
+
+    return None
+
+
+def delete_index_rows(table_path, filter_series, old_stamp):
+    '''
+    This function removes the entries of deleted rows from the indexes of a table and moves the positions of
+    the rows after them.
+
+    Returns: None
+    '''
+    registry, indexes = current_indexes(table_path, old_stamp)
+    if not indexes:
+        return None
+
+    deleted = filter_series.to_numpy(dtype=bool)
+
+    # Each remaining row moves up by the number of deleted rows before it
+    shift = np.cumsum(deleted)
+
+    for index_name, details in indexes:
+        index_path = index_file(table_path, index_name)
+        index = load_index(index_path, details['kind']).merged()
+
+        keep = ~deleted[index.positions]
+        positions = index.positions[keep]
+        save_index(index_path, Column_Index(index.keys[keep], positions - shift[positions]))
+        details['delta'] = 0
+
+        details['rows'] -= int(deleted.sum())
+        details['stamp'] = table_stamp(table_path)
+
+    save_registry(table_path, registry)
+
+    return None
+
+
+def forget_directory(directory):
+    '''
+    This function removes the loaded indexes of a dropped database.
+
+    Returns: None
+    '''
+    directory = os.path.normpath(directory) + os.sep
+    for index_path in [path for path in loaded_indexes if os.path.normpath(path).startswith(directory)]:
+        loaded_indexes.pop(index_path)
+    for index_path in [path for path in key_sets if os.path.normpath(path).startswith(directory)]:
+        key_sets.pop(index_path)
+
+    return None
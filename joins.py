@@ -0,0 +1,274 @@
+'''
+Join operators used by SELECT.
+Each join finds the pairs of matching row positions of the two tables with vectorized NumPy operations and
+then builds the joined DataFrame from those pairs, adding unmatched rows for LEFT, RIGHT and OUTER joins.
+
+* hash_join builds a hash table on the smaller table and probes it with the rows of the other table. Large probe
+  tables are probed in chunks of rows in parallel (see parallel.py).
+* sort_merge_join walks both tables in key order, which avoids hashing when they are already sorted on the key.
+
+Missing key values never match, like NULL in SQL.
+'''
+
+import numpy as np
+import pandas as pd
+
+from errors import Invalid_Command
+from parallel import map_chunks
+
+JOIN_TYPES = {'inner', 'left', 'right', 'outer'}
+
+
+def key_values(series):
+    '''
+    This function gets the values of a join key column. Categorical columns use their values instead of their codes
+    so they can be matched against columns with different categories.
+
+    Returns: Series
+    '''
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.astype(series.cat.categories.dtype)
+
+    return series
+
+
+def smaller_side(left_rows, right_rows):
+    '''
+    This function picks the build side of a hash join, the table with fewer rows.
+
+    Returns: 'left' or 'right'
+    '''
+    return 'left' if left_rows < right_rows else 'right'
+
+
+def hash_pairs(left_keys, right_keys, build_side=None):
+    '''
+    This function finds all matching pairs of rows with a hash join. The build side is hashed into groups of
+    equal keys and every row of the other side looks up its group. If build_side is not given the table with
+    fewer rows is used as the build side.
+
+    Returns: (left row positions, right row positions)
+    '''
+    if build_side is None:
+        build_side = smaller_side(len(left_keys), len(right_keys))
+
+    if build_side == 'left':
+        build_keys, probe_keys = left_keys, right_keys
+    else:
+        build_keys, probe_keys = right_keys, left_keys
+
+    # Hashes the build keys into integer codes, then looks up the code of every probe key in chunks of rows.
+    # Missing keys and keys not on the build side get the code -1
+    build_codes, uniques = pd.factorize(key_values(build_keys))
+    build_index = pd.Index(uniques)
+    probe_values = key_values(probe_keys)
+    probe_codes = np.concatenate(map_chunks(lambda start, stop: build_index.get_indexer(probe_values.iloc[start:stop]), len(probe_values)))
+
+    # Groups the build rows by code: rows of code c are build_order[group_start[c]:group_start[c]+group_size[c]]
+    valid_build = build_codes >= 0
+    build_order = np.flatnonzero(valid_build)[np.argsort(build_codes[valid_build], kind='stable')]
+    group_size = np.bincount(build_codes[valid_build], minlength=len(uniques))
+    group_start = np.concatenate(([0], np.cumsum(group_size)[:-1]))
+
+    # Looks up the group of every probe row
+    probe_rows = np.flatnonzero(probe_codes >= 0)
+    matches = group_size[probe_codes[probe_rows]]
+    probe_positions = np.repeat(probe_rows, matches)
+    build_positions = build_order[expand_ranges(group_start[probe_codes[probe_rows]], matches)]
+
+    if build_side == 'left':
+        return build_positions, probe_positions
+
+    return probe_positions, build_positions
+
+
+def sort_merge_pairs(left_keys, right_keys):
+    '''
+    This function finds all matching pairs of rows with a sort-merge join. Tables that are not already sorted on
+    their key are sorted first, then the range of equal right keys is found for every left key by binary search.
+
+    Returns: (left row positions, right row positions)
+    '''
+    left_values = key_values(left_keys)
+    right_values = key_values(right_keys)
+
+    # Sorts each side unless it is already in key order, missing keys are left out
+    left_rows = np.flatnonzero(left_values.notna().to_numpy())
+    right_rows = np.flatnonzero(right_values.notna().to_numpy())
+    left_sorted = left_values.to_numpy()[left_rows]
+    right_sorted = right_values.to_numpy()[right_rows]
+
+    if not is_sorted(left_sorted):
+        order = np.argsort(left_sorted, kind='stable')
+        left_rows, left_sorted = left_rows[order], left_sorted[order]
+    if not is_sorted(right_sorted):
+        order = np.argsort(right_sorted, kind='stable')
+        right_rows, right_sorted = right_rows[order], right_sorted[order]
+
+    # Finds the block of matching right rows once for each run of equal left keys, then repeats it for the run
+    run_starts = np.flatnonzero(np.concatenate(([len(left_sorted) > 0], left_sorted[1:] != left_sorted[:-1])))
+    run_lengths = np.diff(np.append(run_starts, len(left_sorted)))
+    run_keys = left_sorted[run_starts]
+    starts = np.repeat(np.searchsorted(right_sorted, run_keys, side='left'), run_lengths)
+    matches = np.repeat(np.searchsorted(right_sorted, run_keys, side='right'), run_lengths) - starts
+
+    left_positions = np.repeat(left_rows, matches)
+    right_positions = right_rows[expand_ranges(starts, matches)]
+
+    return left_positions, right_positions
+
+
+def expand_ranges(starts, lengths):
+    '''
+    This function concatenates the ranges start..start+length for each pair of values without a Python loop.
+
+    Example: starts [0, 5], lengths [2, 3] -> [0, 1, 5, 6, 7]
+
+    Returns: array of positions
+    '''
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    nonempty = lengths > 0
+    starts, lengths = starts[nonempty], lengths[nonempty]
+
+    # Each position is one more than the previous one, except at the start of a range where it jumps to the new start
+    steps = np.ones(total, dtype=np.int64)
+    range_starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    steps[0] = starts[0]
+    steps[range_starts[1:]] = starts[1:] - (starts[:-1] + lengths[:-1] - 1)
+
+    return np.cumsum(steps)
+
+
+def is_sorted(values):
+    '''
+    This function checks if an array is in ascending order.
+
+    Returns: bool
+    '''
+    try:
+        return bool(len(values) < 2 or np.all(values[:-1] <= values[1:]))
+    except TypeError:
+        return False
+
+
+def assemble(left_df, right_df, left_positions, right_positions, how):
+    '''
+    This function builds the joined table from the matching pairs of rows. Unmatched left rows are added for LEFT and
+    OUTER joins and unmatched right rows for RIGHT and OUTER joins, with missing values for the other table's columns.
+    Rows are ordered like DataFrame.merge: by the left table, or by the right table for RIGHT joins.
+
+    Returns: DataFrame
+    '''
+    if how in ('left', 'outer'):
+        unmatched = np.ones(len(left_df), dtype=bool)
+        unmatched[left_positions] = False
+        left_positions = np.concatenate((left_positions, np.flatnonzero(unmatched)))
+        right_positions = np.concatenate((right_positions, np.full(unmatched.sum(), -1)))
+
+    if how in ('right', 'outer'):
+        unmatched = np.ones(len(right_df), dtype=bool)
+        unmatched[right_positions[right_positions >= 0]] = False
+        right_positions = np.concatenate((right_positions, np.flatnonzero(unmatched)))
+        left_positions = np.concatenate((left_positions, np.full(unmatched.sum(), -1)))
+
+    # Sorts the pairs by the row order of the preserved table, unmatched right rows of an outer join go last.
+    # Matches of one row are already in the other table's row order so a stable sort on one key is enough,
+    # and pairs from a hash join built on the right table are usually in order already
+    sort_key = right_positions if how == 'right' else np.where(left_positions < 0, len(left_df), left_positions)
+    if not is_sorted(sort_key):
+        order = np.argsort(sort_key, kind='stable')
+        left_positions, right_positions = left_positions[order], right_positions[order]
+
+    return pd.concat([take_rows(left_df, left_positions), take_rows(right_df, right_positions)], axis=1)
+
+
+def take_rows(table_df, positions):
+    '''
+    This function selects rows by position where -1 gives a row of missing values.
+
+    Returns: DataFrame with a new index
+    '''
+    table_df = table_df.reset_index(drop=True)
+
+    if len(positions) == 0 or positions.min() >= 0:
+        return table_df.take(positions).reset_index(drop=True)
+
+    return table_df.reindex(positions).reset_index(drop=True)
+
+
+def hash_join(left_df, right_df, left_key, right_key, how='inner', build_side=None):
+    '''
+    This function joins two tables on left_key = right_key with a hash join.
+
+    Returns: DataFrame
+    '''
+    left_positions, right_positions = hash_pairs(left_df[left_key], right_df[right_key], build_side)
+
+    return assemble(left_df, right_df, left_positions, right_positions, how)
+
+
+def sort_merge_join(left_df, right_df, left_key, right_key, how='inner'):
+    '''
+    This function joins two tables on left_key = right_key with a sort-merge join.
+
+    Returns: DataFrame
+    '''
+    left_positions, right_positions = sort_merge_pairs(left_df[left_key], right_df[right_key])
+
+    return assemble(left_df, right_df, left_positions, right_positions, how)
+
+
+def cross_join(left_df, right_df):
+    '''
+    This function joins every row of the left table with every row of the right table.
+
+    Returns: DataFrame
+    '''
+    left_positions = np.repeat(np.arange(len(left_df)), len(right_df))
+    right_positions = np.tile(np.arange(len(right_df)), len(left_df))
+
+    return pd.concat([take_rows(left_df, left_positions), take_rows(right_df, right_positions)], axis=1)
+
+
+def choose_join(left_df, right_df, left_key, right_key):
+    '''
+    This function picks the join algorithm. Tables that are both already sorted on their keys use a sort-merge join,
+    anything else uses a hash join.
+
+    Returns: 'sort_merge' or 'hash'
+    '''
+    left_keys = key_values(left_df[left_key])
+    right_keys = key_values(right_df[right_key])
+
+    if left_keys.is_monotonic_increasing and right_keys.is_monotonic_increasing:
+        return 'sort_merge'
+
+    return 'hash'
+
+
+def join_tables(left_df, right_df, left_key, right_key, how='inner', algorithm=None):
+    '''
+    This function joins two tables on left_key = right_key using algorithm ('sort_merge' or 'hash'), or the algorithm
+    picked by choose_join if it is not given. how can be inner, left, right, outer (or full) and cross.
+
+    Returns: DataFrame
+    '''
+    if how == 'full':
+        how = 'outer'
+
+    if how == 'cross':
+        return cross_join(left_df, right_df)
+
+    if how not in JOIN_TYPES:
+        raise Invalid_Command(f'{how} is not a valid join type.\n')
+
+    if algorithm is None:
+        algorithm = choose_join(left_df, right_df, left_key, right_key)
+
+    if algorithm == 'sort_merge':
+        return sort_merge_join(left_df, right_df, left_key, right_key, how)
+
+    return hash_join(left_df, right_df, left_key, right_key, how)
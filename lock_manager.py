@@ -0,0 +1,472 @@
+'''
+Lock manager shared by every process using the databases directory. The locks are stored in databases/locks.json,
+which is only read and changed while holding an exclusive lock of the file. Each lock belongs to an owner, which is
+an open transaction or a command running outside a transaction, and is one of:
+
+* table: the whole table in shared (S) or exclusive (X) mode
+* rows: exclusive locks on rows, identified by a hash of their values (row_keys)
+* range: a range of values of one column containing the rows matching the WHERE condition of an UPDATE or DELETE
+  (column, low, high). New rows and new values in the range conflict with it, so another transaction cannot add rows
+  to a range it changed.
+
+Locks are not waited for here. acquire raises Lock_Conflict, and the caller releases what it holds and calls wait,
+which polls until the owners blocking it are gone. While waiting, the owner is recorded in the wait-for graph, and a
+request that would close a cycle in the graph is refused as a deadlock. Locks of processes that no longer exist are
+removed the next time the file is read.
+'''
+
+import os
+import json
+import time
+import threading
+
+import numpy as np
+import pandas as pd
+
+from errors import Invalid_Command
+from wal import process_alive
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LOCK_FILE = 'locks.json'
+
+# Time a command waits for a lock before failing
+LOCK_TIMEOUT_SECONDS = float(os.environ.get('SQL_LOCK_TIMEOUT_MS', 5000)) / 1000
+
+# Number of row locks above which a command locks the whole table instead
+LOCK_ESCALATION_ROWS = int(os.environ.get('SQL_LOCK_ESCALATION_ROWS', 1000))
+
+
+class Lock_Conflict(Exception):
+    '''
+    Raised by acquire when a lock is held by another owner.
+    '''
+
+    def __init__(self, table_path, blockers):
+        super().__init__(table_path)
+        self.table_path = table_path
+        self.blockers = blockers
+
+
+class Deadlock_Detected(Invalid_Command):
+    '''
+    Raised by wait when waiting would close a cycle in the wait-for graph.
+    '''
+    pass
+
+
+def row_keys(table_df):
+    '''
+    This function hashes every row of a table into the key used by row locks. Rows with the same values have the
+    same key whatever the dtypes of the columns, as long as numbers have the same type.
+
+    Returns: array of uint64 keys
+    '''
+    return pd.util.hash_pandas_object(table_df, index = False).to_numpy()
+
+
+def range_value(text):
+    '''
+    This function converts a value of a WHERE condition to a range bound.
+
+    Returns: string or float, or None if the operand is a column
+    '''
+    if text.startswith("'") and text.endswith("'"):
+        return text[1:-1].replace("''", "'")
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def where_range(condition):
+    '''
+    This function converts a WHERE condition, a tree of conditions (see conditions.py), to a range of values of one
+    column containing every row it matches. A comparison with a value or BETWEEN gives its range, IN the range from
+    its smallest to its largest value and other conditions on one column the whole column. An AND uses the range of
+    one of its conditions and an OR the range covering all of its conditions if they are on the same column.
+
+    Returns: (column, low, high, low inclusive, high inclusive) or None if no range of one column contains the rows
+    '''
+    kind = condition[0]
+
+    if kind == 'and':
+        ranges = [x for x in (where_range(child) for child in condition[1:]) if x is not None]
+        bounded = [x for x in ranges if x[1] is not None or x[2] is not None]
+        return (bounded or ranges or [None])[0]
+
+    if kind == 'or':
+        ranges = [where_range(child) for child in condition[1:]]
+        if any(x is None for x in ranges) or len(set(x[0] for x in ranges)) > 1:
+            return None
+        # A bound missing from one of the conditions is missing from the union
+        low = high = None
+        try:
+            if all(x[1] is not None for x in ranges):
+                low = min(ranges, key = lambda x: (x[1], not x[3]))
+            if all(x[2] is not None for x in ranges):
+                high = max(ranges, key = lambda x: (x[2], x[4]))
+        except TypeError:
+            low = high = None
+        return (ranges[0][0], low and low[1], high and high[2], low[3] if low else True, high[4] if high else True)
+
+    if kind == 'not':
+        # Missing values match neither a condition nor its NOT, so NOT matches values of the same column
+        child = where_range(condition[1])
+        return None if child is None else (child[0], None, None, True, True)
+
+    if kind == 'null':
+        # Missing values are never in a range
+        return None
+
+    column = condition[1]
+    if not isinstance(column, str) or range_value(column) is not None:
+        if kind != 'compare' or not isinstance(condition[3], str) or range_value(condition[3]) is not None:
+            return None
+        # Value compared with a column, such as 5 < seat
+        swapped = {'<': '>', '<=': '>=', '>': '<', '>=': '<='}
+        condition = ('compare', condition[3], swapped.get(condition[2], condition[2]), condition[1])
+        column = condition[1]
+
+    if kind == 'between':
+        low, high = range_value(condition[2]), range_value(condition[3])
+        return (column, low, high, True, True)
+
+    if kind == 'in':
+        values = [range_value(value) for value in condition[2]]
+        try:
+            return (column, min(values), max(values), True, True)
+        except TypeError:
+            return (column, None, None, True, True)
+
+    if kind != 'compare':
+        return (column, None, None, True, True)
+
+    comparison, value = condition[2], range_value(condition[3])
+    if value is None:
+        return (column, None, None, True, True)
+    if comparison == '=':
+        return (column, value, value, True, True)
+    if comparison in ('<', '<='):
+        return (column, None, value, True, comparison == '<=')
+    if comparison in ('>', '>='):
+        return (column, value, None, comparison == '>=', True)
+
+    return (column, None, None, True, True)
+
+
+def in_range(value, lock):
+    '''
+    This function checks if a value is in the range of a range lock. Values that cannot be compared with the bounds
+    are treated as in the range, missing values never are.
+
+    Returns: bool
+    '''
+    if value is None or value != value:
+        return False
+
+    try:
+        if lock['low'] is not None and (value < lock['low'] or (value == lock['low'] and not lock['low_inclusive'])):
+            return False
+        if lock['high'] is not None and (value > lock['high'] or (value == lock['high'] and not lock['high_inclusive'])):
+            return False
+    except TypeError:
+        return True
+
+    return True
+
+
+def conflicts(request, held):
+    '''
+    This function checks if a requested lock conflicts with a lock held by another owner on the same table.
+    A values request checks new rows against range locks and is never stored.
+
+    Returns: bool
+    '''
+    if held['kind'] == 'table' or request['kind'] == 'table':
+        return held['mode'] == 'X' or request['mode'] == 'X'
+
+    if request['kind'] == 'rows' and held['kind'] == 'rows':
+        return not set(request['keys']).isdisjoint(held['keys'])
+
+    if request['kind'] == 'values' and held['kind'] == 'range' and held['column'] in request['columns']:
+        position = request['columns'].index(held['column'])
+        return any(in_range(row[position], held) for row in request['rows'])
+
+    return False
+
+
+class Lock_Manager:
+    '''
+    Locks of one databases directory. held is the set of owners of this process that have locks in the file, so
+    releasing an owner without locks does not read the file.
+    '''
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, LOCK_FILE)
+        self.lock = threading.Lock()
+        self.held = set()
+
+    def load(self, f):
+        '''
+        This function reads the lock file and removes the locks and waits of processes that no longer exist.
+
+        Returns: {'locks': list of locks, 'waits': {owner: {'pid': ..., 'blockers': [...]}}}
+        '''
+        f.seek(0)
+        text = f.read()
+        state = json.loads(text) if text else {'locks': list(), 'waits': dict()}
+
+        alive = dict()
+        def running(pid):
+            if pid not in alive:
+                alive[pid] = process_alive(pid)
+            return alive[pid]
+
+        state['locks'] = [lock for lock in state['locks'] if running(lock['pid'])]
+        state['waits'] = {owner: wait for owner, wait in state['waits'].items() if running(wait['pid'])}
+
+        return state
+
+    def save(self, f, state):
+        '''
+        This function overwrites the lock file with the new state.
+
+        Returns: None
+        '''
+        f.seek(0)
+        f.truncate()
+        if state['locks'] or state['waits']:
+            f.write(json.dumps(state))
+        f.flush()
+
+        return None
+
+    def update(self, function):
+        '''
+        This function runs function(state) while holding the exclusive lock of the lock file and saves the state if
+        function returns True.
+
+        Returns: None
+        '''
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok = True)
+
+        with self.lock, open(self.path, 'a+') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                state = self.load(f)
+                if function(state):
+                    self.save(f, state)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+        return None
+
+    def acquire(self, owner, table_path, requests):
+        '''
+        This function grants all requested locks on a table to owner, or none of them if one conflicts with a lock
+        of another owner. Locks the owner already holds are not added again. Values requests are only checked.
+
+        Returns: None, raises Lock_Conflict if a lock is held by another owner
+        '''
+        # Checks of new rows need no lock file if no lock is held
+        if all(request['kind'] == 'values' for request in requests) and (not os.path.isfile(self.path) or os.path.getsize(self.path) == 0):
+            return None
+
+        blockers = list()
+
+        def grant(state):
+            held = [lock for lock in state['locks'] if lock['table'] == table_path]
+            for request in requests:
+                blockers.extend(lock['owner'] for lock in held if lock['owner'] != owner and conflicts(request, lock) and lock['owner'] not in blockers)
+            if blockers:
+                return False
+
+            # Leaves out rows and locks the owner already holds
+            own = [lock for lock in held if lock['owner'] == owner]
+            own_keys = {key for lock in own if lock['kind'] == 'rows' for key in lock['keys']}
+            new_locks = list()
+            for request in requests:
+                if request['kind'] == 'rows':
+                    request = dict(request, keys = [key for key in request['keys'] if key not in own_keys])
+                    if not request['keys']:
+                        continue
+                elif request['kind'] == 'values' or any(all(lock.get(k) == v for k, v in request.items()) for lock in own):
+                    continue
+                new_locks.append(dict(request, owner = owner, pid = os.getpid(), thread = threading.get_ident(), table = table_path))
+
+            state['locks'].extend(new_locks)
+
+            return len(new_locks) > 0
+
+        self.update(grant)
+
+        if blockers:
+            raise Lock_Conflict(table_path, blockers)
+
+        if any(request['kind'] != 'values' for request in requests):
+            self.held.add(owner)
+
+        return None
+
+    def wait(self, owner, conflict, deadline):
+        '''
+        This function waits until the owners blocking a request have released their locks. Waiting for an owner of
+        the same thread would never end, so it fails at once, as does waiting past the deadline.
+
+        Returns: None, raises Invalid_Command if the lock cannot be waited for
+        '''
+        table_name = os.path.splitext(os.path.basename(conflict.table_path))[0]
+        outcome = list()
+
+        def record(state):
+            blockers = [lock for lock in state['locks'] if lock['owner'] in conflict.blockers]
+            if not blockers:
+                outcome.append('free')
+                state['waits'].pop(owner, None)
+                return True
+
+            if any(lock['pid'] == os.getpid() and lock['thread'] == threading.get_ident() for lock in blockers):
+                outcome.append('locked')
+                return False
+
+            # Follows the wait-for graph from the blockers, reaching owner again means a cycle
+            waiting = [lock['owner'] for lock in blockers]
+            seen = set()
+            while waiting:
+                other = waiting.pop()
+                if other == owner:
+                    outcome.append('deadlock')
+                    state['waits'].pop(owner, None)
+                    return True
+                if other not in seen:
+                    seen.add(other)
+                    waiting.extend(state['waits'].get(other, dict()).get('blockers', list()))
+
+            state['waits'][owner] = {'pid': os.getpid(), 'blockers': sorted(set(conflict.blockers))}
+            return True
+
+        while True:
+            outcome.clear()
+            self.update(record)
+
+            if outcome == ['free']:
+                return None
+            if outcome == ['locked']:
+                raise Invalid_Command(f'Table {table_name} is locked.\n')
+            if outcome == ['deadlock']:
+                raise Deadlock_Detected(f'Deadlock detected on table {table_name}. Transaction aborted.\n')
+            if time.monotonic() > deadline:
+                self.update(lambda state: state['waits'].pop(owner, None) is not None)
+                raise Invalid_Command(f'Table {table_name} is locked.\n')
+
+            time.sleep(0.005)
+
+    def release(self, owner):
+        '''
+        This function releases every lock of owner.
+
+        Returns: None
+        '''
+        if owner not in self.held:
+            return None
+
+        def remove(state):
+            state['locks'] = [lock for lock in state['locks'] if lock['owner'] != owner]
+            state['waits'].pop(owner, None)
+            return True
+
+        self.update(remove)
+        self.held.discard(owner)
+
+        return None
+
+    def locks(self):
+        '''
+        This function lists the locks held by every owner.
+
+        Returns: list of locks
+        '''
+        result = list()
+
+        def read(state):
+            result.extend(state['locks'])
+            return False
+
+        self.update(read)
+
+        return result
+
+
+# Lock managers of this process by databases directory
+lock_managers = dict()
+
+
+def lock_manager(directory):
+    '''
+    This function gets the lock manager of a databases directory.
+
+    Returns: Lock_Manager
+    '''
+    key = os.path.abspath(directory)
+    if key not in lock_managers:
+        lock_managers[key] = Lock_Manager(directory)
+
+    return lock_managers[key]
+
+
+def range_request(where_command):
+    '''
+    This function builds the range lock request of a WHERE condition. A condition whose rows are not in a range of
+    one column, such as an OR of two columns, locks the whole table in shared mode instead.
+
+    Returns: request dictionary or None if there is no condition
+    '''
+    if where_command is None:
+        return None
+
+    condition = where_range(where_command)
+    if condition is None:
+        return table_request('S')
+
+    column, low, high, low_inclusive, high_inclusive = condition
+
+    return {'kind': 'range', 'mode': 'S', 'column': column, 'low': low, 'high': high,
+            'low_inclusive': low_inclusive, 'high_inclusive': high_inclusive}
+
+
+def rows_request(keys):
+    '''
+    This function builds the request for exclusive locks on rows, or on the whole table if there are more than
+    LOCK_ESCALATION_ROWS rows.
+
+    Returns: request dictionary
+    '''
+    keys = np.unique(np.asarray(keys, dtype = np.uint64))
+    if len(keys) > LOCK_ESCALATION_ROWS:
+        return table_request('X')
+
+    return {'kind': 'rows', 'mode': 'X', 'keys': [int(key) for key in keys]}
+
+
+def values_request(columns, rows):
+    '''
+    This function builds the request that checks new rows, a list of row lists, against the range locks of other owners.
+
+    Returns: request dictionary
+    '''
+    return {'kind': 'values', 'mode': 'X', 'columns': list(columns), 'rows': rows}
+
+
+def table_request(mode):
+    '''
+    This function builds the request for a lock on the whole table.
+
+    Returns: request dictionary
+    '''
+    return {'kind': 'table', 'mode': mode}
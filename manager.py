@@ -5,8 +5,10 @@ Created By Joshua Hosea at UNR
 '''
 
 import sys
+import atexit
 
 import sql_commands as sql
+from metrics import statement_metrics
 
 def run_input_file(input_file):
     '''
@@ -74,10 +76,22 @@ def run_standard_input():
 
 if __name__ == '__main__':
 
-    # If a file was specified in the command line, we will run the program in file mode
-    if len(sys.argv) > 1:
+    # Finishes or aborts the transactions left by a crash before running any command
+    sql.recover_transactions()
+
+    # Runs as a server for clients of client.py if --serve was given, with an optional address
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        from server import serve
+        from client import DEFAULT_ADDRESS
+        serve(sys.argv[2] if len(sys.argv) > 2 else DEFAULT_ADDRESS)
+
+    # If a file was specified in the command line, we will run the program in file mode, writing the statement
+    # metrics when the program exits
+    elif len(sys.argv) > 1:
+        atexit.register(statement_metrics.write_json)
         run_input_file(sys.argv)
 
     # Else use standard input
     else:
+        atexit.register(statement_metrics.write_json)
         run_standard_input()
@@ -0,0 +1,265 @@
+'''
+Statement metrics and the slow query log.
+
+Every statement run by execute_command is timed and counted by its command type, the first word of the statement
+(EXECUTE is counted as the type of the prepared statement it runs): the number of statements and of errors, a
+histogram of their latencies and the rows they read from tables and wrote. Commands report their rows with
+count_rows while they run.
+
+Statements taking at least SQL_SLOW_QUERY_MS milliseconds (1000 by default) are appended to the slow query log,
+SQL_SLOW_QUERY_LOG (databases/slow_queries.log by default), as one line of JSON each with the time, the duration,
+the database, the rows and the text of the statement. A negative threshold turns the log off.
+
+prometheus_text writes the metrics and the counters of the table cache and of the cache of parsed statements in the
+Prometheus text format. The server answers an HTTP GET on its address with them, so Prometheus can scrape
+http://host:port/metrics, and SHOW METRICS prints them. When the command line exits it writes them as JSON to
+SQL_METRICS_FILE (databases/metrics.json by default, an empty value turns it off).
+'''
+
+import os
+import json
+import time
+import threading
+import contextlib
+
+from table_cache import table_cache
+from sql_parser import parse_cache
+from storage import DATABASE_DIR
+
+# Statements taking at least this many milliseconds are written to the slow query log
+SLOW_QUERY_MS = float(os.environ.get('SQL_SLOW_QUERY_MS', 1000))
+
+# File the slow statements are appended to
+SLOW_QUERY_LOG = os.environ.get('SQL_SLOW_QUERY_LOG', os.path.join(DATABASE_DIR, 'slow_queries.log'))
+
+# File the command line writes the metrics to when it exits
+METRICS_FILE = os.environ.get('SQL_METRICS_FILE', os.path.join(DATABASE_DIR, 'metrics.json'))
+
+# Upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Statement running in this thread
+statements = threading.local()
+
+
+class Statement_Record:
+    '''
+    Measures of one statement. kind is its command type, set once it is parsed, so statements that cannot be
+    parsed are counted as unknown.
+    '''
+
+    def __init__(self, text, database):
+        self.text = text
+        self.database = database
+        self.kind = 'unknown'
+        self.rows_read = 0
+        self.rows_written = 0
+        self.failed = False
+
+
+def count_rows(read=0, written=0):
+    '''
+    This function adds to the rows read and written by the statement running in this thread, if any.
+
+    Returns: None
+    '''
+    record = getattr(statements, 'record', None)
+    if record is not None:
+        record.rows_read += read
+        record.rows_written += written
+
+    return None
+
+
+class Statement_Metrics:
+    '''
+    Metrics of the statements run by this process. kinds maps each command type to its counters: count, errors,
+    seconds (total), max_seconds, buckets (statements per latency bucket, the last one above every bound),
+    rows_read and rows_written.
+    '''
+
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS, slow_query_log=SLOW_QUERY_LOG, buckets=LATENCY_BUCKETS):
+        self.slow_query_ms = slow_query_ms
+        self.slow_query_log = slow_query_log
+        self.buckets = buckets
+        self.kinds = dict()
+        self.slow_queries = 0
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def statement(self, text, database=''):
+        '''
+        This function measures the statement run inside it. The record it gives is the one count_rows adds to.
+
+        Returns: context manager giving a Statement_Record
+        '''
+        record = Statement_Record(text, database)
+        previous = getattr(statements, 'record', None)
+        statements.record = record
+        started = time.perf_counter()
+
+        try:
+            yield record
+        except BaseException:
+            record.failed = True
+            raise
+        finally:
+            statements.record = previous
+            self.add(record, time.perf_counter() - started)
+
+    def add(self, record, seconds):
+        '''
+        This function adds a finished statement to the counters of its command type and to the slow query log if
+        it was slow.
+
+        Returns: None
+        '''
+        bucket = next((i for i, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))
+
+        with self.lock:
+            counters = self.kinds.get(record.kind)
+            if counters is None:
+                counters = self.kinds[record.kind] = {'count': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                                                      'buckets': [0] * (len(self.buckets) + 1), 'rows_read': 0,
+                                                      'rows_written': 0}
+            counters['count'] += 1
+            counters['errors'] += record.failed
+            counters['seconds'] += seconds
+            counters['max_seconds'] = max(counters['max_seconds'], seconds)
+            counters['buckets'][bucket] += 1
+            counters['rows_read'] += record.rows_read
+            counters['rows_written'] += record.rows_written
+
+            slow = 0 <= self.slow_query_ms <= seconds * 1000
+            if slow:
+                self.slow_queries += 1
+
+        if slow:
+            self.log_slow_query(record, seconds)
+
+        return None
+
+    def log_slow_query(self, record, seconds):
+        '''
+        This function appends a slow statement to the slow query log.
+
+        Returns: None
+        '''
+        entry = {'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'milliseconds': round(seconds * 1000, 3),
+                 'command': record.kind, 'database': record.database, 'rows_read': record.rows_read,
+                 'rows_written': record.rows_written, 'failed': record.failed, 'sql': record.text}
+
+        # A log that cannot be written must not make the statement fail
+        try:
+            directory = os.path.dirname(self.slow_query_log)
+            if directory:
+                os.makedirs(directory, exist_ok = True)
+            with self.lock, open(self.slow_query_log, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+        except OSError:
+            pass
+
+        return None
+
+    def snapshot(self):
+        '''
+        This function reports the metrics with the cache counters. Latency buckets are cumulative, like in
+        Prometheus: each counts the statements taking at most its bound in seconds.
+
+        Returns: dictionary
+        '''
+        with self.lock:
+            kinds = {kind: dict(counters, buckets = list(counters['buckets'])) for kind, counters in self.kinds.items()}
+            slow_queries = self.slow_queries
+
+        statements_report = dict()
+        for kind, counters in sorted(kinds.items()):
+            cumulative = [sum(counters['buckets'][:i + 1]) for i in range(len(counters['buckets']))]
+            statements_report[kind] = {
+                'count': counters['count'],
+                'errors': counters['errors'],
+                'total_ms': counters['seconds'] * 1000,
+                'mean_ms': counters['seconds'] * 1000 / counters['count'],
+                'max_ms': counters['max_seconds'] * 1000,
+                'latency_buckets': {**{str(bound): count for bound, count in zip(self.buckets, cumulative)}, '+Inf': cumulative[-1]},
+                'rows_read': counters['rows_read'],
+                'rows_written': counters['rows_written']
+            }
+
+        return {'uptime_seconds': time.time() - self.started, 'statements': statements_report,
+                'slow_queries': slow_queries, 'slow_query_ms': self.slow_query_ms, 'caches': cache_stats()}
+
+    def prometheus_text(self):
+        '''
+        This function writes the metrics in the Prometheus text format.
+
+        Returns: string
+        '''
+        report = self.snapshot()
+        lines = list()
+
+        def metric(name, kind, description, samples):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(f'{name}{labels} {value}' for labels, value in samples)
+
+        statements_report = report['statements']
+        metric('sql_statement_duration_seconds', 'histogram', 'Time taken by statements, by command type.',
+               [(f'_bucket{{command="{kind}",le="{bound}"}}', count) for kind, counters in statements_report.items()
+                for bound, count in counters['latency_buckets'].items()])
+        # Sum and count samples of a histogram are named after the histogram
+        lines.extend(f'sql_statement_duration_seconds_sum{{command="{kind}"}} {counters["total_ms"] / 1000}'
+                     for kind, counters in statements_report.items())
+        lines.extend(f'sql_statement_duration_seconds_count{{command="{kind}"}} {counters["count"]}'
+                     for kind, counters in statements_report.items())
+
+        metric('sql_statement_errors_total', 'counter', 'Statements that failed, by command type.',
+               [(f'{{command="{kind}"}}', counters['errors']) for kind, counters in statements_report.items()])
+        metric('sql_rows_read_total', 'counter', 'Rows read from tables, by command type.',
+               [(f'{{command="{kind}"}}', counters['rows_read']) for kind, counters in statements_report.items()])
+        metric('sql_rows_written_total', 'counter', 'Rows inserted, updated or deleted, by command type.',
+               [(f'{{command="{kind}"}}', counters['rows_written']) for kind, counters in statements_report.items()])
+        metric('sql_slow_queries_total', 'counter', f'Statements taking at least {self.slow_query_ms:g} ms.',
+               [('', report['slow_queries'])])
+
+        for cache, counters in report['caches'].items():
+            for name, value in counters.items():
+                if name in ('hits', 'misses', 'evictions'):
+                    metric(f'sql_{cache}_{name}_total', 'counter', f'{name.capitalize()} of the {cache.replace("_", " ")}.', [('', value)])
+                else:
+                    metric(f'sql_{cache}_{name}', 'gauge', f'{name.replace("_", " ").capitalize()} of the {cache.replace("_", " ")}.', [('', value)])
+
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path=METRICS_FILE):
+        '''
+        This function writes the metrics as JSON to path, if a path is set.
+
+        Returns: None
+        '''
+        if not path:
+            return None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent = 2)
+
+        return None
+
+
+def cache_stats():
+    '''
+    This function gets the counters of the table cache and of the cache of parsed statements.
+
+    Returns: dictionary of cache name to counters
+    '''
+    parse_stats = {name[len('parse_'):]: value for name, value in parse_cache.stats().items()}
+
+    return {'table_cache': table_cache.stats(), 'parse_cache': parse_stats}
+
+
+# Metrics of every statement run by this process
+statement_metrics = Statement_Metrics()
@@ -0,0 +1,151 @@
+'''
+ORDER BY, LIMIT and OFFSET for SELECT.
+
+    SELECT * FROM flights WHERE status = 0 ORDER BY price DESC, seat LIMIT 10 OFFSET 20;
+
+Rows are sorted with a stable sort, so rows with equal keys keep their table order, and missing values go last.
+With LIMIT only the first OFFSET + LIMIT rows are needed: top_rows finds the value of the first key at that position
+with np.partition and only sorts the rows up to it, including every row tied with it, so the result is the same as
+sorting every row. LIMIT without ORDER BY stops reading a streamed table once it has enough rows.
+'''
+
+import numpy as np
+import pandas as pd
+
+from errors import Invalid_Command
+
+
+def check_order_columns(order_by, columns):
+    '''
+    This function checks that the ORDER BY columns are columns of the result.
+
+    Returns: None
+    '''
+    for column, _ in order_by:
+        if column not in columns:
+            raise Invalid_Command(f'Column {column} not found.\n')
+
+    return None
+
+
+def sort_rows(table_df, order_by):
+    '''
+    This function sorts every row of a table by the ORDER BY keys.
+
+    Returns: DataFrame
+    '''
+    if len(table_df) < 2:
+        return table_df
+
+    return table_df.sort_values([column for column, _ in order_by], ascending = [ascending for _, ascending in order_by],
+                                kind = 'stable', na_position = 'last', key = category_values)
+
+
+def category_values(series):
+    '''
+    This function replaces a categorical column by its values so it is sorted by value and not by the order of
+    its categories.
+
+    Returns: Series
+    '''
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.astype(series.cat.categories.dtype)
+
+    return series
+
+
+def rank_key(series, ascending):
+    '''
+    This function converts the first ORDER BY column to numbers that are in the order of the sort, with missing
+    values as NaN. Categorical columns use the rank of their category among the sorted categories.
+
+    Returns: float array or None if the column cannot be converted
+    '''
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        ranks = np.argsort(np.argsort(series.cat.categories.to_numpy(), kind = 'stable'), kind = 'stable')
+        key = np.where(codes < 0, np.nan, ranks[codes].astype(np.float64))
+    elif pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        key = series.to_numpy(dtype = np.float64, na_value = np.nan)
+    else:
+        return None
+
+    return key if ascending else -key
+
+
+def top_rows(table_df, order_by, count):
+    '''
+    This function finds the first count rows of a table in ORDER BY order without sorting every row. The rows whose
+    first key is at most the count-th smallest value are the only ones that can be in the result, ties included, so
+    only they are sorted.
+
+    Returns: DataFrame with at most count rows
+    '''
+    if count >= len(table_df):
+        return sort_rows(table_df, order_by)
+
+    column, ascending = order_by[0]
+    key = rank_key(table_df[column], ascending)
+    if key is None or count == 0:
+        return sort_rows(table_df, order_by).iloc[:count]
+
+    present = ~np.isnan(key)
+    if present.sum() > count:
+        threshold = np.partition(key[present], count - 1)[count - 1]
+        candidates = present & (key <= threshold)
+    else:
+        # Missing values sort last, so they are only needed if there are not enough other rows
+        candidates = np.ones(len(table_df), dtype = bool)
+
+    return sort_rows(table_df.loc[candidates], order_by).iloc[:count]
+
+
+def order_rows(table_df, order_by, limit=None, offset=0):
+    '''
+    This function applies ORDER BY, LIMIT and OFFSET to a table.
+
+    Returns: DataFrame
+    '''
+    if order_by:
+        check_order_columns(order_by, table_df.columns)
+        if limit is None:
+            table_df = sort_rows(table_df, order_by)
+        else:
+            table_df = top_rows(table_df, order_by, offset + limit)
+
+    if limit is None:
+        return table_df.iloc[offset:]
+
+    return table_df.iloc[offset:offset + limit]
+
+
+def order_chunks(chunks, order_by, limit=None, offset=0):
+    '''
+    This function applies ORDER BY, LIMIT and OFFSET to a stream of chunks. With ORDER BY and LIMIT only the first
+    OFFSET + LIMIT rows of the chunks read so far are kept, and without ORDER BY the stream stops as soon as it has
+    enough rows. ORDER BY without LIMIT keeps every row until the end of the stream.
+
+    Returns: generator of DataFrames
+    '''
+    if order_by:
+        kept = list()
+        for chunk in chunks:
+            kept.append(chunk)
+            if limit is not None:
+                kept = [top_rows(pd.concat(kept), order_by, offset + limit)]
+        if kept:
+            yield order_rows(pd.concat(kept), order_by, limit, offset)
+        return
+
+    skipped = taken = 0
+    for chunk in chunks:
+        if offset > skipped:
+            skip = min(offset - skipped, len(chunk))
+            chunk = chunk.iloc[skip:]
+            skipped += skip
+        if limit is not None:
+            chunk = chunk.iloc[:limit - taken]
+            taken += len(chunk)
+        yield chunk
+        if limit is not None and taken >= limit:
+            return
@@ -0,0 +1,106 @@
+'''
+Parallel execution of filters, scans and join probes. A large input is split into chunks of consecutive rows that are
+processed by a pool of threads, and the results are put back together in chunk order, so they are the same as the
+results of serial execution. NumPy and pandas release the GIL while they compare, hash and copy arrays of numbers,
+so the threads run on several cores without copying the table to other processes.
+
+The number of threads is set with the SQL_PARALLEL_WORKERS environment variable (the number of cores by default) and
+inputs with fewer rows than SQL_PARALLEL_MIN_ROWS (1,000,000 by default) are processed serially, since starting the
+threads would cost more than it saves.
+'''
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Number of threads running the chunks of one operation
+PARALLEL_WORKERS = max(int(os.environ.get('SQL_PARALLEL_WORKERS', os.cpu_count() or 1)), 1)
+
+# Inputs with fewer rows are processed serially
+PARALLEL_MIN_ROWS = int(os.environ.get('SQL_PARALLEL_MIN_ROWS', 1000000))
+
+# Thread pool shared by every operation, created the first time it is needed
+executor = None
+executor_lock = threading.Lock()
+
+
+def worker_pool():
+    '''
+    This function gets the thread pool, creating it the first time.
+
+    Returns: ThreadPoolExecutor
+    '''
+    global executor
+
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers = PARALLEL_WORKERS, thread_name_prefix = 'sql-parallel')
+
+    return executor
+
+
+def chunk_bounds(row_count):
+    '''
+    This function splits row_count rows into one chunk of consecutive rows per worker, or a single chunk if the
+    input is processed serially.
+
+    Returns: list of (start, stop)
+    '''
+    if PARALLEL_WORKERS < 2 or row_count < PARALLEL_MIN_ROWS:
+        return [(0, row_count)]
+
+    edges = np.linspace(0, row_count, PARALLEL_WORKERS + 1).astype(np.int64)
+
+    return [(int(start), int(stop)) for start, stop in zip(edges[:-1], edges[1:]) if stop > start]
+
+
+def map_chunks(function, row_count):
+    '''
+    This function runs function(start, stop) on every chunk of row_count rows. A single chunk runs in the calling
+    thread.
+
+    Returns: list of results in chunk order
+    '''
+    bounds = chunk_bounds(row_count)
+    if len(bounds) == 1:
+        return [function(*bounds[0])]
+
+    return list(worker_pool().map(lambda chunk: function(*chunk), bounds))
+
+
+def parallel_mask(function, row_count):
+    '''
+    This function builds a boolean mask of row_count rows from the masks function(start, stop) returns for each
+    chunk. Missing values do not match.
+
+    Returns: boolean array
+    '''
+    def chunk_mask(start, stop):
+        mask = function(start, stop)
+        if isinstance(mask, pd.Series):
+            mask = mask.fillna(False)
+        return np.asarray(mask, dtype = bool)
+
+    masks = map_chunks(chunk_mask, row_count)
+
+    return masks[0] if len(masks) == 1 else np.concatenate(masks)
+
+
+def filter_rows(table_df, mask):
+    '''
+    This function selects the rows of a table where mask is True, like table_df.loc[mask]. Large results copy each
+    column in a separate thread.
+
+    Returns: DataFrame
+    '''
+    mask = np.asarray(mask, dtype = bool)
+    if len(chunk_bounds(len(table_df))) == 1 or table_df.shape[1] < 2 or not table_df.columns.is_unique:
+        return table_df.loc[mask]
+
+    positions = np.flatnonzero(mask)
+    columns = list(worker_pool().map(lambda column: table_df[column].take(positions), table_df.columns))
+
+    return pd.concat(columns, axis = 1).set_axis(table_df.columns, axis = 1)
@@ -0,0 +1,331 @@
+'''
+Helpers for reading table schemas and checking values against the column types stored in {table}_schema.json
+A column type can be followed by the constraints PRIMARY KEY or UNIQUE, which are stored as part of the type, eg. "int primary key".
+'''
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+from errors import Invalid_Command
+
+INTEGER_TYPES = {'int', 'integer', 'smallint', 'bigint'}
+FLOAT_TYPES = {'float', 'double', 'real', 'decimal', 'numeric'}
+STRING_TYPES = {'char', 'varchar', 'text', 'string'}
+
+# Number of bits SQL uses for each integer type, columns are widened if a stored value does not fit
+INTEGER_BITS = {'smallint': 16, 'int': 32, 'integer': 32, 'bigint': 64}
+
+# Constraints that can follow a column type
+CONSTRAINTS = ('primary key', 'unique')
+
+# String columns with at least this many rows and at most this fraction of distinct values are stored as categories
+CATEGORY_MIN_ROWS = 1000
+CATEGORY_MAX_RATIO = 0.5
+
+
+def load_schema(schema_path):
+    '''
+    This function loads the schema of a table.
+
+    Returns: dictionary of column name to column type
+    '''
+    with open(schema_path,'r') as f:
+        schema = json.load(f)
+
+    return schema
+
+
+def schema_file(table_path):
+    '''
+    This function builds the path of the schema of a table from the path of the table or its lock file.
+
+    Returns: schema path
+    '''
+    root = os.path.splitext(table_path)[0]
+    if root.endswith('_lock'):
+        root = root[:-len('_lock')]
+
+    return f'{root}_schema.json'
+
+
+def parse_type(column_type):
+    '''
+    This function splits a column type such as varchar(20) into the base type and the maximum length.
+    Constraints after the type are ignored.
+
+    Returns: (base type, length or None)
+    '''
+    column_type = ' '.join(column_type.lower().split())
+    for constraint in CONSTRAINTS:
+        column_type = column_type.replace(constraint, '')
+    column_type = column_type.strip()
+    base_type = column_type.split('(')[0].strip()
+    length = None
+
+    if '(' in column_type:
+        try:
+            length = int(column_type[column_type.find('(')+1:column_type.find(')')].split(',')[0])
+        except ValueError:
+            raise Invalid_Command(f'Invalid column type {column_type}.\n')
+
+    return base_type, length
+
+
+def is_number_type(column_type):
+    '''
+    This function checks if a column type holds numbers.
+
+    Returns: bool
+    '''
+    try:
+        base_type, _ = parse_type(column_type)
+    except Invalid_Command:
+        return False
+
+    return base_type in INTEGER_TYPES or base_type in FLOAT_TYPES
+
+
+def column_constraints(column_type):
+    '''
+    This function finds the constraints written after a column type.
+
+    Returns: list of constraints
+    '''
+    column_type = ' '.join(column_type.lower().split())
+
+    return [constraint for constraint in CONSTRAINTS if constraint in column_type]
+
+
+def coerce_value(value, column_name, column_type):
+    '''
+    This function checks that a single formatted value matches the column type and converts it if needed.
+    Unquoted NULL is stored as an empty value.
+
+    Returns: value with the column's datatype
+    '''
+    if value is None or (isinstance(value, str) and value.lower() == 'null'):
+        return None
+
+    base_type, length = parse_type(column_type)
+
+    # Empty numeric values are stored as nulls
+    if value == '' and (base_type in INTEGER_TYPES or base_type in FLOAT_TYPES):
+        return None
+
+    try:
+        if base_type in INTEGER_TYPES:
+            if isinstance(value, float) and not value.is_integer():
+                raise ValueError
+            return int(value)
+
+        if base_type in FLOAT_TYPES:
+            return float(value)
+
+    except ValueError:
+        raise Invalid_Command(f'Value {value} is not valid for column {column_name} {column_type}.\n')
+
+    if base_type in STRING_TYPES:
+        value = str(value)
+        if length is not None and len(value) > length:
+            raise Invalid_Command(f'Value {value} is longer than {length} characters for column {column_name}.\n')
+
+    return value
+
+
+def coerce_rows(rows, schema):
+    '''
+    This function checks every value of a list of rows against the schema.
+
+    Returns: list of rows with converted values
+    '''
+    columns = list(schema.keys())
+    coerced_rows = list()
+
+    for row in rows:
+        if len(row) != len(columns):
+            raise Invalid_Command(f'Table has {len(columns)} columns but {len(row)} values were given.\n')
+
+        coerced_rows.append([coerce_value(value, column, schema[column]) for value, column in zip(row, columns)])
+
+    return coerced_rows
+
+
+def coerce_table(table_df, schema):
+    '''
+    This function checks a whole DataFrame of string values against the schema using vectorized conversions.
+    Columns are matched by name and returned in schema order.
+
+    Returns: DataFrame with converted columns
+    '''
+    table_df = table_df.rename(columns = {col: col.strip().lower() for col in table_df.columns})
+    columns = list(schema.keys())
+
+    if sorted(table_df.columns) != sorted(columns):
+        raise Invalid_Command(f'Columns {", ".join(table_df.columns)} do not match table columns {", ".join(columns)}.\n')
+
+    coerced_df = pd.DataFrame(index = table_df.index)
+    for column in columns:
+        values = table_df[column]
+        present = values.notna() & (values.astype(str).str.lower() != 'null')
+        base_type, length = parse_type(schema[column])
+
+        if base_type in INTEGER_TYPES or base_type in FLOAT_TYPES:
+            numbers = pd.to_numeric(values.where(present), errors = 'coerce')
+            invalid = present & numbers.isna()
+
+            # Integers must not have a fractional part
+            if base_type in INTEGER_TYPES:
+                invalid |= present & numbers.notna() & (numbers % 1 != 0)
+
+            converted = numbers
+
+        elif base_type in STRING_TYPES:
+            converted = values.where(present).astype(object)
+            invalid = present & (values.astype(str).str.len() > length) if length is not None else present & False
+
+        else:
+            converted = values.where(present)
+            invalid = present & False
+
+        # Reports the first row that does not match the column type
+        if invalid.any():
+            row_number = int(invalid.to_numpy().nonzero()[0][0]) + 1
+            raise Invalid_Command(f'Row {row_number} value {values[invalid].iloc[0]} is not valid for column {column} {schema[column]}.\n')
+
+        # Nullable integers are written without a decimal point
+        if base_type in INTEGER_TYPES:
+            converted = converted.astype('Int64')
+
+        coerced_df[column] = converted
+
+    return coerced_df
+
+
+def read_dtypes(schema):
+    '''
+    This function maps the schema types to the dtypes the CSV parser should use so it does not have to infer them.
+    Strings are parsed straight into categories, which is faster and smaller than parsing them as strings,
+    and integers are left to the parser since they are narrowed afterwards by apply_schema_types.
+
+    Returns: dictionary of column name to dtype
+    '''
+    dtypes = dict()
+    for column, column_type in schema.items():
+        try:
+            base_type, _ = parse_type(column_type)
+        except Invalid_Command:
+            continue
+
+        if base_type in FLOAT_TYPES:
+            dtypes[column] = 'float32' if base_type == 'real' else 'float64'
+        elif base_type in STRING_TYPES:
+            dtypes[column] = 'category'
+
+    return dtypes
+
+
+def integer_dtype(base_type, values):
+    '''
+    This function picks the smallest integer dtype that is at least as wide as the SQL type and fits all values.
+
+    Returns: dtype name such as int32
+    '''
+    for bits in (16, 32, 64):
+        if bits < INTEGER_BITS.get(base_type, 64):
+            continue
+
+        info = np.iinfo(f'int{bits}')
+        if len(values) == 0 or (values.min() >= info.min and values.max() <= info.max):
+            return f'int{bits}'
+
+    return 'int64'
+
+
+def apply_schema_types(table_df, schema):
+    '''
+    This function converts the columns of a table to compact dtypes based on the schema:
+    integers use the width of their SQL type (nullable Int if there are missing values), real is float32,
+    other floats are float64 and strings with few distinct values become categories.
+    Columns whose values do not match their type keep the type they were read with.
+
+    Returns: DataFrame
+    '''
+    for column in table_df.columns:
+        if column not in schema:
+            continue
+
+        series = table_df[column]
+        try:
+            base_type, _ = parse_type(schema[column])
+
+            if base_type in INTEGER_TYPES:
+                numbers = pd.to_numeric(series)
+                present = numbers.dropna()
+
+                # Keeps columns that hold fractions as they are
+                if not pd.api.types.is_integer_dtype(numbers) and (present % 1 != 0).any():
+                    continue
+
+                dtype = integer_dtype(base_type, present)
+                if len(present) < len(numbers):
+                    dtype = dtype.capitalize()
+                table_df[column] = numbers.astype(dtype)
+
+            elif base_type in FLOAT_TYPES:
+                table_df[column] = pd.to_numeric(series).astype('float32' if base_type == 'real' else 'float64')
+
+            elif base_type in STRING_TYPES:
+                few_distinct = len(series) >= CATEGORY_MIN_ROWS and series.nunique() <= CATEGORY_MAX_RATIO * len(series)
+
+                if isinstance(series.dtype, pd.CategoricalDtype):
+                    # Categories that were parsed as numbers are turned back into strings
+                    if not pd.api.types.is_string_dtype(series.cat.categories):
+                        series = series.cat.rename_categories(series.cat.categories.astype(str))
+
+                    # Columns with many distinct values are plain strings, keeping missing values
+                    if not few_distinct:
+                        series = series.astype(series.cat.categories.dtype)
+
+                else:
+                    if not pd.api.types.is_string_dtype(series):
+                        series = series.astype(object).where(series.isna(), series.astype(str))
+
+                    if few_distinct:
+                        series = series.astype('category')
+
+                table_df[column] = series
+
+        except (ValueError, TypeError, Invalid_Command):
+            continue
+
+    return table_df
+
+
+def assign_values(table_df, filter_series, column, value):
+    '''
+    This function sets a column to a value for the rows selected by filter_series.
+    New values are added to the categories of categorical columns, integer columns are widened or made nullable
+    if the value does not fit, and None is stored as a missing value.
+
+    Returns: None
+    '''
+    series = table_df[column]
+
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        if value is not None and value not in series.cat.categories:
+            table_df[column] = series.cat.add_categories([value])
+
+    elif pd.api.types.is_integer_dtype(series) and (value is None or isinstance(value, int)):
+        dtype = series.dtype.name.lower()
+        if value is not None and not (np.iinfo(dtype).min <= value <= np.iinfo(dtype).max):
+            dtype = 'int64'
+        if value is None or series.isna().any():
+            dtype = dtype.capitalize()
+        table_df[column] = series.astype(dtype)
+
+    table_df.loc[filter_series, column] = value
+
+    return None
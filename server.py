@@ -0,0 +1,193 @@
+'''
+Server mode, started with `python manager.py --serve [address]`. The address is host:port (127.0.0.1:4570 by default)
+or the path of a Unix socket. The server keeps one process running, so modules are imported once and the table
+cache, indexes and write-ahead log stay open between commands. The protocol is described in client.py. An HTTP GET
+on the same address, such as http://127.0.0.1:4570/metrics, gets the statement metrics in the Prometheus text format
+(see metrics.py).
+
+Every connection is a session with its own database and transactions. Connections are served by an asyncio event
+loop, and commands run one at a time in one worker thread, since the table cache and the other state of the engine are
+not shared safely between threads. As all sessions run in the same thread, a lock held by the transaction of another
+session fails at once with `Table <name> is locked.` instead of waiting.
+'''
+
+import io
+import json
+import socket
+import asyncio
+import itertools
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import sql_commands as sql
+from errors import Invalid_Command
+from client import parse_address
+from metrics import statement_metrics
+
+
+class Session:
+    '''
+    One client connection. database is the database selected with USE, prepared the statements prepared with
+    PREPARE and results the tables returned by the command that is running.
+    '''
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.database = ''
+        self.prepared = dict()
+        self.results = list()
+
+
+def table_rows(table_df):
+    '''
+    This function converts a table to column names and rows of JSON values. Missing values become null.
+
+    Returns: {'columns': [...], 'rows': [[...], ...]}
+    '''
+    values = table_df.astype(object).where(table_df.notna(), None)
+
+    return {'columns': [str(column) for column in table_df.columns], 'rows': values.values.tolist()}
+
+
+def run_statement(session, sql_text):
+    '''
+    This function runs one command of a session in the worker thread, capturing what it prints.
+
+    Returns: response dictionary
+    '''
+    session.results = list()
+    output = io.StringIO()
+    response = {'ok': True}
+
+    sql.sessions.session = session
+    try:
+        with contextlib.redirect_stdout(output):
+            session.database = sql.execute_command(sql_text, session.database)
+    except Invalid_Command as ex:
+        response = {'ok': False, 'error': str(ex).strip()}
+    # Keeps the server running if a command fails in an unexpected way
+    except Exception as ex:
+        response = {'ok': False, 'error': f'{type(ex).__name__}: {ex}'}
+    finally:
+        sql.sessions.session = None
+
+    response.update(output = output.getvalue(), database = session.database,
+                    results = [table_rows(table_df) for table_df in session.results],
+                    transaction = sql.transaction_log(sql.DATABASE_DIR).latest(session.id) is not None)
+    session.results = list()
+
+    return response
+
+
+def close_session(session):
+    '''
+    This function rolls back the transactions a client left open when it disconnected.
+
+    Returns: None
+    '''
+    while sql.transaction_log(sql.DATABASE_DIR).latest(session.id) is not None:
+        run_statement(session, 'rollback;')
+
+    return None
+
+
+def metrics_response(request_line):
+    '''
+    This function answers an HTTP GET request with the statement metrics if it asks for /metrics or /.
+
+    Returns: HTTP response bytes
+    '''
+    parts = request_line.decode('latin-1').split()
+    path = parts[1].split('?')[0] if len(parts) > 1 else ''
+
+    if path in ('/', '/metrics'):
+        status, content_type, body = '200 OK', 'text/plain; version=0.0.4', statement_metrics.prometheus_text()
+    else:
+        status, content_type, body = '404 Not Found', 'text/plain', 'Not found.\n'
+
+    body = body.encode()
+    header = f'HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n'
+
+    return header.encode() + body
+
+
+class Database_Server:
+    '''
+    Server accepting commands from many clients. executor is the worker thread running the commands.
+    '''
+
+    def __init__(self, address):
+        self.address = address
+        self.executor = ThreadPoolExecutor(max_workers = 1)
+        self.session_ids = itertools.count(1)
+
+    async def handle(self, reader, writer):
+        '''
+        This function serves one client until it disconnects.
+
+        Returns: None
+        '''
+        loop = asyncio.get_running_loop()
+        session = Session(next(self.session_ids))
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                # Answers an HTTP GET, such as a Prometheus scrape, after reading its headers and closes the connection
+                if line.startswith(b'GET '):
+                    while (await reader.readline()).strip():
+                        pass
+                    writer.write(metrics_response(line))
+                    await writer.drain()
+                    break
+
+                try:
+                    sql_text = json.loads(line)['sql']
+                except (ValueError, KeyError, TypeError):
+                    response = {'ok': False, 'error': 'Request must be a JSON object with a sql field.'}
+                else:
+                    response = await loop.run_in_executor(self.executor, run_statement, session, sql_text)
+
+                writer.write(json.dumps(response, default = str).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            await loop.run_in_executor(self.executor, close_session, session)
+            writer.close()
+
+        return None
+
+    async def serve(self):
+        '''
+        This function listens on the address of the server until it is stopped.
+
+        Returns: None
+        '''
+        family, address = parse_address(self.address)
+        if family == socket.AF_UNIX:
+            server = await asyncio.start_unix_server(self.handle, path = address)
+        else:
+            server = await asyncio.start_server(self.handle, address[0], address[1])
+
+        print(f'Listening on {self.address}.', flush = True)
+
+        async with server:
+            await server.serve_forever()
+
+
+def serve(address):
+    '''
+    This function runs the server until it is interrupted.
+
+    Returns: None
+    '''
+    try:
+        asyncio.run(Database_Server(address).serve())
+    except KeyboardInterrupt:
+        pass
+
+    return None
@@ -1,41 +1,87 @@
 import os
 import shutil
+import re
 import json
-import operator
+import time
+import threading
+import contextlib
 
 import pandas as pd
 import numpy as np
 
-DATABASE_DIR = 'databases'
+from errors import Invalid_Command
+from table_cache import table_cache, CACHE_MEMORY_BUDGET
+from joins import join_tables, cross_join, choose_join, smaller_side
+from parallel import filter_rows
+from conditions import condition_mask, condition_operands, condition_subjects, conjuncts, conjoin, condition_text, \
+    compile_condition, planned_index, lookup_detail
+from aggregates import Aggregate_Query, is_aggregate_query, aggregate_table, aggregate_chunks
+from ordering import check_order_columns, order_rows, order_chunks
+from sql_parser import parse_statement, parse_cache, bind, literal_text
+from schema import load_schema, schema_file, coerce_value, coerce_rows, coerce_table, assign_values, column_constraints, \
+    is_number_type
+from storage import read_table, write_table, read_columns, append_rows, remove_table, table_file, \
+    set_database_storage, read_chunks, table_bytes, CHUNK_ROWS, DATABASE_DIR
+from wal import transaction_log
+from explain import Operator, Query_Profile, plan_operator, profiled, format_plan
+from metrics import statement_metrics, count_rows
+from workspace import transaction_workspace, discard_workspace
+from lock_manager import lock_manager, row_keys, rows_request, range_request, values_request, table_request, \
+    Lock_Conflict, Deadlock_Detected, LOCK_TIMEOUT_SECONDS
+from indexes import create_index, drop_index, drop_column_indexes, find_table_index, table_stamp, \
+    append_index_rows, update_index_rows, delete_index_rows, forget_directory, check_unique_rows, check_unique_update
+from table_stats import analyze_table, load_stats, drop_stats, refresh_stats, add_stats_column, append_stats_rows, \
+    update_stats_rows, delete_stats_rows, column_map, estimate_rows, column_distinct, join_rows, group_rows, DEFAULT_RANGE
+
+# Tables with more bytes on disk are read in chunks by SELECT instead of being loaded whole
+STREAM_BYTES = int(os.environ.get('SQL_STREAM_BYTES', CACHE_MEMORY_BUDGET))
+
+# Server session whose command runs in this thread, see server.py
+sessions = threading.local()
+
+# Statements prepared with PREPARE from the command line, server sessions keep their own
+prepared_statements = dict()
+
+
+def current_session():
+    '''
+    This function gets the server session whose command is running in this thread.
+
+    Returns: Session or None when running from the command line
+    '''
+    return getattr(sessions, 'session', None)
+
+
+def session_id():
+    '''
+    This function gets the id of the server session whose command is running in this thread, which keeps the
+    transactions of the clients of one server apart.
+
+    Returns: session id or None when running from the command line
+    '''
+    session = current_session()
+
+    return None if session is None else session.id
+
 
-class Invalid_Command(Exception):
-    '''Exception for when a command is invalid'''
-    pass
+def session_statements():
+    '''
+    This function gets the prepared statements of the server session running in this thread, or of the command line.
+
+    Returns: dictionary of statement name to Statement
+    '''
+    session = current_session()
+
+    return prepared_statements if session is None else session.prepared
 
 
 def begin_transaction(database, **kwargs):
     '''
-    This function will begin new transactions. It looks for a transactions file and if it does not exist, it will be created.
+    This function will begin a new transaction by appending a begin record to the write-ahead log.
 
     Returns: database
     '''
-    # Looks for transactions file
-    transactions_file = os.path.join(DATABASE_DIR,'transactions_log.json')
-    if not os.path.isfile(transactions_file):
-        transaction_dict = {
-            1: list()
-        }
-    else:
-        with open(transactions_file,'r') as f:
-            transaction_dict = json.load(f)
-            transaction_dict = {int(k):v for k,v in transaction_dict.items()}
-        
-        # Adds new key for new transaction and makes the transaction id one higher
-        transaction_dict[max(transaction_dict.keys()) + 1] = list()
-
-    # Exports transactions dictionary to JSON file in the database folder
-    with open(transactions_file,'w') as f:
-        json.dump(transaction_dict,f)
+    transaction_log(DATABASE_DIR).begin(session_id())
     
     print('Transaction began.\n')
 
@@ -44,46 +90,534 @@ def begin_transaction(database, **kwargs):
 
 def commit_transaction(database, **kwargs):
     '''
-    This function will commit the most recently started transactions. It looks for a transactions file, reads it in, changes altered files names to overwrite originals and deletes key from dictionary.
+    This function will commit the most recently started transaction. Each table it modified is written once from
+    its workspace to the lock file, then the commit record is forced to disk before the lock files are renamed to
+    overwrite the originals, so the commit is finished by recovery after a crash. Changes to tables another
+    transaction committed to in the meantime are merged. The locks of the transaction are released.
 
     Returns: database
     '''
-    # Looks for transactions file
-    transactions_file = os.path.join(DATABASE_DIR,'transactions_log.json')
-    if not os.path.isfile(transactions_file):
-        raise Invalid_Command('No active transactions.')
-    else:
-        with open(transactions_file,'r') as f:
-            transaction_dict = json.load(f)
-            transaction_dict = {int(k):v for k,v in transaction_dict.items()}
+    log = transaction_log(DATABASE_DIR)
+    transaction = log.latest(session_id())
 
-    if len(transaction_dict) == 0:
+    if transaction is None:
         raise Invalid_Command('No active transactions.\n')
 
-    if len(transaction_dict[max(transaction_dict.keys())]) == 0:
-        transaction_dict.pop(max(transaction_dict.keys()), None)
-
-         # Exports transactions dictionary to JSON file in the database folder
-        with open(transactions_file,'w') as f:
-            json.dump(transaction_dict,f)
+    if len(log.tables(transaction)) == 0:
+        log.abort(transaction)
+        end_transaction(transaction_workspace(log, transaction))
         raise Invalid_Command('Nothing to commit. Transaction aborted.\n')
 
-    else:
-        for file_path in transaction_dict[max(transaction_dict.keys())]:
-
-            os.rename(file_path, file_path.replace('_lock',''))
-    
-    transaction_dict.pop(max(transaction_dict.keys()), None)
+    workspace = transaction_workspace(log, transaction)
+    try:
+        workspace.commit()
+    finally:
+        end_transaction(workspace)
 
-    # Exports transactions dictionary to JSON file in the database folder
-    with open(transactions_file,'w') as f:
-        json.dump(transaction_dict,f)
+    # Computes again the statistics of the analyzed tables the transaction changed from the committed tables
+    for table_path in workspace.tables:
+        refresh_stats(table_path, workspace.snapshots[table_path][1])
     
     print('Transaction committed.\n')
     
     return database
 
 
+def rollback_transaction(database, **kwargs):
+    '''
+    This function will roll back the most recently started transaction. Its workspace is dropped and its locks
+    are released, and as nothing is written before commit no table is changed.
+
+    Returns: database
+    '''
+    log = transaction_log(DATABASE_DIR)
+    transaction = log.latest(session_id())
+
+    if transaction is None:
+        raise Invalid_Command('No active transactions.\n')
+
+    log.abort(transaction)
+    end_transaction(transaction_workspace(log, transaction))
+
+    print('Transaction rolled back.\n')
+
+    return database
+
+
+def end_transaction(workspace):
+    '''
+    This function forgets the workspace of a transaction that was committed or aborted and releases its locks.
+
+    Returns: None
+    '''
+    discard_workspace(workspace.txn)
+    lock_manager(DATABASE_DIR).release(workspace.owner)
+
+    return None
+
+
+def recover_transactions():
+    '''
+    This function runs recovery of the write-ahead log when the program starts, finishing interrupted commits
+    and aborting transactions of processes that are no longer running.
+
+    Returns: None
+    '''
+    if os.path.isdir(DATABASE_DIR):
+        transaction_log(DATABASE_DIR).open()
+
+    return None
+
+
+def current_workspace():
+    '''
+    This function gets the workspace of the most recently started transaction of this process.
+
+    Returns: Transaction_Workspace or None if no transaction is active
+    '''
+    log = transaction_log(DATABASE_DIR)
+    transaction = log.latest(session_id())
+
+    if transaction is None:
+        return None
+
+    return transaction_workspace(log, transaction)
+
+
+def load_table(table_path, columns=None, workspace=None):
+    '''
+    This function reads a table. Inside a transaction the table is read from the transaction's snapshot so
+    every statement of the transaction sees the same version of the table and its own changes.
+
+    Returns: DataFrame
+    '''
+    if workspace is not None:
+        table_df = workspace.read(table_path, columns)
+    else:
+        table_df = read_table(table_path, columns)
+    count_rows(read = len(table_df))
+
+    return table_df
+
+
+def index_path(table_path, workspace):
+    '''
+    This function gets the path to pass to where so it can use the indexes of the table. The indexes match the
+    committed table, so they are not used for a snapshot that is modified or older than the committed table.
+
+    Returns: table path or None
+    '''
+    if workspace is not None and not workspace.current(table_path):
+        return None
+
+    return table_path
+
+
+def table_columns(table_path, workspace=None):
+    '''
+    This function gets the column names of a table, from the snapshot if the active transaction read it.
+
+    Returns: list of column names
+    '''
+    if workspace is not None and table_path in workspace.snapshots:
+        return workspace.columns(table_path)
+
+    return read_columns(table_path)
+
+
+def append_to_workspace(workspace, table_path, rows):
+    '''
+    This function adds rows to the copy of a table in the workspace of the active transaction, reading the table
+    into the workspace the first time. Rows can be a list of row lists or a DataFrame with the table's columns.
+
+    Returns: None
+    '''
+    table_df = load_table(table_path, workspace = workspace)
+    if not isinstance(rows, pd.DataFrame):
+        rows = pd.DataFrame(rows, columns = table_df.columns)
+
+    # Checks that no PRIMARY KEY or UNIQUE value is repeated, including rows added earlier in the transaction
+    check_unique_rows(table_path, rows, table_df)
+    workspace.put(table_path, pd.concat([table_df, rows], ignore_index = True))
+
+    return None
+
+
+def show_table(table_df):
+    '''
+    This function prints the result of a query. The result is also kept for the server session running the
+    command, so it can be sent to the client as rows.
+
+    Returns: None
+    '''
+    print(table_df, '\n')
+
+    session = current_session()
+    if session is not None:
+        session.results.append(table_df)
+
+    return None
+
+
+def show_chunks(chunks, columns):
+    '''
+    This function prints the result of a query one chunk of rows at a time as the chunks are produced, with the
+    column names before the first chunk. The chunks are also kept for the server session running the command.
+
+    Returns: number of rows printed
+    '''
+    session = current_session()
+    kept = list()
+    row_count = 0
+    widths = dict()
+    index_width = 0
+
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        if session is not None:
+            kept.append(chunk)
+
+        # Keeps every column at least as wide as in the earlier chunks so the rows stay aligned
+        for column in chunk.columns:
+            formatted = chunk[[column]].to_string(index = False).split('\n')
+            widths[column] = max(widths.get(column, 0), max(len(line.strip()) for line in formatted))
+        labels = chunk.index.astype(str)
+        index_width = max(index_width, int(labels.str.len().max()))
+        text = chunk.set_axis(labels.str.rjust(index_width), axis = 0).to_string(col_space = {column: width + 1 for column, width in widths.items()})
+
+        # Only the first chunk prints the column names
+        print(text if row_count == 0 else text.split('\n', 1)[1], flush = True)
+        row_count += len(chunk)
+
+    if row_count == 0:
+        print(pd.DataFrame(columns = columns), '\n')
+    else:
+        print(f'\n[{row_count} rows x {len(columns)} columns] \n')
+
+    if session is not None:
+        session.results.append(pd.concat(kept) if kept else pd.DataFrame(columns = columns))
+
+    return row_count
+
+
+def scan_detail(table_name, alias, columns):
+    '''
+    This function describes the table and the columns a scan operator of a query plan reads.
+
+    Returns: string
+    '''
+    name = table_name if alias in (None, table_name) else f'{table_name} {alias}'
+
+    return f'{name} (all columns)' if columns is None else f'{name} (columns: {", ".join(columns)})'
+
+
+def order_detail(order_by, limit, offset):
+    '''
+    This function names and describes the operator of a query plan applying ORDER BY, LIMIT and OFFSET.
+
+    Returns: (name, detail) or None if the query has none of these clauses
+    '''
+    if not order_by and limit is None and not offset:
+        return None
+
+    # Without ORDER BY the operator is named Limit, so the limit is written without the keyword
+    parts = list()
+    if limit is not None:
+        parts.append(f'limit {limit}' if order_by else str(limit))
+    if offset:
+        parts.append(f'offset {offset}')
+
+    if not order_by:
+        return 'Limit', ' '.join(parts)
+
+    keys = ', '.join(column if ascending else f'{column} desc' for column, ascending in order_by)
+
+    return 'Top-N Sort' if limit is not None else 'Sort', ' '.join([f'by {keys}'] + parts)
+
+
+def aggregate_detail(query):
+    '''
+    This function describes the aggregates and groups of the Aggregate operator of a query plan.
+
+    Returns: string
+    '''
+    calls = ', '.join(f'{function}({column})' for function, column in query.calls)
+    groups = f'group by {", ".join(query.group_by)}' if query.group_by else ''
+
+    return f'{calls} {groups}'.strip()
+
+
+def join_detail(how, left_key, right_key, algorithm=None, build_side=None):
+    '''
+    This function names and describes the join operator of a query plan. Without algorithm the join is planned but
+    not run yet, so the algorithm is not known, and build_side is the side the cost model expects to hash, if any.
+
+    Returns: (name, detail)
+    '''
+    if how == 'cross' or left_key is None:
+        return 'Cross Join', ''
+
+    detail = f'{"outer" if how == "full" else how} on {left_key} = {right_key}'
+    build_table = None if build_side is None else (left_key if build_side == 'left' else right_key).split('.')[0]
+    if algorithm is None:
+        hash_join = 'hash join' if build_table is None else f'hash join with hash table on {build_table}'
+        return 'Join', detail + f' (merge join if both tables are sorted on the keys, else {hash_join})'
+    if algorithm == 'sort_merge':
+        return 'Merge Join', detail
+
+    return 'Hash Join', f'{detail}, hash table on {build_table}'
+
+
+def scan_table(operator, table_path, columns=None, workspace=None, alias=None):
+    '''
+    This function reads a table as a scan operator of the query plan, counting its rows and the size of the table
+    files if they were read from disk instead of the table cache. With an alias the alias is added to the columns as
+    a prefix.
+
+    Returns: DataFrame
+    '''
+    misses = table_cache.misses
+    with operator.measure():
+        table_df = load_table(table_path, columns, workspace)
+        if alias is not None:
+            table_df = table_df.add_prefix(alias + '.')
+
+    operator.count(rows_out = len(table_df), bytes_read = table_bytes(table_path) if table_cache.misses > misses else 0)
+
+    return table_df
+
+
+def filter_table(table_df, where_command, table_path=None, inputs=None):
+    '''
+    This function keeps the rows of a table matching a WHERE condition as a Filter operator of the query plan.
+    If table_path is given, table_df holds every row of that table and the condition can use its indexes.
+
+    Returns: (DataFrame, Operator)
+    '''
+    operator = plan_operator('Filter', condition_text(where_command), inputs)
+    with operator.measure():
+        table_df = filter_rows(table_df, where(where_command, table_df, table_path, operator))
+    operator.count(rows_out = len(table_df))
+
+    return table_df, operator
+
+
+def join_scans(left_table_df, right_table_df, left_key, right_key, how, inputs):
+    '''
+    This function joins two tables as the join operator of the query plan, named after the algorithm used. Tables
+    without keys are cross joined.
+
+    Returns: DataFrame
+    '''
+    operator = plan_operator('Join', inputs = inputs)
+    with operator.measure():
+        if how == 'cross' or left_key is None:
+            operator.name, operator.detail = join_detail('cross', None, None)
+            table_df = cross_join(left_table_df, right_table_df)
+        else:
+            algorithm = choose_join(left_table_df, right_table_df, left_key, right_key)
+            operator.name, operator.detail = join_detail(how, left_key, right_key, algorithm,
+                                                         smaller_side(len(left_table_df), len(right_table_df)))
+            table_df = join_tables(left_table_df, right_table_df, left_key, right_key, how = how, algorithm = algorithm)
+    operator.count(rows_out = len(table_df))
+
+    return table_df
+
+
+def order_table(table_df, order_by=(), limit=None, offset=0):
+    '''
+    This function applies ORDER BY, LIMIT and OFFSET to a table as an operator of the query plan.
+
+    Returns: DataFrame
+    '''
+    ordering = order_detail(order_by, limit, offset)
+    if ordering is None:
+        return table_df
+
+    operator = plan_operator(*ordering)
+    with operator.measure():
+        table_df = order_rows(table_df, order_by, limit, offset)
+    operator.count(rows_out = len(table_df))
+
+    return table_df
+
+
+def output_table(table_df, select_items):
+    '''
+    This function prints the result of a query as the Output operator of the query plan.
+
+    Returns: None
+    '''
+    operator = plan_operator('Output', ', '.join(select_items))
+    with operator.measure():
+        show_table(table_df)
+    operator.count(rows_out = len(table_df))
+
+    return None
+
+
+def measured_chunks(chunks, operator):
+    '''
+    This function passes on a stream of chunks, measuring the time taken to produce each chunk as part of an operator
+    of the query plan and counting its rows.
+
+    Returns: generator of DataFrames
+    '''
+    chunks = iter(chunks)
+    while True:
+        with operator.measure():
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        operator.count(rows_out = len(chunk))
+        yield chunk
+
+
+def aggregate_groups(query, table_df=None, chunks=None):
+    '''
+    This function computes the aggregates of a query on a whole table, or on a stream of chunks, as the Aggregate
+    operator of the query plan.
+
+    Returns: DataFrame
+    '''
+    operator = plan_operator('Aggregate', aggregate_detail(query))
+    with operator.measure():
+        result_df = aggregate_table(query, table_df) if chunks is None else aggregate_chunks(query, chunks)
+    operator.count(rows_out = len(result_df))
+
+    return result_df
+
+
+def aggregate_result(query, result_df, order_by=(), limit=None, offset=0):
+    '''
+    This function filters the groups of an aggregate query with its HAVING condition, applies ORDER BY and LIMIT
+    to them and takes the SELECT list.
+
+    Returns: DataFrame
+    '''
+    if query.having is not None:
+        result_df = filter_table(result_df, query.having)[0].reset_index(drop = True)
+
+    if order_by or limit is not None or offset:
+        result_df = order_table(result_df, order_by, limit, offset).reset_index(drop = True)
+
+    return result_df[query.items]
+
+
+def streams(table_path, workspace):
+    '''
+    This function checks if a SELECT on one table reads it in chunks. Tables with files larger than STREAM_BYTES are
+    read in chunks, unless a transaction needs a snapshot of them.
+
+    Returns: bool
+    '''
+    return workspace is None and table_bytes(table_path) > STREAM_BYTES
+
+
+def stream_select(table_path, select_items, where_command, columns=None, query=None, order_by=(), limit=None, offset=0):
+    '''
+    This function runs a query on one table that is too large to read at once. The table is read in chunks of
+    rows and each chunk is filtered and projected and its rows printed before the next chunk is read, so memory
+    depends on the size of the chunks and not of the table. columns are the columns the query reads. For an
+    aggregate query, given as query, the partial aggregates of the chunks are merged and only the groups printed.
+    LIMIT without ORDER BY stops reading the table once it has enough rows, and ORDER BY with LIMIT only keeps the
+    first rows of the chunks read so far.
+
+    Returns: None
+    '''
+    table_name = os.path.splitext(os.path.basename(table_path))[0]
+    scan = plan_operator('Chunked Scan', scan_detail(table_name, None, columns) + f' in chunks of {CHUNK_ROWS} rows')
+    scan.count(bytes_read = table_bytes(table_path))
+    row_filter = None if where_command is None else plan_operator('Filter', condition_text(where_command))
+
+    def filtered():
+        for chunk in measured_chunks(read_chunks(table_path, columns), scan):
+            count_rows(read = len(chunk))
+            if row_filter is not None:
+                with row_filter.measure():
+                    chunk = filter_rows(chunk, where(where_command = where_command, table_df = chunk, operator = row_filter))
+                row_filter.count(rows_out = len(chunk))
+            yield chunk
+
+    if query is not None:
+        output_table(aggregate_result(query, aggregate_groups(query, chunks = filtered()), order_by, limit, offset), query.items)
+        return None
+
+    # Checks the selected columns before reading any rows
+    table_columns = read_columns(table_path)
+    if select_items == ['*']:
+        selected = table_columns
+    else:
+        selected = select_items
+        if not all(col_name in table_columns for col_name in selected):
+            raise Invalid_Command(f'Table at least one specified column was not found.\n')
+    check_order_columns(order_by, table_columns)
+
+    chunks = filtered()
+    ordering = order_detail(order_by, limit, offset)
+    if ordering is not None:
+        chunks = measured_chunks(order_chunks(chunks, order_by, limit, offset), plan_operator(*ordering))
+
+    output = plan_operator('Output', ', '.join(select_items))
+    with output.measure():
+        row_count = show_chunks((chunk[selected] for chunk in chunks), selected)
+    output.count(rows_out = row_count)
+
+    return None
+
+
+def statement_owner(workspace):
+    '''
+    This function gets the owner of the locks taken by a command: the active transaction, or the thread running
+    the command if no transaction is active.
+
+    Returns: owner string
+    '''
+    if workspace is not None:
+        return workspace.owner
+
+    return f'{os.getpid()}:{threading.get_ident()}:command'
+
+
+def lock_rows(table_path, table_df, filter_series, workspace, where_command=None, new_values=None):
+    '''
+    This function locks the rows of filter_series before a command changes them, and the range of the WHERE
+    condition so other transactions cannot add rows to it. New values set by the command are checked against the
+    ranges locked by other transactions.
+
+    Returns: None, raises Lock_Conflict if another transaction holds a conflicting lock
+    '''
+    positions = np.flatnonzero(filter_series.to_numpy(dtype = bool))
+
+    # Rows of a transaction are identified by their values in the transaction's snapshot
+    if workspace is not None:
+        keys = workspace.lock_keys(table_path, positions)
+    else:
+        keys = row_keys(table_df.iloc[positions])
+
+    requests = [rows_request(keys)]
+    if where_command is not None:
+        requests.append(range_request(where_command))
+    if new_values is not None and len(positions) > 0:
+        requests.append(values_request(list(new_values), [list(new_values.values())]))
+
+    lock_manager(DATABASE_DIR).acquire(statement_owner(workspace), table_path, [x for x in requests if x is not None])
+
+    return None
+
+
+def lock_table(table_path, mode, workspace):
+    '''
+    This function locks a whole table in shared (S) or exclusive (X) mode.
+
+    Returns: None, raises Lock_Conflict if another transaction holds a conflicting lock
+    '''
+    lock_manager(DATABASE_DIR).acquire(statement_owner(workspace), table_path, [table_request(mode)])
+
+    return None
+
+
 def format_values(value):
     '''
     This function takes in a string and formats it correctly as a string, float, or int.
@@ -92,7 +626,7 @@ def format_values(value):
     '''
     # Looks for quotes and removes them - keeps as string
     if "'" in value:
-        value = value[value.find("'")+1:value.rfind("'")]
+        value = value[value.find("'")+1:value.rfind("'")].replace("''", "'")
     
     # If no quotes assumes numnber and checks for period then converts to float
     elif '.' in value and str.isdigit(value.replace('.','')):
@@ -113,13 +647,15 @@ def create(command, database, **kwargs):
     if len(command) < 3:
         raise Invalid_Command('Invalid Command entered.\n')
 
-    # Checks if creating database or table
+    # Checks if creating database, table or index
     if command[1] == 'table':
         return create_table(command, database)
     elif command[1] == 'database':
         return create_database(command, database)
+    elif command[1] == 'index' or command[1:3] == ['unique', 'index']:
+        return create_index_command(command, database)
     else:
-        raise Invalid_Command('Can only create a database or table.\n')
+        raise Invalid_Command('Can only create a database, table or index.\n')
 
 
 def drop(command, database, **kwargs):
@@ -130,13 +666,15 @@ def drop(command, database, **kwargs):
     if len(command) < 3:
         raise Invalid_Command('Invalid Command entered.\n')
 
-    # Checks if dropping database or table
+    # Checks if dropping database, table or index
     if command[1] == 'table':
         return drop_table(command, database)
     elif command[1] == 'database':
         return drop_database(command, database)
+    elif command[1] == 'index':
+        return drop_index_command(command, database)
     else:
-        raise Invalid_Command('Can only drop a database or table.\n')
+        raise Invalid_Command('Can only drop a database, table or index.\n')
 
 
 def create_database(command, database, **kwargs):
@@ -157,6 +695,14 @@ def create_database(command, database, **kwargs):
     else:
         raise Invalid_Command(f'Failed to create database {database_name} because it already exists.\n')
 
+    # Saves the storage engine if one was given after the STORAGE keyword, else the database uses CSV files
+    if 'storage' in command:
+        try:
+            set_database_storage(database_path, command[command.index('storage')+1])
+        except (IndexError, Invalid_Command):
+            shutil.rmtree(database_path)
+            raise Invalid_Command(f'Failed to create database {database_name} because the storage engine is not valid.\n')
+
     print(f'Database {database_name} created.\n')
 
     return database
@@ -164,7 +710,7 @@ def create_database(command, database, **kwargs):
 
 def create_table(command, database, **kwargs):
     '''
-    Function checks if the table exists and creates the table (stores as csv) and schema (stores as json)
+    Function checks if the table exists and creates the table (stored with the database's storage engine) and schema (stores as json)
 
     Returns: database name
     '''
@@ -175,7 +721,7 @@ def create_table(command, database, **kwargs):
     table_name = command[2]
     if '(' in table_name:
         table_name = table_name.split('(')[0]
-    table_path = os.path.join(DATABASE_DIR,database,f'{table_name}.csv')
+    table_path = table_file(os.path.join(DATABASE_DIR,database), table_name)
 
     # Checks if table exists
     if not os.path.isfile(table_path):
@@ -189,25 +735,53 @@ def create_table(command, database, **kwargs):
         table_schema = dict()
 
         # Loops through each column and extracts the name and data type and store them in table_schema dict
+        # Constraints after the data type such as PRIMARY KEY are kept as part of the type
+        table_constraints = list()
         for col in command_schema:
             col = col.strip()
+
+            # Finds constraints on their own formatted as PRIMARY KEY (column_name) or UNIQUE (column_name)
+            constraint = re.fullmatch(r'(primary key|unique)\s*\(\s*(\w+)\s*\)', ' '.join(col.split()))
+            if constraint is not None:
+                table_constraints.append(constraint.groups())
+                continue
+
             try:
-                col_name = col.split(' ')[0]
-                col_type = col.split(' ')[1]
+                col_name = col.split()[0]
+                col_type = ' '.join(col.split()[1:])
+                if col_type == '':
+                    raise IndexError
 
             except IndexError:
                 raise Invalid_Command('No column type provided.\n')
             table_schema[col_name] = col_type
 
+        # Adds the constraints given on their own to the type of their column
+        for constraint, col_name in table_constraints:
+            if col_name not in table_schema:
+                raise Invalid_Command(f'Column {col_name} does not exists.\n')
+            if constraint not in column_constraints(table_schema[col_name]):
+                table_schema[col_name] += f' {constraint}'
+
+        # Finds the columns that need a unique index
+        key_columns = [col for col, col_type in table_schema.items() if column_constraints(col_type)]
+        if sum('primary key' in column_constraints(table_schema[col]) for col in key_columns) > 1:
+            raise Invalid_Command('A table can only have one primary key.\n')
+
         # Creates empty dataframe with specified columns
         table = pd.DataFrame(columns = table_schema.keys())
         # Exports table DataFrame to csv in the database folder
-        table.to_csv(table_path, index = False)
+        write_table(table, table_path)
 
         # Exports schema dictionary to JSON file in the database folder
         with open(os.path.join(DATABASE_DIR,database,f'{table_name}_schema.json'),'w') as f:
             json.dump(table_schema,f)
 
+        # Creates the unique index that enforces each PRIMARY KEY and UNIQUE column
+        for col in key_columns:
+            constraint = column_constraints(table_schema[col])[0]
+            create_index(table_path, 'primary_key' if constraint == 'primary key' else f'{col}_unique', col, constraint=constraint)
+
     # If the table already exists raise exception
     else:
         raise Invalid_Command(f'Failed to create table {table_name} because it already exists.\n')
@@ -229,6 +803,8 @@ def drop_database(command, database, **kwargs):
 
     if os.path.isdir(database_path):
         shutil.rmtree(database_path)
+        table_cache.invalidate_directory(database_path)
+        forget_directory(database_path)
     else:
         raise Invalid_Command(f'Failed to delete database {database_name} because it does not exists.\n')
 
@@ -237,46 +813,208 @@ def drop_database(command, database, **kwargs):
     return database
 
 
-def drop_table(command, database, **kwargs):
+def drop_table(command, database, **kwargs):
+    '''
+    Function checks if table exists and deletes it.
+
+    Returns: database name
+    '''
+    table_name = command[2] # Extracts database name
+    table_path = table_file(os.path.join(DATABASE_DIR,database), table_name)
+    schema_path = os.path.join(DATABASE_DIR,database,f'{table_name}_schema.json')
+
+    # Checks if csv and json file exist and deletes both
+    if os.path.isfile(table_path) & os.path.isfile(schema_path):
+        drop_column_indexes(table_path)
+        drop_stats(table_path)
+        remove_table(table_path)
+        os.remove(schema_path)
+    else:
+        raise Invalid_Command(f'Failed to delete table {table_name} because it does not exists.\n')
+
+    print(f'Table {table_name} deleted.\n')
+
+    # Returns database so we can continue using it
+    return database
+
+
+def use_database(command,**kwargs):
+    # Function checks if database exists and returns database name
+
+    # Checks if command is long enough
+    if len(command) < 2:
+        raise Invalid_Command('Invalid Command entered.\n')
+
+    database_name = command[1]
+    # Checks if database exists
+    if os.path.isdir(os.path.join(DATABASE_DIR,database_name)):
+        print(f'Using database {database_name}.\n')
+        return database_name
+    else:
+        raise Invalid_Command(f'Could not find database {database_name}.\n')
+
+
+def create_index_command(command, database, **kwargs):
+    '''
+    This function creates an index on one column of a table. A unique index also stops rows repeating a value of the column.
+    The command is formatted as: CREATE [UNIQUE] INDEX index_name ON table_name(column_name)
+
+    Returns: database name
+    '''
+    if database == '':
+        raise Invalid_Command('No database specified.\n')
+
+    # Finds the table and column names in parentheses after the ON keyword
+    match = re.fullmatch(r'create (unique )?index (\w+) on (\w+)\s*\(\s*(\w+)\s*\)', ' '.join(command))
+    if match is None:
+        raise Invalid_Command('Create index command is invalid.\n')
+    unique, index_name, table_name, column_name = match.groups()
+
+    table_path = table_file(os.path.join(DATABASE_DIR,database), table_name)
+    if not os.path.isfile(table_path):
+        raise Invalid_Command(f'Could not find table {table_name}.\n')
+
+    lock_table(table_path, 'S', current_workspace())
+    create_index(table_path, index_name, column_name, unique=unique is not None)
+
+    print(f'Index {index_name} created on {table_name}({column_name}).\n')
+
+    return database
+
+
+def drop_index_command(command, database, **kwargs):
+    '''
+    This function deletes an index.
+    The command is formatted as: DROP INDEX index_name [ON table_name]
+
+    Returns: database name
+    '''
+    if database == '':
+        raise Invalid_Command('No database specified.\n')
+
+    database_path = os.path.join(DATABASE_DIR,database)
+    index_name = command[2]
+
+    # Looks through the tables of the database if the table was not given
+    if 'on' in command and len(command) > command.index('on')+1:
+        table_name = command[command.index('on')+1]
+    else:
+        table_name = find_table_index(database_path, index_name)
+
+    drop_index(table_file(database_path, table_name), index_name)
+
+    print(f'Index {index_name} deleted.\n')
+
+    return database
+
+
+def analyze_command(command, database, **kwargs):
+    '''
+    This function computes the statistics of a table used by the cost model and saves them next to its schema
+    (see table_stats.py). Tables larger than STREAM_BYTES are read in chunks.
+    The command is formatted as: ANALYZE table_name
+
+    Returns: database name
+    '''
+    if database == '':
+        raise Invalid_Command('No database specified.\n')
+
+    if len(command) != 2:
+        raise Invalid_Command('Analyze command is invalid.\n')
+    table_name = command[1]
+
+    table_path = table_file(os.path.join(DATABASE_DIR,database), table_name)
+    if not os.path.isfile(table_path):
+        raise Invalid_Command(f'Could not find table {table_name}.\n')
+
+    # Statistics describe the committed table, even inside a transaction
+    lock_table(table_path, 'S', current_workspace())
+    chunks = read_chunks(table_path) if table_bytes(table_path) > STREAM_BYTES else [read_table(table_path)]
+    stats = analyze_table(table_path, chunks)
+    count_rows(read = stats['rows'])
+
+    print(f'Table {table_name} analyzed: {stats["rows"]} rows.\n')
+
+    return database
+
+
+def referenced_columns(table_path, alias, identifiers, workspace=None):
     '''
-    Function checks if table exists and deletes it.
+    This function finds the columns of a table that are used in the clauses of a query so only those columns are read.
+    identifiers are the names the parser found outside FROM. Columns of a table with an alias must be written as
+    alias.column in the query.
 
-    Returns: database name
+    Returns: list of column names
     '''
-    table_name = command[2] # Extracts database name
-    table_path = os.path.join(DATABASE_DIR,database,f'{table_name}.csv')
-    schema_path = os.path.join(DATABASE_DIR,database,f'{table_name}_schema.json')
+    columns = table_columns(table_path, workspace)
 
-    # Checks if csv and json file exist and deletes both
-    if os.path.isfile(table_path) & os.path.isfile(schema_path):
-        os.remove(table_path)
-        os.remove(schema_path)
+    if alias:
+        needed = [col for col in columns if f'{alias}.{col}' in identifiers]
     else:
-        raise Invalid_Command(f'Failed to delete table {table_name} because it does not exists.\n')
+        needed = [col for col in columns if col in identifiers]
 
-    print(f'Table {table_name} deleted.\n')
+    # Reads at least one column so the number of rows is kept
+    return needed if needed else columns[:1]
 
-    # Returns database so we can continue using it
-    return database
 
+def query_text_columns(statement, database):
+    '''
+    This function finds the columns of the tables of a query whose schema type does not hold numbers, with the alias
+    as prefix when tables are joined.
 
-def use_database(command,**kwargs):
-    # Function checks if database exists and returns database name
+    Returns: list of column names
+    '''
+    texts = list()
+    for table_name, alias in statement.tables:
+        schema = load_schema(schema_file(table_file(os.path.join(DATABASE_DIR,database), table_name)))
+        prefix = f'{alias}.' if statement.join is not None and alias else ''
+        texts.extend(f'{prefix}{column}' for column, column_type in schema.items() if not is_number_type(column_type))
 
-    # Checks if command is long enough
-    if len(command) < 2:
-        raise Invalid_Command('Invalid Command entered.\n')
+    return texts
 
-    database_name = command[1]
-    # Checks if database exists
-    if os.path.isdir(os.path.join(DATABASE_DIR,database_name)):
-        print(f'Using database {database_name}.\n')
-        return database_name
-    else:
-        raise Invalid_Command(f'Could not find database {database_name}.\n')
+
+def split_where(where_command, left_columns, right_columns):
+    '''
+    This function splits the WHERE condition of a comma join into the parts applied before the tables are joined.
+    Each condition of the top AND that only uses the columns of one table filters that table. The first equality
+    between a column of each table becomes the join keys so the tables can be joined on them instead of joining
+    every pair of rows.
+
+    Returns: left condition, right condition, (left key, right key), condition still to apply after the join, each
+    None if there is none
+    '''
+    left_columns = set(left_columns)
+    right_columns = set(right_columns)
+
+    join_keys = None
+    left_conditions, right_conditions, rest = list(), list(), list()
+    for condition in conjuncts(where_command):
+        operands = set(x for x in condition_operands(condition) if isinstance(x, str))
+
+        # Condition compares a column of each table
+        if join_keys is None and condition[0] == 'compare' and condition[2] == '=':
+            first, second = condition[1], condition[3]
+            if first in left_columns and second in right_columns:
+                join_keys = (first, second)
+                continue
+            if first in right_columns and second in left_columns:
+                join_keys = (second, first)
+                continue
+
+        # Condition only uses the columns of one table
+        if operands & left_columns and not operands & right_columns:
+            left_conditions.append(condition)
+        elif operands & right_columns and not operands & left_columns:
+            right_conditions.append(condition)
+
+        # Other conditions are applied after the join
+        else:
+            rest.append(condition)
+
+    return conjoin(left_conditions), conjoin(right_conditions), join_keys, conjoin(rest)
 
 
-def select_command(command, database, raw_command, **kwargs):
+def select_command(command, database, statement, **kwargs):
     '''
     Function checks if the table exists then selects the columns specified
 
@@ -285,147 +1023,157 @@ def select_command(command, database, raw_command, **kwargs):
 
     if not database:
         raise Invalid_Command('Not database selected.\n')
-    if len(command) < 4:
-        raise Invalid_Command('Command is not valid.')
-    # Uses select and from to find columns and table name
-    try:
-        return_cols = command[command.index('select')+1:command.index('from')]
-    except ValueError:
-        raise Invalid_Command('No SELECT or FROM found in command.\n')
 
-    # Parses FROM statement
-    if 'where' in command:
-        from_statement = command[command.index('from')+1:command.index('where')]
-    else:
-        from_statement = command[command.index('from')+1:]
-    
-    # Checks for join in FROM and if found joins the tables
-    if 'join' in from_statement:
+    # ORDER BY and LIMIT, then GROUP BY and HAVING, are applied to the rows left after WHERE
+    order_by, limit, offset = list(statement.order_by), statement.limit, statement.offset
+    group_by, having = list(statement.group_by), statement.having
+    order_items = [column for column, _ in order_by]
+    select_items = list(statement.items)
+    aggregate = is_aggregate_query(select_items, group_by, having)
 
-        # Finds table names and aliases
-        left_table_name = from_statement[0]
-        left_table_alias = from_statement[1]
+    # Columns used outside FROM decide which columns are read
+    names = statement.names
+    read_all = select_items == ['*'] and not aggregate
+    where_command = statement.where
 
-        right_table_name = from_statement[from_statement.index('join')+1]
-        right_table_alias = from_statement[from_statement.index('join')+2]
+    # Path of the table when only one table is queried, which lets WHERE use its indexes
+    table_path = None
 
-        # Finds and formats join type
-        join_type = from_statement[2:from_statement.index('join')]
-        
-        if 'outer' in join_type and len(join_type) > 1:
-            join_type.remove('outer')
+    # Tables modified by the active transaction are read from its workspace
+    workspace = current_workspace()
+    
+    # Checks for join in FROM and if found joins the tables
+    if statement.join not in (None, 'comma'):
 
-        join_type = join_type[0]
+        # Finds table names and aliases
+        (left_table_name, left_table_alias), (right_table_name, right_table_alias) = statement.tables
+        join_type = statement.join
 
-        # Finds join keys
-        on_key = from_statement[from_statement.index('on')+1:]
+        # Finds join keys, a cross join has no ON clause
+        left_key = right_key = None
+        if statement.on is not None:
+            on_key = statement.on[1:]
 
-        if on_key[0].split('.')[0] == left_table_alias:
-            left_key = on_key[0]
-            right_key = on_key[2]
-        
-        else:
-            left_key = on_key[2]
-            right_key = on_key[0]
+            if on_key[0].split('.')[0] == left_table_alias:
+                left_key = on_key[0]
+                right_key = on_key[2]
+            
+            else:
+                left_key = on_key[2]
+                right_key = on_key[0]
 
         
         # Creates table and schema path
-        left_table_path = os.path.join(DATABASE_DIR,database,f'{left_table_name}.csv')
-        right_table_path = os.path.join(DATABASE_DIR,database,f'{right_table_name}.csv')
+        left_table_path = table_file(os.path.join(DATABASE_DIR,database), left_table_name)
+        right_table_path = table_file(os.path.join(DATABASE_DIR,database), right_table_name)
 
-        # Checks if table exists
+        # Checks if table exists and reads the columns used in the query with the alias added as prefix
         if os.path.isfile(left_table_path) and os.path.isfile(right_table_path):
-            left_table_df = pd.read_csv(left_table_path)
-            right_table_df = pd.read_csv(right_table_path)
+            left_columns = None if read_all else referenced_columns(left_table_path, left_table_alias, names, workspace)
+            left_scan = plan_operator('Scan', scan_detail(left_table_name, left_table_alias, left_columns), inputs = ())
+            left_table_df = scan_table(left_scan, left_table_path, left_columns, workspace, left_table_alias)
+
+            right_columns = None if read_all else referenced_columns(right_table_path, right_table_alias, names, workspace)
+            right_scan = plan_operator('Scan', scan_detail(right_table_name, right_table_alias, right_columns), inputs = ())
+            right_table_df = scan_table(right_scan, right_table_path, right_columns, workspace, right_table_alias)
         
         else:
             raise Invalid_Command("Could not find table.")
 
-        # Adds table alias as prefix
-        left_table_df = left_table_df.add_prefix(left_table_alias + '.')
-        right_table_df = right_table_df.add_prefix(right_table_alias + '.')
-
-        # Creates cross join
-        if join_type == 'cross':
-
-            # Creates index of only zero
-            left_table_df.index = [0]*len(left_table_df)
-            right_table_df.index = [0]*len(right_table_df)
-
-            table_df = left_table_df.merge(right=right_table_df, left_index=True, right_index=True)
-            
-        else:
-            table_df = left_table_df.merge(right=right_table_df, how=join_type, left_on=left_key, right_on=right_key)
+        # Joins the tables with a hash or sort-merge join, a cross join pairs every row
+        table_df = join_scans(left_table_df, right_table_df, left_key, right_key, join_type, [left_scan, right_scan])
 
 
     # If there is no join then check for a comma indicating two tables
-    elif ',' in ' '.join(from_statement):
+    elif statement.join == 'comma':
         
-        left_table_name = from_statement[0]
-        left_table_alias = from_statement[1].replace(',','')
-
-        right_table_name = from_statement[2]
-        right_table_alias = from_statement[3]
+        (left_table_name, left_table_alias), (right_table_name, right_table_alias) = statement.tables
 
         # Creates table and schema path
-        left_table_path = os.path.join(DATABASE_DIR,database,f'{left_table_name}.csv')
-        right_table_path = os.path.join(DATABASE_DIR,database,f'{right_table_name}.csv')
+        left_table_path = table_file(os.path.join(DATABASE_DIR,database), left_table_name)
+        right_table_path = table_file(os.path.join(DATABASE_DIR,database), right_table_name)
 
-        # Checks if table exists
+        # Checks if table exists and reads the columns used in the query with the alias added as prefix
         if os.path.isfile(left_table_path) and os.path.isfile(right_table_path):
-            left_table_df = pd.read_csv(left_table_path)
-            right_table_df = pd.read_csv(right_table_path)
+            left_columns = None if read_all else referenced_columns(left_table_path, left_table_alias, names, workspace)
+            left_scan = plan_operator('Scan', scan_detail(left_table_name, left_table_alias, left_columns), inputs = ())
+            left_table_df = scan_table(left_scan, left_table_path, left_columns, workspace, left_table_alias)
+
+            right_columns = None if read_all else referenced_columns(right_table_path, right_table_alias, names, workspace)
+            right_scan = plan_operator('Scan', scan_detail(right_table_name, right_table_alias, right_columns), inputs = ())
+            right_table_df = scan_table(right_scan, right_table_path, right_columns, workspace, right_table_alias)
         
         else:
             raise Invalid_Command("Could not find table.")
 
-        # Mimics cross join and uses WHERE to filter
-        left_table_df.index = [0]*len(left_table_df)
-        right_table_df.index = [0]*len(right_table_df)
-
-        # Adds table alias as prefix
-        left_table_df = left_table_df.add_prefix(left_table_alias + '.')
-        right_table_df = right_table_df.add_prefix(right_table_alias + '.')
-
-        table_df = left_table_df.merge(right=right_table_df, left_index=True, right_index=True)
+        # Filters each table before the join and finds join keys in the WHERE clause
+        join_keys = None
+        left_input, right_input = left_scan, right_scan
+        if where_command is not None:
+            left_where, right_where, join_keys, where_command = split_where(where_command, left_table_df.columns, right_table_df.columns)
+            if left_where is not None:
+                left_table_df, left_input = filter_table(left_table_df, left_where, inputs = [left_scan])
+            if right_where is not None:
+                right_table_df, right_input = filter_table(right_table_df, right_where, inputs = [right_scan])
+
+        # Uses an equi-join if WHERE compares a column of each table, else joins every pair of rows
+        if join_keys is not None:
+            table_df = join_scans(left_table_df, right_table_df, join_keys[0], join_keys[1], 'inner', [left_input, right_input])
+        else:
+            table_df = join_scans(left_table_df, right_table_df, None, None, 'cross', [left_input, right_input])
     
 
-    # If there is no comma or join then use the first token after the FROM
+    # If there is no comma or join then use the only table
     else:
-        table_name = from_statement[0]
-        table_path = os.path.join(DATABASE_DIR,database,f'{table_name}.csv')
-        table_df = pd.read_csv(table_path)
+        table_name = statement.tables[0][0]
+        table_path = table_file(os.path.join(DATABASE_DIR,database), table_name)
+
+        if not os.path.isfile(table_path):
+            raise Invalid_Command(f'Could not find table {table_name}.\n')
+
+        # Tables larger than STREAM_BYTES are read and printed in chunks, unless a transaction needs a snapshot
+        if streams(table_path, workspace):
+            query = Aggregate_Query(select_items, group_by, having, read_columns(table_path), order_items,
+                                    query_text_columns(statement, database)) if aggregate else None
+            stream_select(table_path, select_items, where_command, None if read_all else referenced_columns(table_path, None, names), query,
+                          order_by, limit, offset)
+            return database
+
+        # Reads only the columns used in the query
+        columns = None if read_all else referenced_columns(table_path, None, names, workspace)
+        table_df = scan_table(plan_operator('Scan', scan_detail(table_name, None, columns)), table_path, columns, workspace)
+        table_path = index_path(table_path, workspace)
 
     # Checks if table exists
     if table_df is not None:
 
 
-        # Runs if there was a where command
-        where_command = raw_command[raw_command.lower().find('where'):]
-        if 'where' in where_command.lower():
-            where_command = where_command.replace(';','').split(' ')
-            where_command = [x.strip() for x in where_command]
-            where_command = [x for x in where_command if x != '']
-        
-            filter_series = where(where_command=where_command, table_df=table_df)
+        # Runs if there was a where command that was not already applied before a join
+        if where_command is not None:
+            table_df, _ = filter_table(table_df, where_command, table_path)
+
+        # Groups the rows and computes the aggregates instead of returning the rows
+        if aggregate:
+            query = Aggregate_Query(select_items, group_by, having, list(table_df.columns), order_items,
+                                    query_text_columns(statement, database))
+            output_table(aggregate_result(query, aggregate_groups(query, table_df), order_by, limit, offset), query.items)
+            return database
 
-            table_df = table_df.loc[filter_series]
+        # Sorts the rows and keeps the ones in the LIMIT, only sorting the first rows if there is a LIMIT
+        table_df = order_table(table_df, order_by, limit, offset)
 
         # Returns all columns if *
-        if return_cols == ['*']:
-            print(table_df, '\n')
+        if select_items == ['*']:
+            output_table(table_df, select_items)
 
-        # Else split columns with comma and create a list of column names
+        # Else returns the columns of the SELECT list
         else:
-            return_cols = ' '.join(return_cols)
-            return_cols = return_cols.split(',')
-            return_cols = [x.strip() for x in return_cols]
 
             # Checks if all columns exist
-            if all(col_name in table_df.columns for col_name in return_cols):
+            if all(col_name in table_df.columns for col_name in select_items):
 
                 # Prints all selected columns
-                print(table_df[return_cols], '\n')
+                output_table(table_df[select_items], select_items)
             else:
                 raise Invalid_Command(f'Table at least one specified column was not found.\n')
     # Raises error if table not found
@@ -436,6 +1184,174 @@ def select_command(command, database, raw_command, **kwargs):
     return database
 
 
+def estimated_rows(condition, columns, known, rows):
+    '''
+    This function estimates the rows of a plan that a condition keeps, for EXPLAIN. known maps the columns to their
+    statistics (see column_map).
+
+    Returns: number of rows or None if the tables have no statistics
+    '''
+    if known is None or rows is None:
+        return None
+
+    # A condition the query cannot run has no estimate, the error comes when the query runs
+    try:
+        return estimate_rows(compile_condition(condition, columns), known, rows)
+    except Invalid_Command:
+        return None
+
+
+def select_plan(statement, database):
+    '''
+    This function builds the plan of a SELECT for EXPLAIN from the statement, the table files and their indexes,
+    without reading any rows. It has the operators select_command adds when it runs the query, except for the join
+    algorithm, which depends on whether the rows are sorted on the join keys. Operators of analyzed tables get the
+    rows they are expected to give from the statistics of the tables.
+
+    Returns: Operator, the output of the query
+    '''
+    if not database:
+        raise Invalid_Command('Not database selected.\n')
+
+    order_by, limit, offset = list(statement.order_by), statement.limit, statement.offset
+    group_by, having = list(statement.group_by), statement.having
+    select_items = list(statement.items)
+    aggregate = is_aggregate_query(select_items, group_by, having)
+    read_all = select_items == ['*'] and not aggregate
+    where_command = statement.where
+    workspace = current_workspace()
+
+    def scan(table_name, alias=None):
+        # Plans the scan of a table and finds the columns it gives, with the alias as prefix for a join
+        table_path = table_file(os.path.join(DATABASE_DIR,database), table_name)
+        if not os.path.isfile(table_path):
+            raise Invalid_Command(f'Could not find table {table_name}.\n')
+
+        columns = None if read_all else referenced_columns(table_path, alias, statement.names, workspace)
+        read = table_columns(table_path, workspace) if columns is None else columns
+        if alias is not None:
+            read = [f'{alias}.{column}' for column in read]
+
+        stats = load_stats(table_path)
+        operator = Operator('Scan', scan_detail(table_name, alias, columns))
+        operator.estimate = None if stats is None else stats['rows']
+
+        return operator, read, table_path, column_map(stats, alias)
+
+    def planned(name, detail, inputs, estimate):
+        # Adds an operator to the plan with the rows it is expected to give
+        operator = Operator(name, detail, inputs)
+        operator.estimate = estimate
+        return operator
+
+    table_path = None
+    if statement.join is not None:
+        (left_table_name, left_table_alias), (right_table_name, right_table_alias) = statement.tables
+        left, left_columns, _, left_known = scan(left_table_name, left_table_alias)
+        right, right_columns, _, right_known = scan(right_table_name, right_table_alias)
+        columns = left_columns + right_columns
+        known = None if left_known is None or right_known is None else {**left_known, **right_known}
+
+        if statement.join == 'comma':
+            join_keys = None
+            if where_command is not None:
+                left_where, right_where, join_keys, where_command = split_where(where_command, left_columns, right_columns)
+                if left_where is not None:
+                    left = planned('Filter', condition_text(left_where), [left],
+                                   estimated_rows(left_where, left_columns, left_known, left.estimate))
+                if right_where is not None:
+                    right = planned('Filter', condition_text(right_where), [right],
+                                    estimated_rows(right_where, right_columns, right_known, right.estimate))
+            how = 'inner' if join_keys is not None else 'cross'
+            left_key, right_key = join_keys or (None, None)
+
+        else:
+            how = statement.join
+            left_key = right_key = None
+            if statement.on is not None:
+                left_key, right_key = statement.on[1], statement.on[3]
+                if left_key.split('.')[0] != left_table_alias:
+                    left_key, right_key = right_key, left_key
+
+        # With estimates of both inputs the cost model picks the build side of a hash join
+        estimate = build_side = None
+        if known is not None:
+            estimate = join_rows(left.estimate, right.estimate, column_distinct(known, left_key, left.estimate),
+                                 column_distinct(known, right_key, right.estimate), how if left_key else 'cross')
+            build_side = smaller_side(left.estimate, right.estimate)
+        node = planned(*join_detail(how, left_key, right_key, build_side = build_side), [left, right], estimate)
+
+    else:
+        node, columns, table_path, known = scan(statement.tables[0][0])
+
+        # Streamed queries do not use indexes
+        if streams(table_path, workspace):
+            node.name = 'Chunked Scan'
+            node.detail += f' in chunks of {CHUNK_ROWS} rows'
+            table_path = None
+        else:
+            table_path = index_path(table_path, workspace)
+
+    if where_command is not None:
+        node = planned('Filter', condition_text(where_command), [node], estimated_rows(where_command, columns, known, node.estimate))
+        found = None if table_path is None else planned_index(where_command, columns, table_path)
+        if found is not None:
+            lookup_rows = None if known is None else estimate_rows(found[1], known, node.inputs[0].estimate)
+            node.inputs = [planned('Index Lookup', lookup_detail(found[1]), node.inputs, lookup_rows)]
+
+    if aggregate:
+        query = Aggregate_Query(select_items, group_by, having, columns, [column for column, _ in order_by],
+                                query_text_columns(statement, database))
+        distincts = [column_distinct(known, column, node.estimate) for column in query.group_by]
+        estimate = None if node.estimate is None or None in distincts else group_rows(node.estimate, distincts)
+        node = planned('Aggregate', aggregate_detail(query), [node], estimate)
+        if having is not None:
+            node = planned('Filter', condition_text(having), [node], None if estimate is None else int(round(estimate * DEFAULT_RANGE)))
+
+    ordering = order_detail(order_by, limit, offset)
+    if ordering is not None:
+        estimate = node.estimate
+        if estimate is not None and limit is not None:
+            estimate = min(limit, max(estimate - offset, 0))
+        node = planned(*ordering, [node], estimate)
+
+    return planned('Output', ', '.join(select_items), [node], node.estimate)
+
+
+def explain_command(command, database, statement, **kwargs):
+    '''
+    This function prints the plan of a SELECT. With ANALYZE the query is run with the rows it prints discarded, and
+    each operator of the plan shows its time, rows in and out, bytes read and peak memory.
+
+    Returns: database name
+    '''
+    query = statement.statement
+
+    if not statement.analyze:
+        lines = format_plan(select_plan(query, database))
+
+    else:
+        # Keeps the results of the query from being sent to the client of a server session
+        session = current_session()
+        kept_results = None if session is None else len(session.results)
+
+        profile = Query_Profile()
+        started = time.perf_counter()
+        try:
+            with profiled(profile), open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                select_command(list(query.words), database, query)
+        finally:
+            if session is not None:
+                del session.results[kept_results:]
+        seconds = time.perf_counter() - started
+
+        lines = format_plan(profile.last, analyze = True) + [f'Execution time: {seconds * 1000:.3f} ms']
+
+    print('\n'.join(lines), '\n')
+
+    return database
+
+
 def alter_table(command, database, **kwargs):
     '''
     Function adds or removes one column from the table.
@@ -453,27 +1369,29 @@ def alter_table(command, database, **kwargs):
     col_name = command[4]
 
     # Creates table and schema path
-    table_path = os.path.join(DATABASE_DIR,database,f'{table_name}.csv')
+    table_path = table_file(os.path.join(DATABASE_DIR,database), table_name)
     schema_path = os.path.join(DATABASE_DIR,database,f'{table_name}_schema.json')
 
-    # Raises error if file has already locked 
-    if os.path.isfile(table_path.replace('.csv','_lock.csv')):
-        raise Invalid_Command(f'Table {table_name} is locked.\n')
+    # Gets the workspace of the active transaction, if any
+    workspace = current_workspace()
 
     # Checks if table exists
     if os.path.isfile(table_path) & os.path.isfile(schema_path):
+        lock_table(table_path, 'X', workspace)
 
         # Checks if add and if so selects the column type
         if add_or_remove == 'add':
             if len(command) < 6:
                 raise Invalid_Command('Alter add command is invalid.\n')
             col_type = command[5]
-            add_to_table(table_path, schema_path, col_name, col_type)
+            add_to_table(table_path, schema_path, col_name, col_type, workspace)
             print(f'Added column {col_name} {col_type} to {table_name}.\n')
 
         # Checks if remove and calls command if so
         elif add_or_remove == 'remove':
-            remove_from_table(table_path, schema_path, col_name)
+            remove_from_table(table_path, schema_path, col_name, workspace)
+            drop_column_indexes(table_path, col_name)
+            drop_stats(table_path, col_name)
             print(f'Removed column {col_name} from {table_name}.\n')
 
         else:
@@ -485,14 +1403,15 @@ def alter_table(command, database, **kwargs):
     return database
 
 
-def add_to_table(table_path, schema_path, column_name, column_type, **kwargs):
+def add_to_table(table_path, schema_path, column_name, column_type, workspace=None, **kwargs):
     '''
     This function checks if a column exists and if not adds the column to the table and schema.
+    Inside a transaction the table is changed in the transaction's workspace.
 
     Returns: None
     '''
     # Loads table and check if column exists
-    table = pd.read_csv(table_path)
+    table = load_table(table_path, workspace = workspace)
     if column_name in table.columns:
         raise Invalid_Command(f'Column {column_name} already exists.\n')
 
@@ -503,22 +1422,12 @@ def add_to_table(table_path, schema_path, column_name, column_type, **kwargs):
     # Adds new column to table and saves table to csv
     table[column_name] = np.nan
 
-
-    transactions_file = os.path.join(DATABASE_DIR,'transactions_log.json')
-    if os.path.isfile(transactions_file):
-        with open(transactions_file,'r') as f:
-            transaction_dict = json.load(f)
-        
-        if len(transaction_dict) > 0:
-            transaction_dict = {int(k):v for k,v in transaction_dict.items()}
-
-            table_path = table_path.replace('.csv','_lock.csv')
-            transaction_dict[max(transaction_dict.keys())].append(table_path)
-            
-            with open(transactions_file,'w') as f:
-                json.dump(transaction_dict,f)
-
-    table.to_csv(table_path, index = False)
+    # Keeps the table in the workspace if a transaction is active, else saves it with the column in its statistics
+    if workspace is not None:
+        workspace.put(table_path, table)
+    else:
+        write_table(table, table_path)
+        add_stats_column(table_path, column_name, 'number' if is_number_type(column_type) else 'string')
 
     # Adds new column to schema and saves to json
     schema[column_name] = column_type
@@ -528,14 +1437,15 @@ def add_to_table(table_path, schema_path, column_name, column_type, **kwargs):
     return None
 
 
-def remove_from_table(table_path, schema_path, column_name, **kwargs):
+def remove_from_table(table_path, schema_path, column_name, workspace=None, **kwargs):
     '''
     This function checks if a column exists and if so deletes the column to the table and schema.
+    Inside a transaction the table is changed in the transaction's workspace.
 
     Returns: None
     '''
     # Loads table and check if column exists
-    table = pd.read_csv(table_path)
+    table = load_table(table_path, workspace = workspace)
     if column_name not in table.columns:
         raise Invalid_Command(f'Column {column_name} does not exists.\n')
 
@@ -546,22 +1456,11 @@ def remove_from_table(table_path, schema_path, column_name, **kwargs):
     # Drops columm from table and saves to csv
     table = table.drop(columns = column_name)
 
-
-    transactions_file = os.path.join(DATABASE_DIR,'transactions_log.json')
-    if os.path.isfile(transactions_file):
-        with open(transactions_file,'r') as f:
-            transaction_dict = json.load(f)
-        
-        if len(transaction_dict) > 0:
-            transaction_dict = {int(k):v for k,v in transaction_dict.items()}
-
-            table_path = table_path.replace('.csv','_lock.csv')
-            transaction_dict[max(transaction_dict.keys())].append(table_path)
-            
-            with open(transactions_file,'w') as f:
-                json.dump(transaction_dict,f)
-
-    table.to_csv(table_path, index = False)
+    # Keeps the table in the workspace if a transaction is active, else saves it
+    if workspace is not None:
+        workspace.put(table_path, table)
+    else:
+        write_table(table, table_path)
 
     # Drops column from schema and saves to json
     schema.pop(column_name)
@@ -571,142 +1470,202 @@ def remove_from_table(table_path, schema_path, column_name, **kwargs):
     return None
 
 
-def insert(command, database, raw_command, **kwargs):
+def insert(command, database, statement, **kwargs):
     '''
     This function inserts values to a specified table.
 
     Returns: database name
     '''
 
-    # Checks for database and INTO keyword
+    # Checks for database
     if database == '':
         raise Invalid_Command('No database specified.\n')
-
-    if command[1] != 'into':
-        raise Invalid_Command('Missing "INTO" keyword.\n')
     
     # Gets table name and path
-    table_name = command[2]
-    table_path = os.path.join(DATABASE_DIR,database,f'{table_name}.csv')
+    table_name = statement.table
+    table_path = table_file(os.path.join(DATABASE_DIR,database), table_name)
 
-    # Raises error if file has already locked 
-    if os.path.isfile(table_path.replace('.csv','_lock.csv')):
-        raise Invalid_Command(f'Table {table_name} is locked.\n')
+    # Gets the workspace of the active transaction, if any
+    workspace = current_workspace()
 
     # Checks if table exists
     if os.path.isfile(table_path):
 
-        # Looks for values keyword
-        try:
-            values_to_insert = raw_command[raw_command.find('values'):]
-        
-        except:
-            raise Invalid_Command('Could not find keyword "VALUES".\n')
-
-        # Extracts values to insert and splits on comma
-        values_to_insert = values_to_insert[values_to_insert.find('(')+1:values_to_insert.rfind(')')].split(',')
-
         # Checks for quote or period to indicate value is a float or a string. Else will be converted to an int.
-        formatted_values = list()
-        for value in values_to_insert:
-            # Correcly formats value and appends it
-            formatted_values.append(format_values(value))
+        formatted_rows = [[format_values(value) for value in row] for row in statement.rows]
 
-        # Reads table, adds new row and saves back in csv
-        table_df = pd.read_csv(table_path)
+        # Checks that a value was given for every column and that the values match the column types
+        columns = table_columns(table_path, workspace)
+        schema_path = os.path.join(DATABASE_DIR,database,f'{table_name}_schema.json')
+        schema = load_schema(schema_path)
+        if list(schema.keys()) != columns:
+            schema = {col: schema.get(col, '') for col in columns}
+        formatted_rows = coerce_rows(formatted_rows, schema)
 
-        table_df.loc[table_df.index.max()+1] = formatted_values
-
-        transactions_file = os.path.join(DATABASE_DIR,'transactions_log.json')
-        if os.path.isfile(transactions_file):
-            with open(transactions_file,'r') as f:
-                transaction_dict = json.load(f)
-            
-            if len(transaction_dict) > 0:
-                transaction_dict = {int(k):v for k,v in transaction_dict.items()}
+        # Checks that the rows do not enter a range locked by another transaction
+        lock_manager(DATABASE_DIR).acquire(statement_owner(workspace), table_path, [values_request(columns, formatted_rows)])
 
-                table_path = table_path.replace('.csv','_lock.csv')
-                transaction_dict[max(transaction_dict.keys())].append(table_path)
-                
-                with open(transactions_file,'w') as f:
-                    json.dump(transaction_dict,f)
+        # Adds the rows to the table in the workspace if a transaction is active
+        if workspace is not None:
+            append_to_workspace(workspace, table_path, formatted_rows)
 
-        table_df.to_csv(table_path, index = False)
+        # Else checks that no PRIMARY KEY or UNIQUE value is repeated and appends only the new rows to the end of the table
+        else:
+            check_unique_rows(table_path, formatted_rows)
+            old_stamp = table_stamp(table_path)
+            append_rows(formatted_rows, table_path)
+            append_index_rows(table_path, formatted_rows, old_stamp)
+            append_stats_rows(table_path, formatted_rows, columns)
 
 
     # If the table already exists raise exception
     else:
         raise Invalid_Command(f'Failed to insert. Table {table_name} could not be found.\n')
 
-    print(f'1 new record inserted into table {table_name}.\n')
+    count_rows(written = len(formatted_rows))
+    if len(formatted_rows) == 1:
+        print(f'1 new record inserted into table {table_name}.\n')
+    else:
+        print(f'{len(formatted_rows)} new records inserted into table {table_name}.\n')
 
     # Returns database so we can continue using it
     return database
 
 
-def delete(command, database, raw_command, **kwargs):
+def load_data(command, database, statement, **kwargs):
     '''
-    This function rows from a specified table.
+    This function loads all rows of a CSV file into a table in one batch.
+    The command is formatted as: LOAD DATA FROM 'file.csv' INTO table_name
+    The first line of the file must contain the column names of the table.
+
+    Returns: database name
+    '''
+    if database == '':
+        raise Invalid_Command('No database specified.\n')
+
+    # Gets the file path, which keeps its case, and the table name and path
+    file_path = statement.file_path
+    table_name = statement.table
+    table_path = table_file(os.path.join(DATABASE_DIR,database), table_name)
+    schema_path = os.path.join(DATABASE_DIR,database,f'{table_name}_schema.json')
+
+    # Gets the workspace of the active transaction, if any
+    workspace = current_workspace()
+
+    if not os.path.isfile(table_path):
+        raise Invalid_Command(f'Failed to load. Table {table_name} could not be found.\n')
+
+    if not os.path.isfile(file_path):
+        raise Invalid_Command(f'Failed to load. File {file_path} could not be found.\n')
+
+    # Reads every value as a string so the schema decides the types
+    load_df = pd.read_csv(file_path, dtype = str, skipinitialspace = True)
+
+    # Checks all rows against the schema and orders the columns like the table
+    columns = table_columns(table_path, workspace)
+    schema = load_schema(schema_path)
+    schema = {col: schema.get(col, '') for col in columns}
+    load_df = coerce_table(load_df, schema)
+    lock_table(table_path, 'X', workspace)
+
+    # Adds the rows to the table in the workspace if a transaction is active, else appends them in one write
+    if workspace is not None:
+        append_to_workspace(workspace, table_path, load_df)
+    else:
+        check_unique_rows(table_path, load_df)
+        old_stamp = table_stamp(table_path)
+        append_rows(load_df, table_path)
+        append_index_rows(table_path, load_df, old_stamp)
+        append_stats_rows(table_path, load_df, columns)
+
+    count_rows(written = len(load_df))
+    print(f'{len(load_df)} new records loaded into table {table_name}.\n')
+
+    return database
+
+
+def export_table(command, database, statement, **kwargs):
+    '''
+    This function saves a table as a CSV file with a header line, which can be loaded again with LOAD DATA.
+    The command is formatted as: EXPORT table_name TO 'file.csv'
 
     Returns: database name
     '''
-    # Checks for database and INTO keyword
     if database == '':
         raise Invalid_Command('No database specified.\n')
 
-    if command[1] != 'from':
-        raise Invalid_Command('Missing "FROM" keyword.\n')
+    # Gets the file path, which keeps its case, and the table name
+    file_path = statement.file_path
+    table_name = statement.table
+    table_path = table_file(os.path.join(DATABASE_DIR,database), table_name)
+
+    if not os.path.isfile(table_path):
+        raise Invalid_Command(f'Failed to export. Table {table_name} could not be found.\n')
+
+    table_df = read_table(table_path)
+    table_df.to_csv(file_path, index = False)
+
+    print(f'{len(table_df)} records exported from table {table_name}.\n')
+
+    return database
+
+
+def delete(command, database, statement, **kwargs):
+    '''
+    This function rows from a specified table.
+
+    Returns: database name
+    '''
+    # Checks for database
+    if database == '':
+        raise Invalid_Command('No database specified.\n')
     
     # Gets table name and path
-    table_name = command[2]
-    table_path = os.path.join(DATABASE_DIR,database,f'{table_name}.csv')
+    table_name = statement.table
+    table_path = table_file(os.path.join(DATABASE_DIR,database), table_name)
 
-    # Raises error if file has already locked 
-    if os.path.isfile(table_path.replace('.csv','_lock.csv')):
-        raise Invalid_Command(f'Table {table_name} is locked.\n')
+    # Gets the workspace of the active transaction, if any
+    workspace = current_workspace()
 
     # Checks if table exists
     if os.path.isfile(table_path):
 
-        # Reads table
-        table_df = pd.read_csv(table_path)
-
-        # Splits raw command on where, removes semicolon, splits on space, removes whitespace, and drops empty elements
-        where_command = raw_command[raw_command.lower().find('where'):]
+        # Reads table, or the transaction's copy if it already modified it
+        table_df = load_table(table_path, workspace = workspace)
 
         # Runs if there was a where command
-        if 'where' in where_command.lower():
-            where_command = where_command.replace(';','').split(' ')
-            where_command = [x.strip() for x in where_command]
-            where_command = [x for x in where_command if x != '']
-        
-            filter_series = where(where_command=where_command, table_df=table_df)
+        where_command = statement.where
+        if where_command is not None:
+            filter_series = where(where_command=where_command, table_df=table_df, table_path=index_path(table_path, workspace))
+            lock_rows(table_path, table_df, filter_series, workspace, where_command)
 
-            table_df.drop(table_df.loc[filter_series].index, inplace=True)
+            # Keeps the deleted rows to take them out of the table statistics
+            deleted_df = table_df.loc[filter_series]
+            table_df.drop(deleted_df.index, inplace=True)
 
-            print(f'Deleted {sum(filter_series)} records.\n')
+            print(f'Deleted {int(filter_series.sum())} records.\n')
 
         # If no where command entire table is deleted
         else:
+            filter_series = pd.Series(True, index = table_df.index)
+            lock_table(table_path, 'X', workspace)
+            # Statistics of a table without rows are computed again instead
+            deleted_df = None
             table_df.drop(table_df.index, inplace=True)
             print(f'Deleted all records.\n')
 
-        transactions_file = os.path.join(DATABASE_DIR,'transactions_log.json')
-        if os.path.isfile(transactions_file):
-            with open(transactions_file,'r') as f:
-                transaction_dict = json.load(f)
-            
-            if len(transaction_dict) > 0:
-                transaction_dict = {int(k):v for k,v in transaction_dict.items()}
+        # Keeps the table in the workspace if a transaction is active
+        if workspace is not None:
+            workspace.put(table_path, table_df)
 
-                table_path = table_path.replace('.csv','_lock.csv')
-                transaction_dict[max(transaction_dict.keys())].append(table_path)
-                
-                with open(transactions_file,'w') as f:
-                    json.dump(transaction_dict,f)
+        # Else saves new table and removes the deleted rows from its indexes
+        else:
+            old_stamp = table_stamp(table_path)
+            write_table(table_df, table_path)
+            delete_index_rows(table_path, filter_series, old_stamp)
+            delete_stats_rows(table_path, deleted_df, table_df)
 
-        # Saves new table
-        table_df.to_csv(table_path, index = False)
+        count_rows(written = int(filter_series.sum()))
 
 
     # If the table already exists raise exception
@@ -718,167 +1677,320 @@ def delete(command, database, raw_command, **kwargs):
     return database
 
 
-def where(where_command, table_df):
+def where(where_command, table_df, table_path=None, operator=None):
     '''
-    This function returns DataFrame after applying the where condition.
+    This function returns DataFrame after applying the where condition, a tree of comparisons joined by AND, OR and
+    NOT evaluated by condition_mask in conditions.py.
+    If table_path is given, table_df holds every row of that table and conditions on an indexed column use the index.
+    operator is the Filter operator of the query plan when the filter is part of a SELECT (see explain.py).
 
-    Where condition formatted as: ['WHERE','{column_name}', '{comparison operator}', '{value}'] eg. 'WHERE','a', '=', '2']
+    Where condition formatted as: ('compare', '{column_name}', '{comparison operator}', '{value}') eg. ('compare', 'a', '=', '2')
 
     Returns: boolean series to filter df
     '''
+    return pd.Series(condition_mask(where_command, table_df, table_path, operator), index = table_df.index)
 
-    operator_dict = {
-        '=': operator.eq,
-        '!=': operator.ne,
-        '<': operator.lt,
-        '<=': operator.le,
-        '>': operator.gt,
-        '>=': operator.ge,
-    }
 
-    if (where_command[1].lower() in table_df.columns) and (where_command[3].lower() in table_df.columns):
-        col_1 = where_command[1].lower()
-        comparison = where_command[2]
-        comparison_function = operator_dict[comparison]
-        col_2 = where_command[3].lower()
+def update_table(command, database, statement, **kwargs):
+    '''
+    This function updates values in a specified table using a WHERE statment.
+
+    Returns: database
+    '''
+
+    # Checks for database
+    if database == '':
+        raise Invalid_Command('No database specified.\n')
+
+    if len(statement.assignments) != 1:
+        raise Invalid_Command('Can only set one column at a time.\n')
+    
+    # Gets table name and path
+    table_name = statement.table
+    table_path = table_file(os.path.join(DATABASE_DIR,database), table_name)
+
+    # Gets the workspace of the active transaction, if any
+    workspace = current_workspace()
+
+    # Checks if table exists
+    if os.path.isfile(table_path):
+
+        table_df = load_table(table_path, workspace = workspace)
 
-        if comparison in operator_dict:
-                filter_series = comparison_function(table_df[col_1],table_df[col_2])
+        # Runs if there was a where command, else every row is updated
+        where_command = statement.where
+        if where_command is not None:
+            filter_series = where(where_command=where_command, table_df=table_df, table_path=index_path(table_path, workspace))
         else:
-                raise Invalid_Command('No matching comparison operator found.')
-        
+            filter_series = pd.Series(True, index = table_df.index)
 
-    else:
-        column = where_command[1].lower()
-        comparison = where_command[2]
-        comparison_function = operator_dict[comparison]
-        value = format_values(where_command[3].lower())
+        # Selects column and formats value
+        column, value = statement.assignments[0]
+        value = format_values(value)
 
         if column in table_df.columns:
 
-            if comparison in operator_dict:
-                filter_series = comparison_function(table_df[column],value)
+            # Checks the value against the column type
+            schema = load_schema(os.path.join(DATABASE_DIR,database,f'{table_name}_schema.json'))
+            if column in schema:
+                value = coerce_value(value, column, schema[column])
+
+            # Locks the rows to change and checks that no PRIMARY KEY or UNIQUE value is repeated, then sets value
+            if where_command is None:
+                lock_table(table_path, 'X', workspace)
+            lock_rows(table_path, table_df, filter_series, workspace, where_command, {column: value})
+            held_df = table_df if index_path(table_path, workspace) is None else None
+            check_unique_update(table_path, filter_series, column, value, held_df)
+            old_values = table_df.loc[filter_series, column]
+            assign_values(table_df, filter_series, column, value)
+
+            # Keeps the table in the workspace if a transaction is active
+            if workspace is not None:
+                workspace.put(table_path, table_df)
+
+            # Else saves the table and moves the changed rows to their new place in the indexes
             else:
-                raise Invalid_Command('No matching comparison operator found.')
+                old_stamp = table_stamp(table_path)
+                write_table(table_df, table_path)
+                update_index_rows(table_path, filter_series, column, value, old_stamp)
+                update_stats_rows(table_path, old_values, column, value, table_df)
 
-    return filter_series
+            count_rows(written = int(filter_series.sum()))
+            print(f'Modified {int(filter_series.sum())} records.\n')
 
+        else:
+            raise Invalid_Command("Column not found.\n")
 
-def update_table(command, database, raw_command, **kwargs):
-    '''
-    This function updates values in a specified table using a WHERE statment.
+    else:
+        raise Invalid_Command("Table not found.\n")
 
-    Returns: database
+    return database
+
+
+def check_prepared(statement, database):
     '''
+    This function checks a statement against the schema of its tables when it is prepared: the tables must exist and
+    the columns set by UPDATE, the columns of a WHERE on one table and the number of values of INSERT must match them.
 
-    # Checks for database and INTO keyword
+    Returns: None
+    '''
     if database == '':
         raise Invalid_Command('No database specified.\n')
-    
-    # Gets table name and path
-    table_name = command[1]
-    table_path = os.path.join(DATABASE_DIR,database,f'{table_name}.csv')
 
-    # Raises error if file has already locked 
-    if os.path.isfile(table_path.replace('.csv','_lock.csv')):
-        raise Invalid_Command(f'Table {table_name} is locked.\n')
+    workspace = current_workspace()
+    table_names = [name for name, _ in statement.tables] if statement.kind == 'select' else [statement.table]
+    for table_name in table_names:
+        if not os.path.isfile(table_file(os.path.join(DATABASE_DIR,database), table_name)):
+            raise Invalid_Command(f'Could not find table {table_name}.\n')
+    columns = table_columns(table_file(os.path.join(DATABASE_DIR,database), table_names[0]), workspace)
+
+    if statement.kind == 'insert':
+        for row in statement.rows:
+            if len(row) != len(columns):
+                raise Invalid_Command(f'Table has {len(columns)} columns but {len(row)} values were given.\n')
+
+    if statement.kind == 'update':
+        for column, _ in statement.assignments:
+            if column not in columns:
+                raise Invalid_Command('Column not found.\n')
+
+    # Columns of a join are prefixed with their alias, so only a WHERE on one table is checked
+    if getattr(statement, 'where', None) is not None and len(table_names) == 1:
+        for column in condition_subjects(statement.where):
+            if column not in columns:
+                raise Invalid_Command(f'Column {column} not found.\n')
 
-    # Checks if table exists
-    if os.path.isfile(table_path):
+    return None
 
-        table_df = pd.read_csv(table_path)
 
-        # Splits raw command on where, removes semicolon, splits on space, removes whitespace, and drops empty elements
-        where_command = raw_command[raw_command.lower().find('where'):]
-        # Runs if there was a where command
-        if 'where' in where_command.lower():
-            where_command = where_command.replace(';','').split(' ')
-            where_command = [x.strip() for x in where_command]
-            where_command = [x for x in where_command if x != '']
-        
-            filter_series = where(where_command=where_command, table_df=table_df)
+def prepare_command(command, database, statement, **kwargs):
+    '''
+    This function parses and checks a statement once and keeps it under a name for EXECUTE.
+    The command is formatted as: PREPARE name AS statement, with ? in place of each value given to EXECUTE
 
+    Returns: database
+    '''
+    check_prepared(statement.statement, database)
+    session_statements()[statement.name] = statement.statement
 
-        # Subsets to the set statement
-        set_command = raw_command[raw_command.lower().find('set'):raw_command.lower().find('where')]
-        if 'set' in set_command.lower():
-            # Splits on spaces, strips, and removes empty elements
-            set_command = set_command.split(' ')
-            set_command = [x.strip() for x in set_command]
-            set_command = [x for x in set_command if x != '']
+    print(f'Statement {statement.name} prepared.\n')
 
-            # Selects column and formats value
-            column = set_command[1].lower()
-            value = format_values(set_command[3])
+    return database
 
-            if column in table_df.columns:
-                
-                # Sets value
-                table_df.loc[filter_series,column] = value
 
-                transactions_file = os.path.join(DATABASE_DIR,'transactions_log.json')
-                if os.path.isfile(transactions_file):
-                    with open(transactions_file,'r') as f:
-                        transaction_dict = json.load(f)
-                    
-                    if len(transaction_dict) > 0:
-                        transaction_dict = {int(k):v for k,v in transaction_dict.items()}
+def deallocate_command(command, database, **kwargs):
+    '''
+    This function forgets a prepared statement.
+    The command is formatted as: DEALLOCATE [PREPARE] name
 
-                        table_path = table_path.replace('.csv','_lock.csv')
-                        transaction_dict[max(transaction_dict.keys())].append(table_path)
-                        
-                        with open(transactions_file,'w') as f:
-                            json.dump(transaction_dict,f)
+    Returns: database
+    '''
+    names = [x for x in command[1:] if x != 'prepare']
+    if len(names) != 1:
+        raise Invalid_Command('Deallocate command is invalid.\n')
+    if session_statements().pop(names[0], None) is None:
+        raise Invalid_Command(f'Could not find prepared statement {names[0]}.\n')
 
-                table_df.to_csv(table_path, index = False)
+    print(f'Statement {names[0]} deallocated.\n')
 
-                print(f'Modified {sum(filter_series)} records.\n')
+    return database
 
-            else:
-                raise Invalid_Command("Column not found.\n")
 
-    else:
-        raise Invalid_Command("Table not found.\n")
+def prepared_statement(name):
+    '''
+    This function finds a statement prepared with PREPARE.
+
+    Returns: Statement
+    '''
+    try:
+        return session_statements()[name]
+    except KeyError:
+        raise Invalid_Command(f'Could not find prepared statement {name}.\n')
+
+
+class Prepared_Statement:
+    '''
+    Statement parsed and checked once by prepare and run with different values by execute.
+
+        update = prepare('update flights set status = ? where seat = ?;', 'db_1')
+        update.execute((1, 22))
+    '''
+
+    def __init__(self, statement, database):
+        self.statement = statement
+        self.database = database
+
+    def execute(self, params=()):
+        '''
+        This function runs the statement with params, a sequence of Python values, in place of its parameters.
+
+        Returns: database name
+        '''
+        with statement_metrics.statement(' '.join(self.statement.words), self.database) as record:
+            record.kind = self.statement.kind
+            return execute_statement(bind(self.statement, [literal_text(value) for value in params]), self.database)
+
+
+def prepare(sql_text, database):
+    '''
+    This function parses a statement with ? parameters and checks it against the schema of database.
+
+    Returns: Prepared_Statement
+    '''
+    statement = parse_statement(sql_text)
+    if statement.kind not in ('select', 'insert', 'update', 'delete'):
+        raise Invalid_Command('Only SELECT, INSERT, UPDATE and DELETE can be prepared.\n')
+    check_prepared(statement, database)
+
+    return Prepared_Statement(statement, database)
+
+
+def show_command(command, database, **kwargs):
+    '''
+    This function prints internal statistics. SHOW CACHE prints the hit and miss counts of the table cache and of
+    the cache of parsed statements, and SHOW METRICS the statement metrics in the Prometheus text format.
+
+    Returns: database
+    '''
+    if len(command) < 2 or command[1] not in ('cache', 'metrics'):
+        raise Invalid_Command('Can only show cache or metrics.\n')
+
+    if command[1] == 'metrics':
+        print(statement_metrics.prometheus_text())
+        return database
+
+    for name, value in {**table_cache.stats(), **parse_cache.stats()}.items():
+        print(f'{name}: {value}')
+    print()
 
     return database
 
 
 def execute_command(command, database):
     '''
-    This function executes one sql command. It first checks for a semi-colon and then
-    uses the first word to find the right function to execute.
+    This function executes one sql command. It first checks for a semi-colon, then parses the command
+    and uses the first word to find the right function to execute. The command is measured in the statement
+    metrics under the kind of statement it runs.
 
     Returns: database_name
     '''
+    with statement_metrics.statement(command, database) as record:
 
-    # Creates copy of original command
-    raw_command = command
+        # Checks if command includes semi-colon and raises error if not
+        if ';' not in command:
+            raise Invalid_Command('No semi-colon found. Not a valid input.\n')
 
-    command = command.lower()
+        # Parses the command, or reuses the parsed statement if the same command was entered before
+        statement = parse_statement(command)
 
-    # Checks if command includes semi-colon and raises error if not
-    if ';' in command:
-        command = command.replace(';','')
-        # Splits command into array wtih each element being a word and removes whitespaces
-        command = command.split(' ')
-        command = [x.strip() for x in command]
-        if '' in command:
-            command = [x for x in command if x != '']
-    else:
-        raise Invalid_Command('No semi-colon found. Not a valid input.\n')
+        # EXECUTE runs a prepared statement with its values in place of the parameters, without parsing it again
+        if statement.kind == 'execute':
+            statement = bind(prepared_statement(statement.name), statement.values)
+        elif statement.parameters:
+            raise Invalid_Command('Parameters (?) can only be used in PREPARE.\n')
+
+        # Commands that do not exist stay unknown so each wrong word does not become a command type
+        if statement.kind in command_dict:
+            record.kind = statement.kind
+        return execute_statement(statement, database)
+
+
+def execute_statement(statement, database):
+    '''
+    This function runs a parsed statement with the function of its first word.
+
+    Returns: database_name
+    '''
 
     # Tries to find matching command function using first word
-    command_type = command[0]
+    command_type = statement.kind
     try:
         command_function = command_dict[command_type]
     #  If command is not found raises Invalid_Command error
     except KeyError:
         raise Invalid_Command(f'{command_type} is not a valid SQL command.\n')
 
-    # Runs matching command function
-    database = command_function(command=command, database=database, raw_command=raw_command)
+    # Runs the command again after waiting for the locks it needs
+    deadline = time.monotonic() + LOCK_TIMEOUT_SECONDS
+    while True:
+        try:
+            return run_command(command_function, command_type, statement, database)
+        except Lock_Conflict as conflict:
+            workspace = current_workspace() if database != '' else None
+            try:
+                lock_manager(DATABASE_DIR).wait(statement_owner(workspace), conflict, deadline)
+            except Deadlock_Detected:
+                # Aborts the transaction that would close the cycle so the others can go on
+                if workspace is not None:
+                    transaction_log(DATABASE_DIR).abort(workspace.txn)
+                    end_transaction(workspace)
+                raise
+
 
-    return database
+def run_command(command_function, command_type, statement, database):
+    '''
+    This function runs a command function with the words of the command and its parsed statement. Commands that
+    change tables outside a transaction hold the write lock so they never overwrite a commit, and release their
+    locks when they finish.
+
+    Returns: database_name
+    '''
+    command = list(statement.words)
+
+    if command_type in WRITE_COMMANDS and database != '' and transaction_log(DATABASE_DIR).latest(session_id()) is None:
+        log = transaction_log(DATABASE_DIR)
+        log.lock_writes()
+        try:
+            return command_function(command=command, database=database, statement=statement)
+        finally:
+            log.unlock_writes()
+            lock_manager(DATABASE_DIR).release(statement_owner(None))
+
+    return command_function(command=command, database=database, statement=statement)
+
+
+# Commands that change tables
+WRITE_COMMANDS = {'create', 'drop', 'alter', 'insert', 'update', 'delete', 'load', 'analyze'}
 
 
 # Dictionary to match sql command to matching function
@@ -892,5 +2004,13 @@ command_dict = {
     'update': update_table,
     'delete': delete,
     'begin': begin_transaction,
-    'commit': commit_transaction
+    'commit': commit_transaction,
+    'rollback': rollback_transaction,
+    'load': load_data,
+    'export': export_table,
+    'show': show_command,
+    'prepare': prepare_command,
+    'explain': explain_command,
+    'analyze': analyze_command,
+    'deallocate': deallocate_command
 }
@@ -0,0 +1,790 @@
+'''
+Lexer and recursive-descent parser of SQL statements.
+
+    statement = parse_statement("update product set name = 'Gizmo' where pid = 5;")
+    statement.kind, statement.table, statement.assignments, statement.where
+
+tokenize splits the text of a statement into tokens, and Parser builds a Statement from them with one function per
+rule of the grammar. Keywords and identifiers are case insensitive and lowercased, while string literals keep their
+case and may contain keywords, commas, semicolons and spaces, with a quote written as two quotes. Values are kept as
+the text written in the statement (such as 'Gizmo' with its quotes, or 14.99) so commands convert them with
+format_values like before.
+
+SELECT, INSERT, UPDATE, DELETE, LOAD and EXPORT are parsed into clauses. The other commands only get the words of the
+statement, which their functions read themselves.
+
+A ? in place of a value is a parameter of a prepared statement:
+
+    PREPARE set_status AS UPDATE flights SET status = ? WHERE seat = ?;
+    EXECUTE set_status (1, 22);
+
+bind replaces the parameters of a parsed statement by the values given to EXECUTE, so the statement is only parsed
+when it is prepared. EXPLAIN keeps the SELECT after it, parsed like PREPARE does, as its statement.
+
+Parsed statements are kept in a least recently used cache keyed by the text of the statement with the whitespace
+outside quotes collapsed, so a statement repeated in a script is only parsed once. The number of statements kept is
+set with the SQL_PARSE_CACHE_SIZE environment variable (1024 by default).
+'''
+
+import os
+import re
+import math
+import numbers
+import decimal
+import threading
+from collections import OrderedDict
+
+from errors import Invalid_Command
+
+# Number of parsed statements kept in the cache
+PARSE_CACHE_SIZE = int(os.environ.get('SQL_PARSE_CACHE_SIZE', 1024))
+
+TOKEN_PATTERN = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<number>-?(?:\d+\.?\d*|\.\d+))
+  | (?P<name>[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)*)
+  | (?P<operator><>|!=|<=|>=|=|<|>)
+  | (?P<symbol>[(),;*?])
+''', re.VERBOSE)
+
+# Words that end a table name in FROM, so they cannot be an alias
+CLAUSE_KEYWORDS = {'where', 'group', 'having', 'order', 'limit', 'offset', 'join', 'inner', 'left', 'right', 'full',
+                   'outer', 'cross', 'on'}
+
+# Words that start or continue a clause, so they cannot be a column
+RESERVED_WORDS = CLAUSE_KEYWORDS | {'select', 'from', 'by', 'asc', 'desc', 'set', 'into', 'values', 'and', 'or', 'not',
+                                    'in', 'between', 'like', 'is'}
+
+# Joins written as LEFT [OUTER] JOIN and so on, with the join type passed to join_tables
+JOIN_TYPES = {'inner': 'inner', 'left': 'left', 'right': 'right', 'full': 'outer', 'outer': 'outer', 'cross': 'cross'}
+
+
+class Token:
+    '''
+    One token of a statement. kind is name, string, number, operator, symbol or end. value is the lowercased name,
+    and text is the token as written in the statement.
+    '''
+
+    def __init__(self, kind, text, position=0):
+        self.kind = kind
+        self.text = text
+        self.value = text.lower() if kind == 'name' else text
+        self.position = position
+
+
+def tokenize(text):
+    '''
+    This function splits the text of a statement into tokens.
+
+    Returns: list of Token ending with an end token
+    '''
+    tokens = list()
+    position = 0
+
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if match is None:
+            if text[position] == "'":
+                raise Invalid_Command('Unclosed quote.\n')
+            raise Invalid_Command(f'Unexpected character {text[position]}.\n')
+
+        if match.lastgroup != 'space':
+            tokens.append(Token(match.lastgroup, match.group(), position))
+        position = match.end()
+
+    tokens.append(Token('end', '', position))
+
+    return tokens
+
+
+class Parameter:
+    '''
+    A ? in a prepared statement. index is the position of its value in the values given to EXECUTE.
+    '''
+
+    def __init__(self, index):
+        self.index = index
+
+
+class Statement:
+    '''
+    Parsed statement. kind is its first word, words the lowercased words of the statement, parameters the number of
+    ? in it and the other attributes the clauses of its kind. Statements are shared through the cache, so their
+    clauses are tuples and must not be changed.
+    '''
+
+    def __init__(self, kind, words, parameters=0, **clauses):
+        self.kind = kind
+        self.words = words
+        self.parameters = parameters
+        self.__dict__.update(clauses)
+
+    def clauses(self):
+        '''
+        This function gets the clauses of the statement.
+
+        Returns: dictionary of clause name to value
+        '''
+        return {name: value for name, value in self.__dict__.items() if name not in ('kind', 'words', 'parameters')}
+
+
+class Parser:
+    '''
+    Recursive-descent parser of one statement. Each parse function reads one rule of the grammar from the tokens at
+    position and moves past them. names collects the identifiers used outside FROM, which are the columns a query
+    can read.
+    '''
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.position = 0
+        self.names = set()
+        self.parameters = 0
+
+    def peek(self, offset=0):
+        '''
+        This function gets a token after the current one without moving past it.
+
+        Returns: Token
+        '''
+        return self.tokens[min(self.position + offset, len(self.tokens) - 1)]
+
+    def next(self):
+        '''
+        This function moves past the current token.
+
+        Returns: Token
+        '''
+        token = self.peek()
+        self.position += 1
+
+        return token
+
+    def at(self, *values):
+        '''
+        This function checks if the current token is one of the given keywords or symbols.
+
+        Returns: bool
+        '''
+        token = self.peek()
+
+        return token.kind in ('name', 'operator', 'symbol') and token.value in values
+
+    def accept(self, *values):
+        '''
+        This function moves past the current token if it is one of the given keywords or symbols.
+
+        Returns: bool
+        '''
+        if self.at(*values):
+            self.position += 1
+            return True
+
+        return False
+
+    def expect(self, value, message=None):
+        '''
+        This function moves past a keyword or symbol the grammar needs, with message as the error if it is missing.
+
+        Returns: None
+        '''
+        if not self.accept(value):
+            raise Invalid_Command(message or self.error(value.upper() if value.isalpha() else value))
+
+        return None
+
+    def error(self, expected):
+        '''
+        This function builds the message for a token that is not the one the grammar expected.
+
+        Returns: message string
+        '''
+        token = self.peek()
+        found = 'end of command' if token.kind == 'end' else token.text
+
+        return f'Expected {expected} but found {found}.\n'
+
+    def name(self, what='a name'):
+        '''
+        This function reads a table, column or other name.
+
+        Returns: lowercased name
+        '''
+        if self.peek().kind != 'name':
+            raise Invalid_Command(self.error(what))
+
+        return self.next().value
+
+    def end(self):
+        '''
+        This function checks that nothing but semicolons is left in the statement.
+
+        Returns: None
+        '''
+        while self.accept(';'):
+            pass
+        if self.peek().kind != 'end':
+            raise Invalid_Command(self.error('end of command'))
+
+        return None
+
+    def parameter(self):
+        '''
+        This function reads a ? if it is the current token.
+
+        Returns: Parameter or None
+        '''
+        if not self.accept('?'):
+            return None
+        self.parameters += 1
+
+        return Parameter(self.parameters - 1)
+
+    def value(self):
+        '''
+        This function reads a value of INSERT or UPDATE: a string, a number, a word such as null or a parameter.
+
+        Returns: value text as written or Parameter
+        '''
+        parameter = self.parameter()
+        if parameter is not None:
+            return parameter
+        if self.peek().kind not in ('string', 'number', 'name'):
+            raise Invalid_Command(self.error('a value'))
+
+        return self.next().text
+
+    def operand(self):
+        '''
+        This function reads one side of a comparison or an item of the SELECT list: a value, a column, or an
+        aggregate function call, which is written without spaces as function(column).
+
+        Returns: operand text or Parameter
+        '''
+        parameter = self.parameter()
+        if parameter is not None:
+            return parameter
+
+        token = self.peek()
+        if token.kind in ('string', 'number'):
+            return self.next().text
+
+        if token.kind == 'name' and token.value in RESERVED_WORDS:
+            raise Invalid_Command(self.error('a column or value'))
+
+        name = self.name('a column or value')
+        if not self.accept('('):
+            self.names.add(name)
+            return name
+
+        argument = '*' if self.accept('*') else self.name('a column')
+        self.expect(')')
+        self.names.add(argument)
+
+        return f'{name}({argument})'
+
+    def comparison(self, left=None):
+        '''
+        This function reads a comparison of two operands, the condition of ON. left is the first operand if it was
+        already read.
+
+        Returns: ('compare', left operand, comparison operator, right operand)
+        '''
+        if left is None:
+            left = self.operand()
+        if self.peek().kind != 'operator':
+            raise Invalid_Command(self.error('a comparison operator'))
+        comparison = self.next().value
+        right = self.operand()
+
+        return ('compare', left, '!=' if comparison == '<>' else comparison, right)
+
+    def condition(self):
+        '''
+        condition = term [OR term ...], the condition of WHERE and HAVING
+
+        Returns: condition tree, see conditions.py
+        '''
+        terms = [self.term()]
+        while self.accept('or'):
+            terms.append(self.term())
+
+        return terms[0] if len(terms) == 1 else ('or',) + tuple(terms)
+
+    def term(self):
+        '''
+        term = factor [AND factor ...]
+
+        Returns: condition tree
+        '''
+        factors = [self.factor()]
+        while self.accept('and'):
+            factors.append(self.factor())
+
+        return factors[0] if len(factors) == 1 else ('and',) + tuple(factors)
+
+    def factor(self):
+        '''
+        factor = NOT factor | '(' condition ')' | predicate
+
+        Returns: condition tree
+        '''
+        if self.accept('not'):
+            return ('not', self.factor())
+
+        if self.accept('('):
+            condition = self.condition()
+            self.expect(')')
+            return condition
+
+        return self.predicate()
+
+    def predicate(self):
+        '''
+        predicate = operand (comparison operator operand | [NOT] IN '(' operand, ... ')' | [NOT] BETWEEN operand AND operand
+                    | [NOT] LIKE operand | IS [NOT] NULL)
+
+        Returns: condition tree
+        '''
+        operand = self.operand()
+
+        if self.accept('is'):
+            negated = self.accept('not')
+            self.expect('null')
+            return ('not', ('null', operand)) if negated else ('null', operand)
+
+        negated = self.accept('not')
+        if self.accept('in'):
+            self.expect('(')
+            values = [self.operand()]
+            while self.accept(','):
+                values.append(self.operand())
+            self.expect(')')
+            predicate = ('in', operand, tuple(values))
+        elif self.accept('between'):
+            low = self.operand()
+            self.expect('and')
+            predicate = ('between', operand, low, self.operand())
+        elif self.accept('like'):
+            predicate = ('like', operand, self.operand())
+        elif negated:
+            raise Invalid_Command(self.error('IN, BETWEEN or LIKE'))
+        else:
+            return self.comparison(operand)
+
+        return ('not', predicate) if negated else predicate
+
+    def table(self):
+        '''
+        This function reads a table in FROM with its optional alias. The alias defaults to the table name.
+
+        Returns: (table name, alias)
+        '''
+        table_name = self.name('a table name')
+        self.accept('as')
+        if self.peek().kind == 'name' and self.peek().value not in CLAUSE_KEYWORDS:
+            return table_name, self.next().value
+
+        return table_name, table_name
+
+    def select(self, words):
+        '''
+        select = SELECT items FROM table [(',' table) | ([join type] JOIN table [ON condition])] [WHERE condition]
+                 [GROUP BY columns] [HAVING condition] [ORDER BY column [ASC|DESC], ...] [LIMIT n] [OFFSET n]
+
+        Returns: Statement
+        '''
+        self.expect('select', 'No SELECT or FROM found in command.\n')
+
+        items = list()
+        if self.accept('*'):
+            items.append('*')
+        else:
+            items.append(self.operand())
+            while self.accept(','):
+                items.append(self.operand())
+        self.expect('from', 'No SELECT or FROM found in command.\n')
+
+        tables = [self.table()]
+        join = on = None
+        if self.accept(','):
+            join = 'comma'
+            tables.append(self.table())
+        elif self.at('join', *JOIN_TYPES):
+            join = 'inner'
+            if not self.at('join'):
+                join = JOIN_TYPES[self.next().value]
+                self.accept('outer')
+            self.expect('join')
+            tables.append(self.table())
+            if self.accept('on'):
+                on = self.comparison()
+            elif join != 'cross':
+                raise Invalid_Command('Missing "ON" keyword.\n')
+
+        where = self.condition() if self.accept('where') else None
+
+        group_by = list()
+        if self.accept('group'):
+            self.expect('by')
+            group_by.append(self.name('a column'))
+            while self.accept(','):
+                group_by.append(self.name('a column'))
+            self.names.update(group_by)
+
+        having = self.condition() if self.accept('having') else None
+
+        order_by = list()
+        if self.accept('order'):
+            self.expect('by')
+            while True:
+                if self.peek().kind != 'name':
+                    raise Invalid_Command('ORDER BY must list columns followed by ASC or DESC.\n')
+                column = self.operand()
+                ascending = not self.accept('desc')
+                if ascending:
+                    self.accept('asc')
+                order_by.append((column, ascending))
+                if not self.accept(','):
+                    break
+            if self.peek().kind == 'name' and not self.at('limit', 'offset'):
+                raise Invalid_Command('ORDER BY must list columns followed by ASC or DESC.\n')
+
+        limit, offset = None, 0
+        if self.accept('limit'):
+            limit = parse_count(self.next().text, 'LIMIT')
+        if self.accept('offset'):
+            offset = parse_count(self.next().text, 'OFFSET')
+        self.end()
+
+        return Statement('select', words, self.parameters, items = tuple(items), tables = tuple(tables), join = join, on = on,
+                         where = where, group_by = tuple(group_by), having = having, order_by = tuple(order_by),
+                         limit = limit, offset = offset, names = frozenset(self.names))
+
+    def insert(self, words):
+        '''
+        insert = INSERT INTO table VALUES '(' value, ... ')' [, '(' value, ... ')' ...]
+
+        Returns: Statement
+        '''
+        self.expect('insert')
+        self.expect('into', 'Missing "INTO" keyword.\n')
+        table_name = self.name('a table name')
+        self.expect('values', 'Could not find keyword "VALUES".\n')
+        if self.peek().kind == 'end' or self.at(';'):
+            raise Invalid_Command('No values to insert.\n')
+
+        rows = list()
+        while True:
+            self.expect('(')
+            row = list()
+            if not self.at(')'):
+                row.append(self.value())
+                while self.accept(','):
+                    row.append(self.value())
+            self.expect(')')
+            rows.append(tuple(row))
+            if not self.accept(','):
+                break
+        self.end()
+
+        return Statement('insert', words, self.parameters, table = table_name, rows = tuple(rows))
+
+    def update(self, words):
+        '''
+        update = UPDATE table SET column = value [, column = value ...] [WHERE condition]
+
+        Returns: Statement
+        '''
+        self.expect('update')
+        table_name = self.name('a table name')
+        self.expect('set')
+
+        assignments = list()
+        while True:
+            column = self.name('a column')
+            self.expect('=')
+            assignments.append((column, self.value()))
+            if not self.accept(','):
+                break
+
+        where = self.condition() if self.accept('where') else None
+        self.end()
+
+        return Statement('update', words, self.parameters, table = table_name, assignments = tuple(assignments), where = where)
+
+    def delete(self, words):
+        '''
+        delete = DELETE FROM table [WHERE condition]
+
+        Returns: Statement
+        '''
+        self.expect('delete')
+        self.expect('from', 'Missing "FROM" keyword.\n')
+        table_name = self.name('a table name')
+        where = self.condition() if self.accept('where') else None
+        self.end()
+
+        return Statement('delete', words, self.parameters, table = table_name, where = where)
+
+    def file_path(self):
+        '''
+        This function reads the quoted file path of LOAD or EXPORT, keeping its case.
+
+        Returns: file path
+        '''
+        if self.peek().kind != 'string':
+            raise Invalid_Command('File path must be in quotes.\n')
+
+        return self.next().text[1:-1].replace("''", "'")
+
+    def load(self, words):
+        '''
+        load = LOAD DATA FROM 'file' INTO table
+
+        Returns: Statement
+        '''
+        for keyword in ('load', 'data', 'from'):
+            self.expect(keyword, 'Load command is invalid.\n')
+        file_path = self.file_path()
+        self.expect('into', 'Load command is invalid.\n')
+        table_name = self.name('a table name')
+        self.end()
+
+        return Statement('load', words, table = table_name, file_path = file_path)
+
+    def export(self, words):
+        '''
+        export = EXPORT table TO 'file'
+
+        Returns: Statement
+        '''
+        self.expect('export')
+        table_name = self.name('a table name')
+        self.expect('to', 'Export command is invalid.\n')
+        file_path = self.file_path()
+        self.end()
+
+        return Statement('export', words, table = table_name, file_path = file_path)
+
+    def prepare(self, words):
+        '''
+        prepare = PREPARE name AS (select | insert | update | delete)
+
+        Returns: Statement whose statement is the parsed statement after AS
+        '''
+        self.expect('prepare')
+        name = self.name('a statement name')
+        self.expect('as')
+
+        statement = parse_statement(self.text[self.peek().position:])
+        if statement.kind not in PREPARED_KINDS:
+            raise Invalid_Command('Only SELECT, INSERT, UPDATE and DELETE can be prepared.\n')
+
+        return Statement('prepare', words, name = name, statement = statement)
+
+    def explain(self, words):
+        '''
+        explain = EXPLAIN [ANALYZE] select
+
+        Returns: Statement whose statement is the parsed SELECT
+        '''
+        self.expect('explain')
+        analyze = self.accept('analyze')
+
+        statement = parse_statement(self.text[self.peek().position:])
+        if statement.kind != 'select':
+            raise Invalid_Command('Only SELECT can be explained.\n')
+
+        return Statement('explain', words, statement.parameters, analyze = analyze, statement = statement)
+
+    def execute(self, words):
+        '''
+        execute = EXECUTE name ['(' value, ... ')']
+
+        Returns: Statement with the values of the parameters as written
+        '''
+        self.expect('execute')
+        name = self.name('a statement name')
+
+        values = list()
+        if self.accept('('):
+            if not self.at(')'):
+                values.append(self.value())
+                while self.accept(','):
+                    values.append(self.value())
+            self.expect(')')
+        self.end()
+        if self.parameters:
+            raise Invalid_Command('EXECUTE needs values, not parameters.\n')
+
+        return Statement('execute', words, name = name, values = tuple(values))
+
+
+# Commands parsed into clauses, the others only get their words
+PARSED_KINDS = {'select', 'insert', 'update', 'delete', 'load', 'export', 'prepare', 'execute', 'explain'}
+
+# Commands that can be prepared
+PREPARED_KINDS = {'select', 'insert', 'update', 'delete'}
+
+
+def parse_count(text, clause):
+    '''
+    This function parses the number of rows of a LIMIT or OFFSET clause.
+
+    Returns: int
+    '''
+    try:
+        count = int(text)
+    except ValueError:
+        raise Invalid_Command(f'{clause} must be a whole number.\n')
+    if count < 0:
+        raise Invalid_Command(f'{clause} cannot be negative.\n')
+
+    return count
+
+
+def literal_text(value):
+    '''
+    This function writes a Python value as a value of a statement: strings are quoted, None and NaN are null.
+
+    Returns: value text
+    '''
+    if value is None or (isinstance(value, numbers.Real) and not isinstance(value, numbers.Integral) and math.isnan(value)):
+        return 'null'
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, numbers.Integral):
+        return str(int(value))
+    if isinstance(value, numbers.Real):
+        # Written without an exponent, which the lexer does not read
+        return format(decimal.Decimal(repr(float(value))), 'f')
+
+    raise Invalid_Command(f'Cannot use a value of type {type(value).__name__} as a parameter.\n')
+
+
+def bind(statement, values):
+    '''
+    This function replaces the parameters of a prepared statement by values written as in a statement.
+
+    Returns: Statement without parameters
+    '''
+    if len(values) != statement.parameters:
+        raise Invalid_Command(f'Statement needs {statement.parameters} values but {len(values)} were given.\n')
+
+    def replace(clause):
+        if isinstance(clause, Parameter):
+            return values[clause.index]
+        if isinstance(clause, tuple):
+            return tuple(replace(part) for part in clause)
+        return clause
+
+    return Statement(statement.kind, statement.words, **{name: replace(clause) for name, clause in statement.clauses().items()})
+
+
+def parse(text):
+    '''
+    This function parses the text of one statement without the cache.
+
+    Returns: Statement
+    '''
+    words = tuple(text.lower().replace(';', ' ').split())
+    if len(words) == 0:
+        raise Invalid_Command('No command entered.\n')
+
+    kind = words[0]
+    if kind not in PARSED_KINDS:
+        return Statement(kind, words)
+
+    return getattr(Parser(text), kind)(words)
+
+
+def normalize_text(text):
+    '''
+    This function collapses the whitespace outside quotes, so statements only differing in spacing share a cache
+    entry while string literals are kept as written.
+
+    Returns: text
+    '''
+    if "'" not in text:
+        return ' '.join(text.split())
+
+    return re.sub(r"('(?:[^']|'')*')|\s+", lambda match: match.group(1) or ' ', text).strip()
+
+
+class Parse_Cache:
+    '''
+    Least recently used cache of parsed statements keyed by their normalized text.
+    '''
+
+    def __init__(self, size=PARSE_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, text):
+        '''
+        This function returns the parsed statement of text, parsing it only if it is not in the cache. Statements
+        that fail to parse are not cached.
+
+        Returns: Statement
+        '''
+        key = normalize_text(text)
+
+        with self.lock:
+            statement = self.entries.get(key)
+            if statement is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return statement
+            self.misses += 1
+
+        statement = parse(key)
+
+        # EXECUTE commands differ by their values, so they would only push prepared statements out of the cache
+        if statement.kind == 'execute':
+            return statement
+
+        with self.lock:
+            self.entries[key] = statement
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last = False)
+                self.evictions += 1
+
+        return statement
+
+    def stats(self):
+        '''
+        This function reports the cache counters.
+
+        Returns: dictionary of hits, misses, hit rate, evictions and entries
+        '''
+        with self.lock:
+            lookups = self.hits + self.misses
+
+            return {
+                'parse_hits': self.hits,
+                'parse_misses': self.misses,
+                'parse_hit_rate': self.hits / lookups if lookups else 0.0,
+                'parse_evictions': self.evictions,
+                'parse_entries': len(self.entries)
+            }
+
+
+# Cache shared by all commands in this process
+parse_cache = Parse_Cache()
+
+
+def parse_statement(text):
+    '''
+    This function parses one statement, reusing the parsed statement if the same text was parsed before.
+
+    Returns: Statement
+    '''
+    return parse_cache.get(text)
@@ -0,0 +1,516 @@
+'''
+Storage engines for tables.
+Each database picks a storage engine when it is created and the choice is saved in databases/{database}/database.json.
+If the file does not exist the database uses CSV storage.
+
+* csv: the table is stored as {table}.csv
+* columnar: the table is stored as {table}.npz with one typed array per column so single columns can be loaded
+  without parsing text. Rows appended since the last compaction are kept in {table}_delta.csv and folded into the
+  .npz file once the segment grows past DELTA_COMPACT_BYTES.
+
+The engine of a table is found from the extension of its file so commands only need the table path.
+'''
+
+import os
+import csv
+import json
+
+import numpy as np
+import pandas as pd
+
+from errors import Invalid_Command
+from table_cache import table_cache, file_stamp, normalize_types
+from schema import load_schema, schema_file, read_dtypes, apply_schema_types
+
+# Directory holding a directory for each database
+DATABASE_DIR = 'databases'
+
+DATABASE_CONFIG = 'database.json'
+DEFAULT_STORAGE = 'csv'
+
+# Size of the delta segment of a columnar table before it is merged into the .npz file
+DELTA_COMPACT_BYTES = int(os.environ.get('SQL_DELTA_COMPACT_BYTES', 4 * 1024 * 1024))
+
+# Number of rows read at a time by read_chunks
+CHUNK_ROWS = int(os.environ.get('SQL_CHUNK_ROWS', 100000))
+
+
+def csv_chunks(csv_path, chunk_rows, first_row=0, **read_options):
+    '''
+    This function reads a CSV file in chunks of rows. The rows are numbered from first_row across the chunks.
+    If the values do not match dtypes the file is read again with inferred types, unless chunks were already returned.
+
+    Returns: generator of DataFrames
+    '''
+    attempts = [read_options, {key: value for key, value in read_options.items() if key != 'dtype'}]
+    for i, options in enumerate(attempts):
+        returned = False
+        try:
+            with pd.read_csv(csv_path, chunksize = chunk_rows, **options) as reader:
+                for chunk in reader:
+                    returned = True
+                    yield chunk.set_axis(chunk.index + first_row, axis = 0)
+            return
+        except (ValueError, TypeError):
+            if returned or i == 1:
+                raise
+
+
+def write_csv_rows(rows, csv_path):
+    '''
+    This function appends rows to the end of a CSV file with the same quoting and line endings as DataFrame.to_csv.
+    Rows can be a list of row lists or a DataFrame.
+
+    Returns: None
+    '''
+    if isinstance(rows, pd.DataFrame):
+        rows.to_csv(csv_path, mode = 'a', header = False, index = False)
+
+    else:
+        with open(csv_path, 'a', newline='') as f:
+            writer = csv.writer(f, lineterminator = os.linesep)
+            writer.writerows(rows)
+
+    return None
+
+
+class Csv_Storage:
+    '''Stores a table as a single CSV file with a header line'''
+
+    name = 'csv'
+    extension = '.csv'
+
+    def files(self, table_path):
+        return [table_path]
+
+    def stamp(self, table_path):
+        return file_stamp(table_path)
+
+    def load(self, table_path, columns=None, dtypes=None):
+        # Falls back to inferring types if a stored value does not match its column type
+        try:
+            return pd.read_csv(table_path, usecols = columns, dtype = dtypes)
+        except (ValueError, TypeError):
+            return pd.read_csv(table_path, usecols = columns)
+
+    def save(self, table_df, table_path):
+        # Writes to a temporary file and renames it so readers never see a partly written table
+        temp_path = table_path + '.tmp'
+        table_df.to_csv(temp_path, index = False)
+        os.replace(temp_path, table_path)
+
+    def append(self, rows, table_path):
+        write_csv_rows(rows, table_path)
+
+    def chunks(self, table_path, columns=None, dtypes=None, chunk_rows=CHUNK_ROWS):
+        # The open file keeps the version being read if the table is replaced
+        return csv_chunks(table_path, chunk_rows, usecols = columns, dtype = dtypes)
+
+    def read_columns(self, table_path):
+        with open(table_path, 'r', newline='') as f:
+            header = next(csv.reader(f), [])
+
+        return header
+
+
+class Columnar_Storage:
+    '''
+    Stores a table as an uncompressed .npz archive. Column i is stored as the array c{i} and,
+    if it has missing values, a boolean array n{i} marks them. The column names are stored in __columns__.
+    Numbers keep their dtype, strings are fixed width unicode arrays and categorical columns are stored
+    as integer codes in c{i} with the categories in k{i}.
+    '''
+
+    name = 'columnar'
+    extension = '.npz'
+
+    def delta_file(self, table_path):
+        return table_path[:-len(self.extension)] + '_delta.csv'
+
+    def files(self, table_path):
+        return [table_path, self.delta_file(table_path)]
+
+    def stamp(self, table_path):
+        base_stamp = file_stamp(table_path)
+        if base_stamp is None:
+            return None
+
+        return (base_stamp, file_stamp(self.delta_file(table_path)))
+
+    def read_columns(self, table_path):
+        with np.load(table_path, allow_pickle = False) as npz:
+            return [str(col) for col in npz['__columns__']]
+
+    def encode_column(self, series):
+        '''
+        This function converts a column to a typed array, a mask of missing values and the categories of a categorical column.
+
+        Returns: (array, boolean mask or None, categories or None)
+        '''
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            categories = series.cat.categories.astype(str).to_numpy(dtype = str)
+            return series.cat.codes.to_numpy(), None, categories
+
+        nulls = series.isna().to_numpy()
+        mask = nulls if nulls.any() else None
+
+        if pd.api.types.is_bool_dtype(series) and mask is None:
+            return series.to_numpy(dtype = bool), None, None
+
+        if pd.api.types.is_integer_dtype(series):
+            return series.fillna(0).to_numpy(dtype = series.dtype.name.lower()), mask, None
+
+        # Missing floats are stored as NaN
+        if pd.api.types.is_float_dtype(series):
+            return series.to_numpy(dtype = 'float32' if series.dtype == np.float32 else 'float64'), None, None
+
+        return series.astype(object).where(~nulls, '').astype(str).to_numpy(dtype = str), mask, None
+
+    def decode_column(self, npz, i):
+        '''
+        This function converts a stored array back to a column. Integers with missing values become nullable integers.
+
+        Returns: Series
+        '''
+        values = npz[f'c{i}']
+
+        # Missing values of categorical columns have the code -1
+        if f'k{i}' in npz.files:
+            return pd.Series(pd.Categorical.from_codes(values, npz[f'k{i}']))
+
+        if f'n{i}' not in npz.files:
+            return pd.Series(values)
+
+        mask = npz[f'n{i}']
+        if values.dtype.kind in 'iu':
+            return pd.Series(pd.arrays.IntegerArray(values, mask))
+
+        return pd.Series(values).where(~mask)
+
+    def load(self, table_path, columns=None, dtypes=None):
+        # Only the arrays of the selected columns are read from the archive
+        with np.load(table_path, allow_pickle = False) as npz:
+            all_columns = [str(col) for col in npz['__columns__']]
+            selected = all_columns if columns is None else [col for col in all_columns if col in columns]
+            table_df = pd.DataFrame({col: self.decode_column(npz, all_columns.index(col)) for col in selected}, columns = selected)
+
+        # Adds rows from the delta segment
+        delta_path = self.delta_file(table_path)
+        if os.path.isfile(delta_path) and os.path.getsize(delta_path) > 0:
+            try:
+                delta_df = pd.read_csv(delta_path, header = None, names = all_columns, usecols = selected, dtype = dtypes)
+            except (ValueError, TypeError):
+                delta_df = pd.read_csv(delta_path, header = None, names = all_columns, usecols = selected)
+            table_df = normalize_types(pd.concat([table_df, delta_df], ignore_index = True))
+
+        return table_df
+
+    def chunks(self, table_path, columns=None, dtypes=None, chunk_rows=CHUNK_ROWS):
+        # Arrays of an .npz archive cannot be read in parts, so each selected column is read whole once
+        with np.load(table_path, allow_pickle = False) as npz:
+            all_columns = [str(col) for col in npz['__columns__']]
+            selected = all_columns if columns is None else [col for col in all_columns if col in columns]
+            table_df = pd.DataFrame({col: self.decode_column(npz, all_columns.index(col)) for col in selected}, columns = selected)
+
+        for start in range(0, len(table_df), chunk_rows):
+            yield table_df.iloc[start:start + chunk_rows]
+
+        delta_path = self.delta_file(table_path)
+        if os.path.isfile(delta_path) and os.path.getsize(delta_path) > 0:
+            yield from csv_chunks(delta_path, chunk_rows, len(table_df), header = None, names = all_columns, usecols = selected, dtype = dtypes)
+
+    def save(self, table_df, table_path):
+        table_df = normalize_types(table_df)
+        arrays = {'__columns__': np.array([str(col) for col in table_df.columns], dtype = str)}
+
+        for i, column in enumerate(table_df.columns):
+            values, mask, categories = self.encode_column(table_df[column])
+            arrays[f'c{i}'] = values
+            if mask is not None:
+                arrays[f'n{i}'] = mask
+            if categories is not None:
+                arrays[f'k{i}'] = categories
+
+        # Writes to a temporary file and renames it so readers never see a partly written table
+        temp_path = table_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temp_path, table_path)
+
+        # The delta rows are now part of the .npz file
+        delta_path = self.delta_file(table_path)
+        if os.path.isfile(delta_path):
+            os.remove(delta_path)
+
+    def append(self, rows, table_path):
+        # Large batches are merged straight into the .npz file
+        if isinstance(rows, pd.DataFrame):
+            table_df = self.load(table_path)
+            self.save(pd.concat([table_df, rows.set_axis(table_df.columns, axis = 1)], ignore_index = True), table_path)
+            return
+
+        delta_path = self.delta_file(table_path)
+        write_csv_rows(rows, delta_path)
+
+        if os.path.getsize(delta_path) > DELTA_COMPACT_BYTES:
+            self.save(self.load(table_path), table_path)
+
+
+STORAGE_ENGINES = {
+    'csv': Csv_Storage(),
+    'columnar': Columnar_Storage()
+}
+
+
+def storage_for(table_path):
+    '''
+    This function finds the storage engine of a table from the extension of its file.
+
+    Returns: storage engine
+    '''
+    extension = os.path.splitext(table_path)[1]
+    for engine in STORAGE_ENGINES.values():
+        if engine.extension == extension:
+            return engine
+
+    raise Invalid_Command(f'No storage engine for {table_path}.\n')
+
+
+def database_storage(database_path):
+    '''
+    This function reads which storage engine a database uses.
+
+    Returns: storage engine
+    '''
+    config_path = os.path.join(database_path, DATABASE_CONFIG)
+    if not os.path.isfile(config_path):
+        return STORAGE_ENGINES[DEFAULT_STORAGE]
+
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+
+    return STORAGE_ENGINES[config.get('storage', DEFAULT_STORAGE)]
+
+
+def set_database_storage(database_path, storage_name):
+    '''
+    This function saves the storage engine of a new database.
+
+    Returns: None
+    '''
+    if storage_name not in STORAGE_ENGINES:
+        raise Invalid_Command(f'Storage must be one of {", ".join(STORAGE_ENGINES)}.\n')
+
+    with open(os.path.join(database_path, DATABASE_CONFIG), 'w') as f:
+        json.dump({'storage': storage_name}, f)
+
+    return None
+
+
+def table_file(database_path, table_name):
+    '''
+    This function builds the path of the main file of a table using the database's storage engine.
+
+    Returns: table path
+    '''
+    return os.path.join(database_path, f'{table_name}{database_storage(database_path).extension}')
+
+
+def lock_file(table_path):
+    '''
+    This function builds the path of the copy of a table that is modified inside a transaction.
+
+    Returns: lock file path
+    '''
+    root, extension = os.path.splitext(table_path)
+
+    return f'{root}_lock{extension}'
+
+
+def unlock_file(lock_path):
+    '''
+    This function builds the path of the table a lock file replaces when the transaction is committed.
+
+    Returns: table path
+    '''
+    root, extension = os.path.splitext(lock_path)
+    if root.endswith('_lock'):
+        root = root[:-len('_lock')]
+
+    return f'{root}{extension}'
+
+
+def table_schema(table_path):
+    '''
+    This function loads the schema of a table from the path of the table or its lock file.
+
+    Returns: dictionary of column name to column type, empty if there is no schema
+    '''
+    schema_path = schema_file(table_path)
+    if not os.path.isfile(schema_path):
+        return dict()
+
+    return load_schema(schema_path)
+
+
+def read_table(table_path, columns=None):
+    '''
+    This function reads a table through the table cache so unchanged tables are not parsed again.
+    Column types come from the table schema. If columns is given only those columns are read.
+
+    Returns: DataFrame
+    '''
+    engine = storage_for(table_path)
+    schema = table_schema(table_path)
+
+    def loader(path, columns):
+        return apply_schema_types(engine.load(path, columns, read_dtypes(schema)), schema)
+
+    def normalize(table_df):
+        return apply_schema_types(normalize_types(table_df), schema)
+
+    return table_cache.get(table_path, loader, engine.stamp, columns, normalize)
+
+
+def read_chunks(table_path, columns=None, chunk_rows=CHUNK_ROWS):
+    '''
+    This function reads a table in chunks of rows without keeping it in the table cache, for tables too large to
+    read at once. Rows are numbered across the chunks like the rows read by read_table.
+
+    Returns: generator of DataFrames
+    '''
+    engine = storage_for(table_path)
+    schema = table_schema(table_path)
+
+    for chunk in engine.chunks(table_path, columns, read_dtypes(schema), chunk_rows):
+        yield apply_schema_types(chunk.copy(), schema)
+
+
+def table_bytes(table_path):
+    '''
+    This function gets the size of the files of a table.
+
+    Returns: size in bytes
+    '''
+    return sum(os.path.getsize(path) for path in storage_for(table_path).files(table_path) if os.path.isfile(path))
+
+
+def write_table(table_df, table_path):
+    '''
+    This function saves a whole table and updates the table cache with the saved DataFrame.
+
+    Returns: None
+    '''
+    engine = storage_for(table_path)
+
+    # Converts column types the same way a read would so cached and stored tables match
+    table_df = apply_schema_types(normalize_types(table_df), table_schema(table_path))
+    engine.save(table_df, table_path)
+    table_cache.put(table_path, table_df, engine.stamp)
+
+    return None
+
+
+def read_columns(table_path):
+    '''
+    This function reads only the column names of a table.
+
+    Returns: list of column names
+    '''
+    return storage_for(table_path).read_columns(table_path)
+
+
+def table_version(table_path):
+    '''
+    This function gets the version of a table, which is the stamp of all of its files. Every write of the table
+    changes it.
+
+    Returns: stamp or None if the table does not exist
+    '''
+    return storage_for(table_path).stamp(table_path)
+
+
+def append_rows(rows, table_path):
+    '''
+    This function appends rows to the end of a table without reading or rewriting the rest of the table.
+    Rows can be a list of row lists or a DataFrame with the table's columns.
+
+    Returns: None
+    '''
+    engine = storage_for(table_path)
+    old_stamp = engine.stamp(table_path)
+
+    engine.append(rows, table_path)
+    table_cache.append(table_path, rows, old_stamp, engine.stamp)
+
+    return None
+
+
+def replace_table(table_path, new_path):
+    '''
+    This function renames all files of a table to new_path, overwriting the table stored there.
+
+    Returns: None
+    '''
+    engine = storage_for(table_path)
+    for source, destination in zip(engine.files(table_path), engine.files(new_path)):
+        if os.path.isfile(source):
+            os.replace(source, destination)
+        elif os.path.isfile(destination):
+            os.remove(destination)
+
+    table_cache.invalidate(table_path)
+    table_cache.invalidate(new_path)
+
+    return None
+
+
+def sync_table(table_path):
+    '''
+    This function forces all files of a table to disk so they survive a crash.
+
+    Returns: None
+    '''
+    for path in storage_for(table_path).files(table_path):
+        if os.path.isfile(path):
+            fd = os.open(path, os.O_RDWR)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    return None
+
+
+def sync_directory(directory):
+    '''
+    This function forces the file names in a directory to disk so renames survive a crash.
+    Directories cannot be opened on Windows, where renames are left to the operating system.
+
+    Returns: None
+    '''
+    if os.name != 'posix':
+        return None
+
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    return None
+
+
+def remove_table(table_path):
+    '''
+    This function deletes all files of a table.
+
+    Returns: None
+    '''
+    for path in storage_for(table_path).files(table_path):
+        if os.path.isfile(path):
+            os.remove(path)
+
+    table_cache.invalidate(table_path)
+
+    return None
@@ -0,0 +1,306 @@
+'''
+In-process cache of parsed tables.
+Tables are cached by their path (databases/{database}/{table}.csv) so repeated statements
+against the same table do not parse the whole file again.
+'''
+
+import os
+from collections import OrderedDict
+
+import pandas as pd
+
+# Maximum number of bytes of DataFrames held in the cache, can be changed with the SQL_CACHE_BYTES environment variable
+CACHE_MEMORY_BUDGET = int(os.environ.get('SQL_CACHE_BYTES', 256 * 1024 * 1024))
+
+
+def file_stamp(table_path):
+    '''
+    This function gets the modification time, size and inode of a file which is used to check if a cached table is
+    stale. A file replaced by a rename gets a new inode, so it is detected even within the same clock tick.
+
+    Returns: (modification time in ns, size in bytes, inode) or None if the file does not exist
+    '''
+    try:
+        stat = os.stat(table_path)
+    except FileNotFoundError:
+        return None
+
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def normalize_types(table_df):
+    '''
+    This function resets the index and converts column types the same way read_csv would,
+    so a DataFrame built in memory matches the one parsed from the saved file.
+
+    Returns: DataFrame
+    '''
+    table_df = table_df.reset_index(drop=True)
+    for column in table_df.columns:
+        if not pd.api.types.is_numeric_dtype(table_df[column]) and not isinstance(table_df[column].dtype, pd.CategoricalDtype):
+            try:
+                table_df[column] = pd.to_numeric(table_df[column])
+            except (ValueError, TypeError):
+                pass
+
+    return table_df.infer_objects()
+
+
+def read_csv_columns(table_path, columns=None):
+    '''
+    This function reads a CSV table, only parsing the given columns if columns is not None.
+
+    Returns: DataFrame
+    '''
+    return pd.read_csv(table_path, usecols = columns)
+
+
+class Table_Cache:
+    '''
+    Least recently used cache of table DataFrames.
+    Each entry stores the DataFrame, the file stamp it was read with, its size in memory and
+    any rows appended to the file since then which are merged on the next read.
+    An entry can hold only some of the columns of a table if the table was read with a column list.
+    '''
+
+    def __init__(self, memory_budget=CACHE_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.entries = OrderedDict()
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, table_path, loader=read_csv_columns, stamp_function=file_stamp, columns=None, normalize=normalize_types):
+        '''
+        This function returns a copy of the table at table_path. The cached DataFrame is used if the file
+        has not changed since it was read, else the file is read with loader and cached.
+        stamp_function is used for tables stored in more than one file and normalize converts the types of
+        the table after pending rows are merged.
+        If columns is given only those columns are read and returned. If the cached entry for the table does not
+        have all of them, the columns of the entry and the new columns are read together and replace the entry.
+
+        Returns: DataFrame
+        '''
+        key = os.path.normpath(table_path)
+        stamp = stamp_function(table_path)
+        entry = self.entries.get(key)
+        fresh = entry is not None and stamp is not None and entry['stamp'] == stamp
+
+        # Widens the column list to the cached columns so the new entry covers both queries
+        if fresh and entry['columns'] is not None and (columns is None or not set(columns) <= set(entry['columns'])):
+            read_columns = None if columns is None else entry['columns'] + [col for col in columns if col not in entry['columns']]
+            fresh = False
+        else:
+            read_columns = columns
+
+        # Uses cached DataFrame if the file has not been modified
+        if fresh:
+            self.hits += 1
+            self.entries.move_to_end(key)
+
+            # Merges rows appended since the table was cached
+            if entry['pending']:
+                table_df = normalize(pd.concat([entry['table']] + self.pending_frames(entry), ignore_index=True))
+                self.store(key, table_df, stamp, entry['columns'])
+            else:
+                table_df = entry['table']
+
+            if columns is not None:
+                table_df = table_df[columns]
+
+            return table_df.copy()
+
+        self.misses += 1
+
+        # Reads the table again if another process changed it during the read, so a partly written file is never used
+        while True:
+            try:
+                table_df = loader(table_path, read_columns)
+            except (ValueError, OSError):
+                if stamp_function(table_path) == stamp:
+                    raise
+                stamp = stamp_function(table_path)
+                continue
+
+            new_stamp = stamp_function(table_path)
+            if new_stamp == stamp:
+                break
+            stamp = new_stamp
+
+        self.store(key, table_df, stamp, read_columns)
+
+        if columns is not None:
+            table_df = table_df[columns]
+
+        return table_df.copy()
+
+    def put(self, table_path, table_df, stamp_function=file_stamp):
+        '''
+        This function stores a table that was just written to table_path so the next read is a hit.
+
+        Returns: None
+        '''
+        key = os.path.normpath(table_path)
+        self.store(key, table_df, stamp_function(table_path))
+
+        return None
+
+    def append(self, table_path, rows, old_stamp, stamp_function=file_stamp):
+        '''
+        This function records rows that were just appended to table_path. If the cached table matches the file
+        as it was before the append, the rows are kept as pending and merged on the next read, else the entry is dropped.
+
+        Rows can be a list of row lists or a DataFrame.
+
+        Returns: None
+        '''
+        key = os.path.normpath(table_path)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        # Rows have every column so they can only be kept for entries with the whole table
+        if old_stamp is None or entry['stamp'] != old_stamp or entry['columns'] is not None:
+            self.discard(key)
+            return None
+
+        if isinstance(rows, pd.DataFrame):
+            size = int(rows.memory_usage(index=True, deep=True).sum())
+            entry['pending'].append(rows)
+        else:
+            # Estimates the size of the rows as 64 bytes per value until they are merged
+            size = 64 * sum(len(row) for row in rows)
+            entry['pending'].extend(rows)
+
+        entry['stamp'] = stamp_function(table_path)
+        entry['size'] += size
+        self.used_bytes += size
+
+        # Evicts least recently used tables until the cache is within the budget
+        while self.used_bytes > self.memory_budget and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.used_bytes -= evicted['size']
+            self.evictions += 1
+
+        return None
+
+    def pending_frames(self, entry):
+        '''
+        This function turns the pending rows of an entry into DataFrames, keeping the order they were appended in.
+
+        Returns: list of DataFrames
+        '''
+        columns = entry['table'].columns
+        frames = list()
+        rows = list()
+
+        for item in entry['pending']:
+            if isinstance(item, pd.DataFrame):
+                if rows:
+                    frames.append(pd.DataFrame(rows, columns = columns))
+                    rows = list()
+                frames.append(item.set_axis(columns, axis = 1))
+            else:
+                rows.append(item)
+
+        if rows:
+            frames.append(pd.DataFrame(rows, columns = columns))
+
+        return frames
+
+    def store(self, key, table_df, stamp, columns=None):
+        '''
+        This function adds an entry to the cache and evicts the least recently used entries until it fits in the budget.
+        columns is the list of columns the entry holds or None if it holds the whole table.
+
+        Returns: None
+        '''
+        self.discard(key)
+        if stamp is None:
+            return None
+
+        size = int(table_df.memory_usage(index=True, deep=True).sum())
+
+        # Tables larger than the whole budget are never cached
+        if size > self.memory_budget:
+            return None
+
+        self.entries[key] = {'table': table_df, 'stamp': stamp, 'size': size, 'pending': list(),
+                             'columns': None if columns is None else list(table_df.columns)}
+        self.used_bytes += size
+
+        # Evicts least recently used tables until the cache is within the budget
+        while self.used_bytes > self.memory_budget:
+            _, evicted = self.entries.popitem(last=False)
+            self.used_bytes -= evicted['size']
+            self.evictions += 1
+
+        return None
+
+    def discard(self, key):
+        '''
+        This function removes an entry by key if it exists.
+
+        Returns: None
+        '''
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.used_bytes -= entry['size']
+
+        return None
+
+    def invalidate(self, table_path):
+        '''
+        This function removes a table from the cache, used when a file is renamed or deleted.
+
+        Returns: None
+        '''
+        self.discard(os.path.normpath(table_path))
+
+        return None
+
+    def invalidate_directory(self, directory):
+        '''
+        This function removes all tables under a directory from the cache, used when a database is dropped.
+
+        Returns: None
+        '''
+        directory = os.path.normpath(directory) + os.sep
+        for key in [k for k in self.entries if k.startswith(directory)]:
+            self.discard(key)
+
+        return None
+
+    def clear(self):
+        '''
+        This function removes all entries from the cache.
+
+        Returns: None
+        '''
+        self.entries.clear()
+        self.used_bytes = 0
+
+        return None
+
+    def stats(self):
+        '''
+        This function reports the cache counters.
+
+        Returns: dictionary of hits, misses, evictions, entries and bytes used
+        '''
+        lookups = self.hits + self.misses
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'used_bytes': self.used_bytes,
+            'memory_budget': self.memory_budget
+        }
+
+
+# Cache shared by all commands in this process
+table_cache = Table_Cache()
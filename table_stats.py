@@ -0,0 +1,708 @@
+'''
+Table statistics, ANALYZE and the cost model of the planner.
+
+    ANALYZE flights;
+
+ANALYZE reads a table once and saves its number of rows and, for each column, in <table>_stats.json next to the
+schema of the table:
+
+* nulls: the number of missing values,
+* distinct: the number of distinct values, estimated with a HyperLogLog sketch of 2^12 registers (about 1.6% error)
+  which is saved with it so new values can be added to it,
+* min and max: the smallest and largest values,
+* bounds and counts: an equi-depth histogram of the values, SQL_STATS_BUCKETS buckets (32 by default) with about the
+  same number of rows each, built from a random sample of SQL_STATS_SAMPLE_ROWS rows (30000 by default). Bucket i
+  holds the values above bounds[i] up to bounds[i + 1], the first bucket also holding bounds[0].
+
+INSERT and LOAD add their rows to the statistics, and UPDATE and DELETE take the old values out of the histogram and
+the counts and add the new ones. A HyperLogLog sketch cannot forget values, so distinct never exceeds the values
+present, and min and max only widen. Once the rows changed since the last ANALYZE (modified) are more than
+SQL_STATS_REFRESH_FRACTION of the rows (a fifth by default), UPDATE and DELETE, which hold the whole table, compute the
+statistics again, and a commit computes again the statistics of the tables its transaction changed. A column added
+with ALTER TABLE gets statistics with only missing values. Tables that were never analyzed have no statistics and are
+planned like before, and a column without statistics gets a fixed selectivity.
+
+The cost model uses the statistics to estimate the fraction of rows a condition matches (its selectivity) and the
+rows each operator of a plan gives. Looking up a comparison in an index costs SQL_INDEX_ROW_COST (15 by default)
+times the cost of comparing a row in a scan for each row it finds, so a condition matching more than a few percent of
+the rows is scanned instead, and of the comparisons of an AND on indexed columns the one finding the fewest rows is
+looked up. A hash join builds its hash table on the input with fewer rows, known once the inputs are read, and
+EXPLAIN shows the rows it expects from each operator.
+'''
+
+import os
+import json
+import math
+import base64
+
+import numpy as np
+import pandas as pd
+
+from storage import unlock_file
+
+# Number of buckets of the histogram of each column
+STATS_BUCKETS = int(os.environ.get('SQL_STATS_BUCKETS', 32))
+
+# Number of rows sampled to build the histograms
+STATS_SAMPLE_ROWS = int(os.environ.get('SQL_STATS_SAMPLE_ROWS', 30000))
+
+# UPDATE and DELETE compute the statistics again once this fraction of the rows changed since the last ANALYZE
+STATS_REFRESH_FRACTION = float(os.environ.get('SQL_STATS_REFRESH_FRACTION', 0.2))
+
+# Cost of finding one row with an index, and of evaluating one condition on one of the rows it found, relative to
+# comparing one row in a scan
+INDEX_ROW_COST = float(os.environ.get('SQL_INDEX_ROW_COST', 15))
+POSITION_ROW_COST = 8
+
+# Bits of the hash picking the register of the HyperLogLog sketch
+HLL_BITS = 12
+
+# Selectivities used for columns without statistics, as in PostgreSQL
+DEFAULT_EQUAL = 0.005
+DEFAULT_RANGE = 1 / 3
+DEFAULT_LIKE = 0.1
+DEFAULT_NULL = 0.005
+
+# Statistics read from disk by stats path, with the modification time and size of the file
+loaded_stats = dict()
+
+
+def stats_file(table_path):
+    '''
+    This function builds the path of the statistics of a table. Lock files share the statistics of their table.
+
+    Returns: statistics path
+    '''
+    root = os.path.splitext(unlock_file(table_path))[0]
+
+    return f'{root}_stats.json'
+
+
+def load_stats(table_path):
+    '''
+    This function reads the statistics of a table, reusing the ones already read if the file did not change.
+
+    Returns: statistics dictionary or None if the table was never analyzed
+    '''
+    path = stats_file(table_path)
+    try:
+        status = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    stamp = (status.st_mtime_ns, status.st_size)
+    if path in loaded_stats and loaded_stats[path][0] == stamp:
+        return loaded_stats[path][1]
+
+    with open(path, 'r') as f:
+        stats = json.load(f)
+    loaded_stats[path] = (stamp, stats)
+
+    return stats
+
+
+def save_stats(table_path, stats):
+    '''
+    This function saves the statistics of a table, replacing the file at once so readers never see half of it.
+
+    Returns: None
+    '''
+    path = stats_file(table_path)
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(stats, f)
+    os.replace(temporary_path, path)
+
+    return None
+
+
+def drop_stats(table_path, column=None):
+    '''
+    This function deletes the statistics of a table, or only of one column.
+
+    Returns: None
+    '''
+    stats = load_stats(table_path)
+    if stats is None:
+        return None
+
+    if column is None:
+        os.remove(stats_file(table_path))
+        loaded_stats.pop(stats_file(table_path), None)
+    elif column in stats['columns']:
+        stats['columns'].pop(column)
+        save_stats(table_path, stats)
+
+    return None
+
+
+def value_kind(series):
+    '''
+    This function finds if the statistics of a column compare its values as numbers or as strings.
+
+    Returns: 'number' or 'string'
+    '''
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return 'number'
+
+    return 'string'
+
+
+def present_values(series, kind):
+    '''
+    This function gets the values of a column that are not missing, as floats for numbers and strings otherwise,
+    so the same value has the same hash whatever the type of the column it is read from.
+
+    Returns: NumPy array
+    '''
+    series = series[series.notna()]
+    if kind == 'number':
+        return pd.to_numeric(series, errors = 'coerce').dropna().to_numpy(dtype = np.float64)
+
+    return series.astype(str).to_numpy(dtype = object)
+
+
+def hll_add(registers, values):
+    '''
+    This function adds values to a HyperLogLog sketch. The first HLL_BITS bits of the hash of a value pick its
+    register, which keeps the highest position of the first 1 bit in the rest of the hash of its values.
+
+    Returns: None
+    '''
+    if len(values) == 0:
+        return None
+
+    hashes = pd.util.hash_array(values)
+    positions = (hashes >> np.uint64(64 - HLL_BITS)).astype(np.intp)
+
+    # The rest of the hash has 52 bits, which a float holds exactly, so frexp gives its bit length
+    rest = (hashes & np.uint64((1 << (64 - HLL_BITS)) - 1)).astype(np.float64)
+    ranks = (64 - HLL_BITS + 1 - np.frexp(rest)[1]).astype(np.uint8)
+    np.maximum.at(registers, positions, ranks)
+
+    return None
+
+
+def hll_estimate(registers):
+    '''
+    This function estimates the number of distinct values added to a HyperLogLog sketch, counting the empty
+    registers instead when few values were added.
+
+    Returns: int
+    '''
+    size = len(registers)
+    estimate = 0.7213 / (1 + 1.079 / size) * size * size / np.sum(np.exp2(-registers.astype(np.float64)))
+
+    empty = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * size and empty > 0:
+        estimate = size * math.log(size / empty)
+
+    return int(round(estimate))
+
+
+def encode_registers(registers):
+    '''
+    This function writes the registers of a sketch as text for the statistics file.
+
+    Returns: string
+    '''
+    return base64.b64encode(registers.tobytes()).decode('ascii')
+
+
+def decode_registers(text):
+    '''
+    This function reads the registers of a sketch written by encode_registers.
+
+    Returns: uint8 array
+    '''
+    return np.frombuffer(base64.b64decode(text), dtype = np.uint8).copy()
+
+
+def histogram_buckets(bounds, values):
+    '''
+    This function finds the histogram bucket of each value. Values outside the bounds go to the first or last bucket.
+
+    Returns: array of bucket numbers
+    '''
+    return np.clip(np.searchsorted(bounds, values, side = 'left') - 1, 0, len(bounds) - 2)
+
+
+def build_histogram(sample, present, buckets=STATS_BUCKETS):
+    '''
+    This function builds the equi-depth histogram of a column from the sorted values of a sample of its rows, with
+    the counts scaled to the present values of the whole column.
+
+    Returns: (bounds, counts)
+    '''
+    if len(sample) == 0:
+        return list(), list()
+
+    edges = np.linspace(0, len(sample) - 1, min(buckets, len(sample)) + 1).round().astype(int)
+    bounds = pd.unique(sample[edges])
+    if len(bounds) == 1:
+        bounds = np.concatenate((bounds, bounds))
+
+    counts = np.bincount(histogram_buckets(bounds, sample), minlength = len(bounds) - 1) * (present / len(sample))
+
+    return bounds.tolist(), counts.tolist()
+
+
+def column_bounds(column):
+    '''
+    This function gets the histogram bounds of a column as an array its values can be compared with.
+
+    Returns: NumPy array
+    '''
+    return np.array(column['bounds'], dtype = np.float64 if column['kind'] == 'number' else object)
+
+
+def stored_value(value, kind):
+    '''
+    This function converts a value of a column to a value the statistics file can hold.
+
+    Returns: float or string
+    '''
+    return float(value) if kind == 'number' else str(value)
+
+
+def add_values(column, registers, series):
+    '''
+    This function adds the values of a column to its counts of missing values, its smallest and largest values and
+    its HyperLogLog sketch. The values of a categorical column are added once each, from its categories.
+
+    Returns: None
+    '''
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        column['nulls'] += int(np.count_nonzero(codes < 0))
+        values = present_values(pd.Series(series.cat.categories[np.unique(codes[codes >= 0])]), column['kind'])
+    else:
+        values = present_values(series, column['kind'])
+        column['nulls'] += len(series) - len(values)
+
+    hll_add(registers, values)
+    if len(values):
+        low, high = stored_value(values.min(), column['kind']), stored_value(values.max(), column['kind'])
+        column['min'] = low if column['min'] is None else min(column['min'], low)
+        column['max'] = high if column['max'] is None else max(column['max'], high)
+
+    return None
+
+
+def add_to_histogram(column, values, sign):
+    '''
+    This function adds values to the histogram of a column, or takes them out if sign is -1. New values outside the
+    bounds move the first or last bound.
+
+    Returns: None
+    '''
+    if len(values) == 0:
+        return None
+
+    if not column['bounds']:
+        if sign < 0:
+            return None
+        column['bounds'] = [stored_value(values.min(), column['kind']), stored_value(values.max(), column['kind'])]
+        column['counts'] = [0.0]
+
+    bounds = column_bounds(column)
+    if sign > 0:
+        bounds[0], bounds[-1] = min(bounds[0], values.min()), max(bounds[-1], values.max())
+
+    counts = np.array(column['counts']) + sign * np.bincount(histogram_buckets(bounds, values), minlength = len(bounds) - 1)
+    column['bounds'] = [stored_value(bound, column['kind']) for bound in bounds]
+    column['counts'] = np.maximum(counts, 0).tolist()
+
+    return None
+
+
+def table_statistics(chunks, sample_rows=STATS_SAMPLE_ROWS, buckets=STATS_BUCKETS):
+    '''
+    This function computes the statistics of a table from its rows, given as a stream of chunks so a table larger
+    than memory is read once. The rows of the histograms are a random sample: each row gets a random key and the
+    sample_rows rows with the smallest keys are kept.
+
+    Returns: statistics dictionary
+    '''
+    generator = np.random.default_rng(0)
+    rows = 0
+    columns, registers = dict(), dict()
+    sample, sample_keys = None, None
+
+    for chunk in chunks:
+        rows += len(chunk)
+        for name in chunk.columns:
+            if name not in columns:
+                columns[name] = {'kind': value_kind(chunk[name]), 'nulls': 0, 'distinct': 0, 'min': None, 'max': None}
+                registers[name] = np.zeros(1 << HLL_BITS, dtype = np.uint8)
+            add_values(columns[name], registers[name], chunk[name])
+
+        keys = generator.random(len(chunk))
+        if sample is not None:
+            chunk = pd.concat([sample, chunk], ignore_index = True)
+            keys = np.concatenate((sample_keys, keys))
+        if len(chunk) > sample_rows:
+            kept = np.argpartition(keys, sample_rows)[:sample_rows]
+            chunk, keys = chunk.iloc[kept].reset_index(drop = True), keys[kept]
+        sample, sample_keys = chunk, keys
+
+    for name, column in columns.items():
+        present = rows - column['nulls']
+        column['distinct'] = min(hll_estimate(registers[name]), present)
+        column['hll'] = encode_registers(registers[name])
+        column['bounds'], column['counts'] = build_histogram(np.sort(present_values(sample[name], column['kind'])), present, buckets)
+
+    return {'rows': rows, 'modified': 0, 'columns': columns}
+
+
+def analyze_table(table_path, chunks):
+    '''
+    This function computes the statistics of a table from its rows and saves them.
+
+    Returns: statistics dictionary
+    '''
+    stats = table_statistics(chunks)
+    save_stats(table_path, stats)
+
+    return stats
+
+
+def changed_stats(table_path):
+    '''
+    This function reads the statistics of a table to change them, without sharing them with the planner until
+    they are saved.
+
+    Returns: statistics dictionary or None if the table was never analyzed
+    '''
+    if not os.path.isfile(stats_file(table_path)):
+        return None
+
+    with open(stats_file(table_path), 'r') as f:
+        return json.load(f)
+
+
+def save_changed_stats(table_path, stats, table_df=None):
+    '''
+    This function saves statistics changed by a command, or computes them again from table_df, the whole table
+    after the command, once the rows changed since the last ANALYZE are more than STATS_REFRESH_FRACTION of them.
+
+    Returns: None
+    '''
+    if table_df is not None and stats['modified'] > STATS_REFRESH_FRACTION * max(stats['rows'], 1):
+        analyze_table(table_path, [table_df])
+    else:
+        save_stats(table_path, stats)
+
+    return None
+
+
+def append_stats_rows(table_path, rows, columns):
+    '''
+    This function adds rows appended to a table to its statistics. Rows can be a list of row lists or a DataFrame,
+    with the table's columns.
+
+    Returns: None
+    '''
+    stats = changed_stats(table_path)
+    if stats is None or len(rows) == 0:
+        return None
+
+    rows_df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows, columns = columns)
+    stats['rows'] += len(rows_df)
+    stats['modified'] += len(rows_df)
+
+    for name, column in stats['columns'].items():
+        if name not in rows_df.columns:
+            continue
+        registers = decode_registers(column['hll'])
+        add_values(column, registers, rows_df[name])
+        add_to_histogram(column, present_values(rows_df[name], column['kind']), 1)
+        column['hll'] = encode_registers(registers)
+        column['distinct'] = min(hll_estimate(registers), stats['rows'] - column['nulls'])
+
+    save_changed_stats(table_path, stats)
+
+    return None
+
+
+def delete_stats_rows(table_path, deleted_df, table_df):
+    '''
+    This function takes deleted rows out of the statistics of a table. deleted_df is None if every row was deleted,
+    and table_df is the table left.
+
+    Returns: None
+    '''
+    stats = changed_stats(table_path)
+    if stats is None:
+        return None
+
+    if deleted_df is None:
+        analyze_table(table_path, [table_df])
+        return None
+
+    stats['rows'] -= len(deleted_df)
+    stats['modified'] += len(deleted_df)
+
+    for name, column in stats['columns'].items():
+        if name not in deleted_df.columns:
+            continue
+        values = present_values(deleted_df[name], column['kind'])
+        column['nulls'] -= len(deleted_df) - len(values)
+        add_to_histogram(column, values, -1)
+        column['distinct'] = min(column['distinct'], stats['rows'] - column['nulls'])
+
+    save_changed_stats(table_path, stats, table_df)
+
+    return None
+
+
+def update_stats_rows(table_path, old_values, column_name, value, table_df):
+    '''
+    This function changes the statistics of a table after the rows whose old values of column_name are old_values
+    had it set to value. table_df is the table after the update.
+
+    Returns: None
+    '''
+    stats = changed_stats(table_path)
+    if stats is None:
+        return None
+
+    stats['modified'] += len(old_values)
+
+    column = stats['columns'].get(column_name)
+    if column is not None and len(old_values):
+        old = present_values(old_values, column['kind'])
+        column['nulls'] -= len(old_values) - len(old)
+        add_to_histogram(column, old, -1)
+
+        new_values = pd.Series([value] * len(old_values), dtype = object)
+        registers = decode_registers(column['hll'])
+        add_values(column, registers, new_values)
+        add_to_histogram(column, present_values(new_values, column['kind']), 1)
+        column['hll'] = encode_registers(registers)
+        column['distinct'] = min(hll_estimate(registers), stats['rows'] - column['nulls'])
+
+    save_changed_stats(table_path, stats, table_df)
+
+    return None
+
+
+def add_stats_column(table_path, column_name, kind):
+    '''
+    This function adds a column added to a table, which has no values yet, to the statistics of the table.
+
+    Returns: None
+    '''
+    stats = changed_stats(table_path)
+    if stats is None or column_name in stats['columns']:
+        return None
+
+    stats['columns'][column_name] = {'kind': kind, 'nulls': stats['rows'], 'distinct': 0, 'min': None, 'max': None,
+                                     'hll': encode_registers(np.zeros(1 << HLL_BITS, dtype = np.uint8)),
+                                     'bounds': list(), 'counts': list()}
+    save_stats(table_path, stats)
+
+    return None
+
+
+def refresh_stats(table_path, table_df):
+    '''
+    This function computes again the statistics of a table from the whole table, if the table was analyzed.
+
+    Returns: None
+    '''
+    if os.path.isfile(stats_file(table_path)):
+        analyze_table(table_path, [table_df])
+
+    return None
+
+
+def column_map(stats, alias=None):
+    '''
+    This function maps the names of the columns of a table, with the alias as prefix for a join, to their
+    statistics and the rows of the table, the form the estimates take so they can mix columns of two tables.
+
+    Returns: dictionary of column name to (column statistics, rows), or None without statistics
+    '''
+    if stats is None:
+        return None
+
+    prefix = '' if alias is None else f'{alias}.'
+
+    return {f'{prefix}{name}': (column, stats['rows']) for name, column in stats['columns'].items()}
+
+
+def comparable(column, value):
+    '''
+    This function checks that a value is compared with a column of the same kind, numbers with numbers and strings
+    with strings.
+
+    Returns: bool
+    '''
+    is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    return is_number == (column['kind'] == 'number')
+
+
+def present_fraction(column, rows):
+    '''
+    This function gets the fraction of the rows of a table whose value of a column is not missing.
+
+    Returns: float
+    '''
+    return (rows - column['nulls']) / rows if rows > 0 else 0.0
+
+
+def below_fraction(column, value):
+    '''
+    This function estimates the fraction of the present values of a column that are smaller than value from its
+    histogram. Within a bucket numbers are assumed spread evenly, and strings are in its middle.
+
+    Returns: float
+    '''
+    bounds = column_bounds(column)
+    counts = np.array(column['counts'])
+    total = counts.sum()
+    if len(bounds) == 0 or total <= 0 or value <= bounds[0]:
+        return 0.0
+    if value > bounds[-1]:
+        return 1.0
+
+    bucket = int(histogram_buckets(bounds, [value])[0])
+    low, high = bounds[bucket], bounds[bucket + 1]
+    part = (value - low) / (high - low) if column['kind'] == 'number' and high > low else 0.5
+
+    return float((counts[:bucket].sum() + counts[bucket] * part) / total)
+
+
+def comparison_fraction(column, rows, comparison, value):
+    '''
+    This function estimates the fraction of the rows of a table where column comparison value is true.
+
+    Returns: float
+    '''
+    if column is None or rows == 0 or not comparable(column, value):
+        return {'=': DEFAULT_EQUAL, '!=': 1 - DEFAULT_EQUAL}.get(comparison, DEFAULT_RANGE)
+
+    if column['min'] is None or value < column['min'] or value > column['max']:
+        equal = 0.0
+    else:
+        equal = 1 / max(column['distinct'], 1)
+    below = below_fraction(column, value)
+
+    fraction = {'=': equal, '!=': 1 - equal, '<': below, '<=': below + equal, '>': 1 - below - equal,
+                '>=': 1 - below}[comparison]
+
+    return min(max(fraction, 0.0), 1.0) * present_fraction(column, rows)
+
+
+def selectivity(condition, columns):
+    '''
+    This function estimates the fraction of the rows a compiled condition (see compile_condition) matches. columns
+    comes from column_map, and columns without statistics use the default selectivities.
+
+    Returns: float between 0 and 1
+    '''
+    kind = condition[0]
+
+    if kind == 'constant':
+        return 1.0 if condition[1] else 0.0
+    if kind == 'and':
+        return float(np.prod([selectivity(child, columns) for child in condition[1:]]))
+    if kind == 'or':
+        return 1 - float(np.prod([1 - selectivity(child, columns) for child in condition[1:]]))
+
+    column, rows = columns.get(condition[1], (None, 0))
+
+    if kind == 'compare':
+        return comparison_fraction(column, rows, condition[2], condition[3])
+
+    if kind == 'columns':
+        other = columns.get(condition[3], (None, 0))[0]
+        if condition[2] != '=':
+            return DEFAULT_RANGE
+        if column is None or other is None:
+            return DEFAULT_EQUAL
+        return 1 / max(column['distinct'], other['distinct'], 1)
+
+    present = 1.0 if column is None else present_fraction(column, rows)
+
+    if kind == 'in':
+        matched = min(sum(comparison_fraction(column, rows, '=', value) for value in set(condition[2])), present)
+        return present - matched if condition[3] else matched
+
+    if kind == 'null':
+        missing = DEFAULT_NULL if column is None else 1 - present
+        return 1 - missing if condition[2] else missing
+
+    # LIKE
+    return present * ((1 - DEFAULT_LIKE) if condition[3] else DEFAULT_LIKE)
+
+
+def estimate_rows(condition, columns, rows):
+    '''
+    This function estimates the rows out of rows that a compiled condition matches.
+
+    Returns: int
+    '''
+    return int(round(rows * selectivity(condition, columns)))
+
+
+def order_lookups(comparisons, conditions, columns, rows):
+    '''
+    This function is the cost model for index lookups. comparisons are the comparisons of a condition that an index
+    can look up and conditions the number of conditions of the AND they come from, all evaluated on every row by a
+    scan. A lookup costs INDEX_ROW_COST for each row it finds and POSITION_ROW_COST for each other condition
+    evaluated on it, and comparing one row in a scan costs 1.
+
+    Returns: positions in comparisons of the lookups costing less than a scan, cheapest first
+    '''
+    scan_cost = rows * conditions
+    costs = [estimate_rows(comparison, columns, rows) * (INDEX_ROW_COST + (conditions - 1) * POSITION_ROW_COST)
+             for comparison in comparisons]
+
+    return [i for i in sorted(range(len(comparisons)), key = lambda i: costs[i]) if costs[i] < scan_cost]
+
+
+def column_distinct(columns, name, rows):
+    '''
+    This function estimates the distinct values of a column among rows rows of its table.
+
+    Returns: int or None if the column has no statistics
+    '''
+    column = columns.get(name, (None, 0))[0] if columns is not None else None
+    if column is None or rows is None:
+        return None
+
+    return max(min(column['distinct'], rows), 1)
+
+
+def join_rows(left_rows, right_rows, left_distinct, right_distinct, how):
+    '''
+    This function estimates the rows of an equi-join. Each key of the side with fewer distinct keys is expected
+    to match the rows of one key of the other side. LEFT, RIGHT and OUTER joins keep at least the rows of their
+    outer sides.
+
+    Returns: int
+    '''
+    if how == 'cross':
+        return left_rows * right_rows
+
+    matched = left_rows * right_rows / max(left_distinct or 1, right_distinct or 1, 1)
+    outer = {'left': (left_rows,), 'right': (right_rows,), 'outer': (left_rows, right_rows),
+             'full': (left_rows, right_rows)}.get(how, ())
+
+    return int(round(max((matched,) + outer)))
+
+
+def group_rows(rows, distincts):
+    '''
+    This function estimates the groups of GROUP BY on columns with distincts distinct values, at most one group
+    per row. A query without GROUP BY gives one row.
+
+    Returns: int
+    '''
+    if not distincts:
+        return 1
+
+    return int(min(np.prod([float(distinct) for distinct in distincts]), max(rows, 1)))
@@ -0,0 +1,521 @@
+'''
+Write-ahead log of transactions, stored as databases/wal.log and shared by every process using the databases directory.
+Each record is one line of JSON:
+
+* {"type": "log", "id": ...} starts the log, a new id means the log was checkpointed and must be read from the start
+* {"type": "begin", "pid": ..., "session": ...} starts a transaction whose id is the byte offset of this record, session
+  is the server session that began it and is left out for transactions of the command line
+* {"type": "write", "txn": ..., "table": ...} records the lock file a transaction writes a table to
+* {"type": "commit", "txn": ..., "tables": [...]} commits a transaction, the lock files replace their tables after it
+* {"type": "end", "txn": ...} marks that the lock files of a committed transaction replaced their tables
+* {"type": "abort", "txn": ...} ends a transaction without changing its tables
+
+Only commit records are forced to disk. Each commit waits for one fsync of the whole log, and commits that arrive while
+an fsync is running share the next one (group commit). Recovery at startup replaces the tables of committed transactions
+that were not finished and aborts the transactions of processes that no longer exist. The log is emptied (checkpointed)
+at startup and whenever a commit or abort leaves no transaction open or unfinished.
+
+The exclusive lock of the log file is also the write lock of the databases directory. Commits hold it while they check
+for conflicts and append their commit record, and commands outside a transaction hold it while they change a table.
+'''
+
+import os
+import json
+import time
+import uuid
+import threading
+
+from storage import replace_table, remove_table, sync_table, sync_directory, unlock_file
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+WAL_FILE = 'wal.log'
+
+# Time the first commit of a group waits for more commits before forcing the log to disk
+GROUP_COMMIT_SECONDS = float(os.environ.get('SQL_GROUP_COMMIT_MS', 0)) / 1000
+
+
+def process_alive(pid):
+    '''
+    This function checks if a process is still running. On systems without POSIX signals every process is assumed alive.
+
+    Returns: bool
+    '''
+    if os.name != 'posix':
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+class Write_Ahead_Log:
+    '''
+    Append-only log of transaction records. The state of all transactions is rebuilt from the records, reading only
+    the records appended since the last read. active maps the id of each open transaction to its process id and the
+    lock files it wrote, committed maps the id of each committed transaction that is not finished to its lock files
+    and owners maps the id of each transaction that is open or not finished to its process id.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, WAL_FILE)
+        self.fd = None
+        self.log_id = None
+        self.offset = 0
+        self.active = dict()
+        self.committed = dict()
+        self.owners = dict()
+        self.lock = threading.RLock()
+        self.sync_condition = threading.Condition()
+        self.synced_offset = 0
+        self.syncing = False
+        self.fsyncs = 0
+        self.exclusive = False
+
+    def open(self):
+        '''
+        This function opens the log file, creating it with a header if it does not exist, and runs recovery.
+
+        Returns: None
+        '''
+        if self.fd is not None:
+            return None
+
+        os.makedirs(self.directory, exist_ok = True)
+        self.fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self.recover()
+
+        return None
+
+    def file_lock(self, exclusive=False):
+        '''
+        This function locks the log file between processes. Appends share the lock and recovery holds it alone.
+        Appends made by recovery keep the exclusive lock.
+
+        Returns: None
+        '''
+        if fcntl is not None and not self.exclusive:
+            fcntl.flock(self.fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        self.exclusive = self.exclusive or exclusive
+
+        return None
+
+    def file_unlock(self, exclusive=False):
+        '''
+        This function releases the lock taken by file_lock.
+
+        Returns: None
+        '''
+        if self.exclusive and not exclusive:
+            return None
+
+        self.exclusive = False
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+        return None
+
+    def append(self, record):
+        '''
+        This function appends one record to the end of the log with a single write so records from different
+        processes are never mixed. The record is not forced to disk.
+
+        Returns: (offset of the record, offset of the end of the record)
+        '''
+        line = (json.dumps(record) + '\n').encode()
+
+        with self.lock:
+            self.file_lock()
+            try:
+                os.write(self.fd, line)
+                end = os.lseek(self.fd, 0, os.SEEK_CUR)
+            finally:
+                self.file_unlock()
+
+        return end - len(line), end
+
+    def sync(self, offset):
+        '''
+        This function waits until the log is on disk up to offset. The first caller forces everything written so far to
+        disk, later callers wait for it and only force the log again if their record was written after it started.
+
+        Returns: None
+        '''
+        with self.sync_condition:
+            while self.synced_offset < offset:
+                if not self.syncing:
+                    self.syncing = True
+                    break
+                self.sync_condition.wait()
+            else:
+                return None
+
+        synced = self.synced_offset
+        try:
+            if GROUP_COMMIT_SECONDS > 0:
+                time.sleep(GROUP_COMMIT_SECONDS)
+            end = os.fstat(self.fd).st_size
+            os.fsync(self.fd)
+            synced = end
+        finally:
+            with self.sync_condition:
+                self.synced_offset = max(self.synced_offset, synced)
+                self.syncing = False
+                self.fsyncs += 1
+                self.sync_condition.notify_all()
+
+        return None
+
+    def refresh(self):
+        '''
+        This function reads the records appended since the last read, by this process or any other, and updates the
+        state of the transactions. Only whole lines are read so a record being written is read next time.
+
+        Returns: None
+        '''
+        with self.lock, open(self.path, 'rb') as f:
+            # Reads the log from the start if it was checkpointed since the last read
+            header = f.readline()
+            if not header.endswith(b'\n') or self.log_id != json.loads(header).get('id') or os.fstat(f.fileno()).st_size < self.offset:
+                self.offset = 0
+                self.log_id = None
+                self.active = dict()
+                self.committed = dict()
+                self.owners = dict()
+
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                self.apply(json.loads(line), self.offset)
+                self.offset += len(line)
+
+        return None
+
+    def apply(self, record, offset):
+        '''
+        This function updates the state of the transactions with one record.
+
+        Returns: None
+        '''
+        record_type = record['type']
+
+        if record_type == 'log':
+            self.log_id = record['id']
+        elif record_type == 'begin':
+            self.active[offset] = {'pid': record['pid'], 'session': record.get('session'), 'tables': list()}
+            self.owners[offset] = record['pid']
+        elif record_type == 'write' and record['txn'] in self.active:
+            if record['table'] not in self.active[record['txn']]['tables']:
+                self.active[record['txn']]['tables'].append(record['table'])
+        elif record_type == 'commit':
+            self.active.pop(record['txn'], None)
+            self.committed[record['txn']] = record['tables']
+        elif record_type == 'end':
+            self.committed.pop(record['txn'], None)
+            self.owners.pop(record['txn'], None)
+        elif record_type == 'abort':
+            self.active.pop(record['txn'], None)
+            self.committed.pop(record['txn'], None)
+            self.owners.pop(record['txn'], None)
+
+        return None
+
+    def begin(self, session=None):
+        '''
+        This function starts a new transaction of this process, belonging to a server session if session is not None.
+
+        Returns: transaction id
+        '''
+        self.open()
+        record = {'type': 'begin', 'pid': os.getpid()}
+        if session is not None:
+            record['session'] = session
+        txn = self.append(record)[0]
+        self.refresh()
+
+        return txn
+
+    def latest(self, session=None):
+        '''
+        This function finds the most recently started transaction of this process and server session that is still
+        open. The log is not read again because every record of this process's transactions was read when it was
+        appended.
+
+        Returns: transaction id or None
+        '''
+        self.open()
+        own = [txn for txn, details in self.active.items() if details['pid'] == os.getpid() and details.get('session') == session]
+
+        return max(own) if own else None
+
+    def tables(self, txn):
+        '''
+        This function lists the lock files a transaction has written.
+
+        Returns: list of lock file paths
+        '''
+        return list(self.active[txn]['tables'])
+
+    def record_write(self, txn, lock_path):
+        '''
+        This function records that a transaction writes a table to its lock file. It must be called before the lock
+        file is written so recovery can remove the file if the transaction never commits.
+
+        Returns: None
+        '''
+        if lock_path not in self.active[txn]['tables']:
+            self.append({'type': 'write', 'txn': txn, 'table': lock_path})
+            self.refresh()
+
+        return None
+
+    def commit(self, txn):
+        '''
+        This function commits a transaction. The lock files are forced to disk, then the commit record, and only
+        then do the lock files replace their tables, so after a crash recovery can always finish the commit.
+
+        Returns: None
+        '''
+        self.finish_commit(txn, self.append_commit(txn))
+
+        return None
+
+    def append_commit(self, txn):
+        '''
+        This function forces the lock files of a transaction to disk and appends its commit record. From then on the
+        transaction is committed for every process, even before the record is on disk and its tables are replaced.
+        It is called while holding the write lock so no other commit can check the same tables in between.
+
+        Returns: offset of the end of the commit record
+        '''
+        lock_paths = self.tables(txn)
+        for lock_path in lock_paths:
+            sync_table(lock_path)
+
+        end = self.append({'type': 'commit', 'txn': txn, 'tables': lock_paths})[1]
+        self.refresh()
+
+        return end
+
+    def finish_commit(self, txn, end):
+        '''
+        This function waits for the commit record to be on disk, sharing the fsync with other commits, then replaces
+        the tables with the lock files. It is called after releasing the write lock.
+
+        Returns: None
+        '''
+        self.sync(end)
+        self.apply_commit(txn, self.committed.get(txn, list()))
+
+        return None
+
+    def pending_tables(self):
+        '''
+        This function lists the lock files of committed transactions that have not replaced their tables yet.
+
+        Returns: set of lock file paths
+        '''
+        return {lock_path for lock_paths in self.committed.values() for lock_path in lock_paths}
+
+    def lock_writes(self, lock_paths=None):
+        '''
+        This function takes the write lock of the databases directory for this thread and reads the new records.
+        It also waits until the committed transactions that write any of lock_paths, or any committed transaction
+        if lock_paths is None, have replaced their tables, so those table files are current. Commits of processes
+        that no longer exist are finished here.
+
+        Returns: None
+        '''
+        self.open()
+
+        while True:
+            self.lock.acquire()
+            self.file_lock(exclusive = True)
+            self.refresh()
+
+            for txn, paths in list(self.committed.items()):
+                if not process_alive(self.owners.get(txn, -1)):
+                    self.apply_commit(txn, paths)
+
+            pending = self.pending_tables()
+            if not pending or (lock_paths is not None and pending.isdisjoint(lock_paths)):
+                return None
+
+            # Lets the committing processes finish while waiting
+            self.unlock_writes()
+            time.sleep(0.001)
+
+    def unlock_writes(self):
+        '''
+        This function releases the write lock taken by lock_writes.
+
+        Returns: None
+        '''
+        self.file_unlock(exclusive = True)
+        self.lock.release()
+
+        return None
+
+    def apply_commit(self, txn, lock_paths):
+        '''
+        This function replaces each table with its lock file and marks the commit as finished.
+        Lock files that no longer exist were already renamed before a crash.
+
+        Returns: None
+        '''
+        for lock_path in lock_paths:
+            # Skips lock files another process already renamed while finishing the same commit
+            if not os.path.isfile(lock_path):
+                continue
+            try:
+                replace_table(lock_path, unlock_file(lock_path))
+            except FileNotFoundError:
+                continue
+            sync_directory(os.path.dirname(lock_path))
+
+        self.append({'type': 'end', 'txn': txn})
+        self.refresh()
+        self.checkpoint_idle()
+
+        return None
+
+    def abort(self, txn, lock_paths=None):
+        '''
+        This function ends a transaction without committing it and removes its lock files.
+
+        Returns: None
+        '''
+        for lock_path in lock_paths or list():
+            if os.path.isfile(lock_path):
+                remove_table(lock_path)
+
+        self.append({'type': 'abort', 'txn': txn})
+        self.refresh()
+        self.checkpoint_idle()
+
+        return None
+
+    def recover(self):
+        '''
+        This function finishes the commits that were interrupted by a crash and aborts the open transactions of
+        processes that are no longer running. If no transaction is left the log is emptied (checkpointed).
+
+        Returns: None
+        '''
+        self.file_lock(exclusive = True)
+        try:
+            # Removes a record that was only partly written when a process crashed
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            if data and not data.endswith(b'\n'):
+                os.truncate(self.path, data.rfind(b'\n') + 1)
+
+            if os.fstat(self.fd).st_size == 0:
+                self.checkpoint()
+            self.refresh()
+
+            # Commits of running processes are finished by those processes
+            for txn, lock_paths in list(self.committed.items()):
+                if self.owners.get(txn) == os.getpid() or not process_alive(self.owners.get(txn, -1)):
+                    self.apply_commit(txn, lock_paths)
+
+            for txn, details in list(self.active.items()):
+                if details['pid'] == os.getpid() or not process_alive(details['pid']):
+                    self.abort(txn, details['tables'])
+
+            if not self.active and not self.committed:
+                self.checkpoint()
+                self.refresh()
+        finally:
+            self.file_unlock(exclusive = True)
+
+        return None
+
+    def checkpoint(self):
+        '''
+        This function empties the log and writes a header with a new log id. It is only called while holding the
+        exclusive lock and when no transaction is open or unfinished.
+
+        Returns: None
+        '''
+        os.ftruncate(self.fd, 0)
+        os.write(self.fd, (json.dumps({'type': 'log', 'id': uuid.uuid4().hex}) + '\n').encode())
+        os.fsync(self.fd)
+        self.synced_offset = 0
+
+        return None
+
+    def checkpoint_idle(self):
+        '''
+        This function empties the log once no transaction is open or unfinished, so the log of a long running process,
+        such as the server, does not grow with every transaction. It takes the exclusive lock without waiting, and
+        leaves the log for a later commit or abort if another process holds the lock.
+
+        Returns: None
+        '''
+        if self.active or self.committed:
+            return None
+
+        with self.lock:
+            # Recovery and the write lock already hold the exclusive lock
+            locked = not self.exclusive
+            if locked and fcntl is not None:
+                try:
+                    fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return None
+
+            try:
+                # Reads the records appended before the lock was taken, which may have begun transactions
+                self.refresh()
+                if not self.active and not self.committed:
+                    self.checkpoint()
+                    self.refresh()
+            finally:
+                if locked and fcntl is not None:
+                    fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+        return None
+
+    def stats(self):
+        '''
+        This function reports the log counters.
+
+        Returns: dictionary of open transactions, log size and fsync count
+        '''
+        self.open()
+        self.refresh()
+
+        return {
+            'active_transactions': len(self.active),
+            'log_bytes': self.offset,
+            'fsyncs': self.fsyncs
+        }
+
+
+# Logs opened in this process by databases directory
+transaction_logs = dict()
+
+
+def transaction_log(directory):
+    '''
+    This function gets the write-ahead log of a databases directory. The log is opened and recovered the first
+    time it is used.
+
+    Returns: Write_Ahead_Log
+    '''
+    key = os.path.abspath(directory)
+    if key not in transaction_logs:
+        transaction_logs[key] = Write_Ahead_Log(directory)
+
+    return transaction_logs[key]
@@ -0,0 +1,267 @@
+'''
+In-memory workspaces of the transactions opened by this process, which give each transaction a snapshot of its tables.
+The first time a transaction reads a table, the whole table is read into the transaction's workspace together with
+the version of the table files (their stamp). Every later statement of the transaction reads that snapshot, so it sees
+the same rows however other processes change the table, and statements that modify the table change the snapshot,
+so the transaction sees its own changes. Nothing is written until COMMIT, which writes each modified table to its
+lock file once before the write-ahead log renames it over the table.
+
+Rows a transaction changes are locked in lock_manager.py, so other transactions can change other rows of the same
+table at the same time. If another transaction committed a change to a table after this transaction read it, COMMIT
+applies this transaction's changes to the committed table instead of overwriting it: every row of the snapshot is
+identified by the hash of its values when it was read (its key), updated and deleted rows replace or remove the
+committed row with the same key and new rows are added at the end. If the committed table no longer has one of those
+rows or its columns changed, another transaction changed it without a lock and the transaction is aborted.
+'''
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from errors import Invalid_Command
+from storage import read_table, write_table, lock_file, table_schema, table_version
+from schema import apply_schema_types
+from table_cache import normalize_types
+from indexes import check_unique_table
+from lock_manager import row_keys
+
+
+class Transaction_Workspace:
+    '''
+    Tables read by one transaction. snapshots maps the path of each table to the version it was read at and its
+    DataFrame, and tables holds the paths of the tables the transaction modified. For a modified table, origins
+    holds the row of the original snapshot each row comes from (-1 for new rows) and base_keys the keys of the rows
+    of the original snapshot.
+    '''
+
+    def __init__(self, log, txn):
+        self.log = log
+        self.txn = txn
+        self.owner = f'{os.getpid()}:{txn}'
+        self.snapshots = dict()
+        self.tables = set()
+        self.origins = dict()
+        self.base_keys = dict()
+
+    def holds(self, table_path):
+        '''
+        This function checks if the transaction has modified a table.
+
+        Returns: bool
+        '''
+        return table_path in self.tables
+
+    def current(self, table_path):
+        '''
+        This function checks if the snapshot of a table is still the committed version of the table, so the
+        indexes of the table match it.
+
+        Returns: bool
+        '''
+        if table_path not in self.snapshots:
+            return True
+
+        return not self.holds(table_path) and self.snapshots[table_path][0] == table_version(table_path)
+
+    def read(self, table_path, columns=None):
+        '''
+        This function returns a copy of the snapshot of a table, with only the given columns if columns is not None.
+        The first read of a table reads every column so later statements can use any of them.
+
+        Returns: DataFrame
+        '''
+        if table_path not in self.snapshots:
+            # Reads the table again if it was replaced between getting its version and reading it
+            version = table_version(table_path)
+            while True:
+                table_df = read_table(table_path)
+                new_version = table_version(table_path)
+                if new_version == version:
+                    break
+                version = new_version
+            self.snapshots[table_path] = (version, table_df)
+
+        table_df = self.snapshots[table_path][1]
+        if columns is not None:
+            table_df = table_df[[column for column in table_df.columns if column in columns]]
+
+        return table_df.copy()
+
+    def columns(self, table_path):
+        '''
+        This function gets the column names of the snapshot of a table.
+
+        Returns: list of column names
+        '''
+        return list(self.snapshots[table_path][1].columns)
+
+    def put(self, table_path, table_df):
+        '''
+        This function stores the modified table in its snapshot. The first time a table is modified its lock file
+        is recorded in the write-ahead log so recovery removes it if the transaction never commits.
+
+        Returns: None
+        '''
+        if table_path not in self.tables:
+            self.log.record_write(self.txn, lock_file(table_path))
+            self.keys(table_path)
+            self.origins[table_path] = np.arange(len(self.snapshots[table_path][1]))
+            self.tables.add(table_path)
+
+        # Rows keep the row number they were read with, rows past the end of the last version are new
+        origins = self.origins[table_path]
+        labels = table_df.index.to_numpy()
+        self.origins[table_path] = np.where(labels < len(origins), origins[np.minimum(labels, len(origins) - 1)], -1) if len(origins) else np.full(len(labels), -1)
+
+        # Converts column types and numbers the rows the same way a read of the saved table would
+        table_df = apply_schema_types(normalize_types(table_df.reset_index(drop = True)), table_schema(table_path))
+        self.snapshots[table_path] = (self.snapshots[table_path][0], table_df)
+
+        return None
+
+    def keys(self, table_path):
+        '''
+        This function gets the keys of the rows of the original snapshot of a table, hashing them the first time.
+        It must be called before the table is first modified.
+
+        Returns: array of row keys
+        '''
+        if table_path not in self.base_keys:
+            self.base_keys[table_path] = row_keys(self.snapshots[table_path][1])
+
+        return self.base_keys[table_path]
+
+    def lock_keys(self, table_path, positions):
+        '''
+        This function gets the keys that lock rows of the snapshot, given by position. New rows of the transaction
+        need no lock and are left out.
+
+        Returns: array of row keys
+        '''
+        keys = self.keys(table_path)
+        if table_path not in self.origins:
+            return keys[positions]
+
+        origins = self.origins[table_path][positions]
+
+        return keys[origins[origins >= 0]]
+
+    def merge(self, table_path):
+        '''
+        This function applies the changes of the transaction to a table that another transaction changed after it
+        was read. The rows the transaction updated or deleted are found in the committed table by their keys.
+
+        Returns: DataFrame, raises Invalid_Command if the committed table no longer matches the changes
+        '''
+        table_name = os.path.splitext(os.path.basename(table_path))[0]
+        conflict = Invalid_Command(f'Table {table_name} was changed by another transaction. Transaction aborted.\n')
+
+        table_df = self.snapshots[table_path][1]
+        origins = self.origins[table_path]
+        base_keys = self.base_keys[table_path]
+
+        if table_version(table_path) is None:
+            raise conflict
+
+        current_df = read_table(table_path)
+        if list(current_df.columns) != list(table_df.columns):
+            raise conflict
+
+        # Finds the deleted rows and the rows whose values changed
+        kept = origins >= 0
+        deleted = np.setdiff1d(np.arange(len(base_keys)), origins[kept])
+        updated = np.flatnonzero(kept & (row_keys(table_df) != base_keys[np.where(kept, origins, 0)]))
+        added = np.flatnonzero(~kept)
+
+        # Finds a committed row for each changed row by its key, each committed row is used once
+        current_keys = row_keys(current_df)
+        needed = np.concatenate((base_keys[deleted], base_keys[origins[updated]]))
+        candidates = dict()
+        for position in np.flatnonzero(np.isin(current_keys, needed)):
+            candidates.setdefault(current_keys[position], list()).append(position)
+
+        def take(key):
+            if not candidates.get(key):
+                raise conflict
+            return candidates[key].pop(0)
+
+        deleted_positions = [take(key) for key in base_keys[deleted]]
+        updated_positions = [take(key) for key in base_keys[origins[updated]]]
+
+        # Picks each row from the committed table or the transaction's table
+        order = np.arange(len(current_df))
+        order[updated_positions] = len(current_df) + updated
+        order = np.delete(order, deleted_positions)
+        order = np.concatenate((order, len(current_df) + added))
+
+        merged_df = pd.concat([current_df, table_df], ignore_index = True).take(order).reset_index(drop = True)
+        check_unique_table(table_path, merged_df)
+
+        return merged_df
+
+    def flush(self):
+        '''
+        This function writes every modified table to its lock file, one write per table.
+
+        Returns: None
+        '''
+        for table_path in self.tables:
+            write_table(self.snapshots[table_path][1], lock_file(table_path))
+
+        return None
+
+    def commit(self):
+        '''
+        This function commits the transaction. Changes to tables that were committed by another transaction since
+        they were read are merged, then the lock files are written and the commit record is appended, all under the
+        write lock. The commit then waits for the log to be on disk without holding it.
+
+        Returns: None, raises Invalid_Command and aborts the transaction if the changes cannot be merged
+        '''
+        self.log.lock_writes({lock_file(table_path) for table_path in self.tables})
+        try:
+            for table_path in sorted(self.tables):
+                if table_version(table_path) != self.snapshots[table_path][0]:
+                    try:
+                        merged_df = self.merge(table_path)
+                    except Invalid_Command:
+                        self.log.abort(self.txn)
+                        raise
+                    self.snapshots[table_path] = (table_version(table_path), merged_df)
+
+            self.flush()
+            end = self.log.append_commit(self.txn)
+        finally:
+            self.log.unlock_writes()
+
+        self.log.finish_commit(self.txn, end)
+
+        return None
+
+
+# Workspaces of the open transactions of this process by transaction id
+workspaces = dict()
+
+
+def transaction_workspace(log, txn):
+    '''
+    This function gets the workspace of a transaction, creating an empty one the first time.
+
+    Returns: Transaction_Workspace
+    '''
+    if txn not in workspaces:
+        workspaces[txn] = Transaction_Workspace(log, txn)
+
+    return workspaces[txn]
+
+
+def discard_workspace(txn):
+    '''
+    This function forgets the workspace of a transaction after it is committed or rolled back.
+
+    Returns: None
+    '''
+    workspaces.pop(txn, None)
+
+    return None